@@ -0,0 +1,234 @@
+"""
+Heatmaps of many MSE trials added together, e.g. every S08 trial or every trial in the RVL volume, and difference maps
+between two such groups.
+
+A single trial's heatmap (heatmap.py) uses ranges found from that trial, so two trials' histograms don't line up bin for
+bin. Here every trial is binned on one fixed grid (GRID_RANGES at a given resolution) through heatmap.heatmap_data(), so
+the four views of every trial are GridHistogram's that can simply be added up. Trials are binned in worker processes and
+the histograms are summed as they come back. Each trial is binned once per run even if it belongs to several groups, so
+a whole dataset can be split into groups and aggregated in one pass:
+
+    catalog = scan()
+    groups = {'RVL': catalog.select(volumes=['RVL'], requires=REQUIRES),
+              'LSX': catalog.select(volumes=['LSX'], requires=REQUIRES)}
+    histograms = aggregate_groups(groups, jobs=4)
+    plot_difference(histograms['RVL'], histograms['LSX'])
+
+Binned trials are kept in the results cache like the heatmaps of single trials (see results_cache.py), so adding a
+trial to a group only bins the new trial. Like the top-level scripts, this must be run from the folder holding
+'tracked_data/', 'boris_data/' and 'volume_data/'.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import copy
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.colors as colors
+from heatmap import heatmap_data
+from catalog import scan
+
+
+# [x_range, y_range, z_range] in meters of the grid every trial is binned on. Covers the testing area with the table
+# and partitions
+GRID_RANGES = [[-2.5, 2.5], [-.5, 2.5], [-2.5, 2.5]]
+
+VIEW_TITLES = ['Front', 'Side', 'Top', 'Top - Feet Only']
+
+# Inputs (see catalog.INPUTS) a trial needs to be binned: heatmap_data() also looks up its bounding box
+REQUIRES = ['tracked', 'bounds']
+
+
+class GridHistogram:
+    # The four views of heatmap.create_heatmap() (front, side, top, top feet-only) on a fixed grid, for one trial or
+    # the sum of many. Histograms on the same grid are added with +, and sum() works on a list of them
+
+    def __init__(self, views, ranges=GRID_RANGES, resolution=200, trials=()):
+        self.views = [np.asarray(view, dtype=float) for view in views]
+        self.ranges = [list(map(float, r)) for r in ranges]
+        self.resolution = resolution
+        self.trials = list(trials)
+
+    @classmethod
+    def empty(cls, ranges=GRID_RANGES, resolution=200):
+
+        return cls([np.zeros((resolution, resolution)) for _ in VIEW_TITLES], ranges, resolution)
+
+    def grid(self):
+
+        return self.ranges, self.resolution
+
+    def extents(self):
+        # Extents of the views, the same as create_heatmap() gives with these ranges
+
+        x, y, z = self.ranges
+        return [z + y, x + y, z + x, z + x]
+
+    def check_grid(self, other):
+
+        if self.grid() != other.grid():
+            raise ValueError('Histograms are on different grids: %s vs %s' % (self.grid(), other.grid()))
+
+    def __add__(self, other):
+        if isinstance(other, int) and other == 0:
+            return self  # Start value of sum()
+        self.check_grid(other)
+        return GridHistogram([a + b for a, b in zip(self.views, other.views)], self.ranges, self.resolution,
+                             self.trials + other.trials)
+
+    __radd__ = __add__
+
+    def occupancy(self):
+        # Every view divided by its number of points: the share of the time markers spent in each bin. Groups with
+        # different numbers (or lengths) of trials can be compared this way
+
+        return [view / view.sum() if view.sum() else view for view in self.views]
+
+    def difference(self, other):
+        # Occupancy of this group minus the occupancy of another group, view by view
+
+        self.check_grid(other)
+        return [a - b for a, b in zip(self.occupancy(), other.occupancy())]
+
+
+def trial_histogram(name, ranges=GRID_RANGES, resolution=200, care_only=False, exclude=None, include=None):
+    # GridHistogram of one trial
+
+    data = heatmap_data(name, care_only=care_only, resolution=resolution, ranges=ranges, exclude=exclude,
+                        include=include)
+    return GridHistogram([view for view, extent in data['views']], ranges, resolution, [name])
+
+
+def bin_trial(name, settings):
+    # Runs inside a worker process. Never raises: returns (name, GridHistogram or None, error message or None) so that
+    # one bad trial doesn't stop the others
+
+    try:
+        return name, trial_histogram(name, **settings), None
+    except Exception as e:
+        return name, None, '%s: %s' % (type(e).__name__, str(e).split('\n')[0])
+
+
+def aggregate_groups(groups, ranges=GRID_RANGES, resolution=200, care_only=False, exclude=None, include=None, jobs=1):
+    # Sums the histograms of every group of trials ({group name: list of trial names}) in one pass over the trials.
+    # Returns {group name: GridHistogram}. Trials that fail are reported and left out
+
+    settings = {'ranges': ranges, 'resolution': resolution, 'care_only': care_only, 'exclude': exclude,
+                'include': include}
+    totals = {group: GridHistogram.empty(ranges, resolution) for group in groups}
+    trials = sorted(set(name for names in groups.values() for name in names))
+
+    if jobs <= 1:
+        results = (bin_trial(name, settings) for name in trials)
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = (future.result() for future in
+                   as_completed([pool.submit(bin_trial, name, settings) for name in trials]))
+
+    try:
+        # Reduce: each trial is added to its groups as soon as it comes back, so only the totals are kept
+        for name, histogram, error in results:
+            if error is not None:
+                print('Failed ' + name + ' - ' + error)
+                continue
+            for group, names in groups.items():
+                if name in names:
+                    totals[group] += histogram
+    finally:
+        if jobs > 1:
+            pool.shutdown()
+
+    return totals
+
+
+def aggregate(names, ranges=GRID_RANGES, resolution=200, care_only=False, exclude=None, include=None, jobs=1):
+    # GridHistogram of all of the trials added together
+
+    return aggregate_groups({'all': names}, ranges=ranges, resolution=resolution, care_only=care_only,
+                            exclude=exclude, include=include, jobs=jobs)['all']
+
+
+def draw_views(views, extents, title, cmap, norm, label):
+    # 2x2 figure of the four views, laid out and flipped the same way as heatmap.HeatmapFigure, with a color bar
+
+    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, sharex='col', sharey='row', figsize=(9.5, 8))
+    axes = [ax1, ax2, ax3, ax4]
+    fig.suptitle(title, x=.5, y=1)
+
+    for ax, view, extent, view_title in zip(axes, views, extents, VIEW_TITLES):
+        image = ax.imshow(view, cmap=cmap, norm=norm, extent=extent, origin='lower', aspect='auto')
+        ax.set_title(view_title)
+        ax.invert_xaxis()
+    ax4.invert_yaxis()
+
+    ax1.set_ylabel('Y (m)')
+    ax2.set_xlabel('X (m)')
+    ax2.xaxis.set_tick_params(labelbottom=True)
+    ax3.set_ylabel('X (m)')
+    ax3.set_xlabel('Z (m)')
+    ax4.get_xaxis().set_visible(False)
+    ax4.get_yaxis().set_visible(False)
+
+    fig.tight_layout()
+    fig.colorbar(image, ax=axes, shrink=.6, label=label)
+
+    return fig
+
+
+def plot_aggregate(histogram, title='', show=True):
+    """
+    Main Function. Heatmap of the sum of the trials in a GridHistogram. Returns the figure
+    """
+
+    # Same color scale as the heatmaps of single trials, with the brightness cap raised by the number of trials
+    v_max = 400 * max(len(histogram.trials), 1)
+    palette = copy(plt.cm.viridis)
+    palette.set_under('w', 0)
+
+    fig = draw_views(histogram.views, histogram.extents(), '%s (%d trials)' % (title, len(histogram.trials)),
+                     palette, colors.SymLogNorm(linthresh=0.01, vmin=1, vmax=v_max), 'Occurrences')
+
+    if show:
+        plt.show()
+
+    return fig
+
+
+def plot_difference(first, second, title='', show=True):
+    """
+    Main Function. Map of where the markers of the first group spent a bigger (red) or smaller (blue) share of their
+    time than those of the second group. Returns the figure
+    """
+
+    views = first.difference(second)
+    limit = max(np.abs(view).max() for view in views) or 1
+
+    fig = draw_views(views, first.extents(), title, plt.cm.RdBu_r,
+                     colors.SymLogNorm(linthresh=limit / 1000, vmin=-limit, vmax=limit), 'Difference in occupancy')
+
+    if show:
+        plt.show()
+
+    return fig
+
+
+if __name__ == "__main__":
+
+    # Number of worker processes
+    jobs = 4
+
+    #############################################################################################################
+
+    # Groups of trials to aggregate, picked by subject, scenario and volume codes from the catalog (see catalog.py). A
+    # group is compared to the second group with a difference map when two groups are given
+    catalog = scan()
+    groups = {'RVL': catalog.select(subjects=['S08'], volumes=['RVL'], requires=REQUIRES),
+              'LSX': catalog.select(subjects=['S08'], volumes=['LSX'], requires=REQUIRES)}
+
+    #############################################################################################################
+
+    histograms = aggregate_groups(groups, jobs=jobs)
+    for group, histogram in histograms.items():
+        plot_aggregate(histogram, title=group)
+    if len(groups) == 2:
+        first, second = groups
+        plot_difference(histograms[first], histograms[second], title=first + ' - ' + second)
@@ -0,0 +1,320 @@
+"""
+Times the hot paths of the plotting scripts on synthetic trials (see synthetic.py) and writes a JSON report that can be
+compared with the report of an earlier run to catch regressions.
+
+For every trial size, a synthetic trial is written into a temporary folder and each benchmark is run --repeat times.
+The in-memory caches (load_trial, load_observation, metadata tables) are cleared before every run so each run does the
+full work of a first call. The binary caches on disk are kept between runs unless --cold is given, in which case every
+run parses the csv's again. Wall time is the best of the repeats; peak memory is measured with tracemalloc in one extra
+run so that tracing doesn't slow down the timed runs.
+
+With --backend both, every benchmark is run once with the NumPy code and once with the compiled kernels (see
+kernels.py, needs numba) and the speed-up of the kernels is printed at the end.
+
+Examples, from the repo folder:
+    python benchmarks/run_benchmarks.py --out before.json
+    python benchmarks/run_benchmarks.py --durations 60 600 --only ongoing_vol plot_heatmap --out after.json
+    python benchmarks/run_benchmarks.py --out after.json --compare before.json
+    python benchmarks/run_benchmarks.py --backend both --only get_cols ongoing_vol plot_heatmap
+"""
+
+import matplotlib
+matplotlib.use('Agg')
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The repo modules live one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import matplotlib.pyplot as plt
+import cumulative_volume
+import heartrate
+import heatmap
+import kernels
+import metadata
+import observation
+import results_cache
+import trial_data
+from catalog import parse_name
+from synthetic import make_dataset
+
+
+REPORT_VERSION = 1
+
+# Trial lengths in seconds
+DEFAULT_DURATIONS = [30, 120, 600]
+
+
+# Every run has to do the work, so derived results are never taken from the results cache
+results_cache.configure(enabled=False)
+
+
+def clear_caches():
+    # Forgets every trial, observation and table held in memory so the next call loads it again
+
+    trial_data._load_trial.cache_clear()
+    observation._read_observation.cache_clear()
+    metadata._heart_rates.cache_clear()
+    metadata._bounds.cache_clear()
+    gc.collect()
+
+
+def clear_disk_caches():
+    # Removes the binary caches written next to the csv's
+
+    for folder in ('tracked_data', 'heartrate_data', 'volume_data'):
+        shutil.rmtree(os.path.join(folder, trial_data.CACHE_DIR), ignore_errors=True)
+
+
+def bench_get_cols(name):
+    cumulative_volume.get_cols(trial_data.tracked_file(name), False)
+
+
+def bench_ongoing_vol(name):
+    cumulative_volume.ongoing_vol(name, calcs_per_second=5)
+
+
+def bench_plot_heatmap(name):
+    plt.close(heatmap.plot_heatmap(name, show=False))
+
+
+def bench_plot_heatmap_care_only(name):
+    plt.close(heatmap.plot_heatmap(name, care_only=True, show=False))
+
+
+def bench_get_observation(name):
+    observation.get_observation(name)
+
+
+def bench_remove_reach(name, df):
+    heatmap.remove_reach(name, df)
+
+
+def setup_remove_reach(name):
+    # remove_reach() is given the marker DataFrame, which isn't part of what's timed
+
+    return (heatmap.get_markers(trial_data.tracked_file(name)),)
+
+
+def bench_hr_2_np(name):
+    heartrate.hr_2_np(name, parse_name(name).subject)
+
+
+# name: (function, setup returning extra arguments or None)
+BENCHMARKS = {'get_cols': (bench_get_cols, None),
+              'ongoing_vol': (bench_ongoing_vol, None),
+              'plot_heatmap': (bench_plot_heatmap, None),
+              'plot_heatmap_care_only': (bench_plot_heatmap_care_only, None),
+              'get_observation': (bench_get_observation, None),
+              'remove_reach': (bench_remove_reach, setup_remove_reach),
+              'hr_2_np': (bench_hr_2_np, None)}
+
+
+def run_one(name, setup, cold):
+    # One run of a benchmark from a cleared state. Returns the arguments to call it with
+
+    clear_caches()
+    if cold:
+        clear_disk_caches()
+    return (name,) + (setup(name) if setup else ())
+
+
+def measure(bench, name, repeat=3, cold=False):
+    # Best wall time, every wall time and peak traced memory (MB) of a benchmark
+
+    function, setup = BENCHMARKS[bench]
+
+    # Warm up run: writes the disk caches (unless cold) and imports anything imported lazily
+    function(*run_one(name, setup, cold))
+
+    seconds = []
+    for _ in range(repeat):
+        args = run_one(name, setup, cold)
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+
+    args = run_one(name, setup, cold)
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(seconds), seconds, peak / 2**20
+
+
+def quiet(function, *args, **kwargs):
+    # Runs a function with stdout silenced, since the plotting functions print their nan/reach loss
+
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            return function(*args, **kwargs)
+        finally:
+            sys.stdout = stdout
+
+
+def backend_name():
+    # Backend the benchmarks are run with
+
+    return 'numba' if kernels.compiled() else 'numpy'
+
+
+def run(durations, benches, frame_rate=100, markers=20, nan_rate=.02, caregivers=1, repeat=3, cold=False,
+        backends=None):
+    # Runs every benchmark at every size, once per backend ('numpy' or 'numba'; None runs the backend kernels.py picks).
+    # Returns the report as a dict
+
+    results = []
+    home = os.getcwd()
+    folder = tempfile.mkdtemp(prefix='mse_bench_')
+    use_numba = kernels.USE_NUMBA  # Put back afterwards, the backends are only switched for the benchmarks
+
+    try:
+        for duration in durations:
+            data_folder = os.path.join(folder, 'trial_%gs' % duration)
+            name = make_dataset(data_folder, duration=duration, frame_rate=frame_rate, body_markers=markers,
+                                nan_rate=nan_rate, caregivers=caregivers)
+            os.chdir(data_folder)
+            size = {'duration': duration, 'frame_rate': frame_rate, 'frames': int(round(duration * frame_rate)),
+                    'markers': markers, 'nan_rate': nan_rate, 'caregivers': caregivers}
+
+            for bench in benches:
+                for backend in backends or [None]:
+                    if backend is not None:
+                        kernels.USE_NUMBA = backend == 'numba'
+                    best, seconds, peak = quiet(measure, bench, name, repeat=repeat, cold=cold)
+                    results.append({'benchmark': bench, 'size': size, 'backend': backend_name(), 'seconds': best,
+                                    'all_seconds': seconds, 'peak_mb': peak})
+                    print('  %-32s %7gs  %9.4fs  %8.1f MB' % (bench + ' [%s]' % backend_name(), duration, best, peak))
+
+            os.chdir(home)
+    finally:
+        os.chdir(home)
+        shutil.rmtree(folder, ignore_errors=True)
+        kernels.USE_NUMBA = use_numba
+
+    return {'version': REPORT_VERSION,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'numba': None if kernels.numba is None else kernels.numba.__version__,
+                        'platform': platform.platform(),
+                        'processor': platform.processor() or platform.machine()},
+            'settings': {'repeat': repeat, 'cold': cold},
+            'results': results}
+
+
+def result_key(result):
+    # Results of two reports are compared when they are the same benchmark at the same size with the same backend.
+    # Reports from before there was a choice of backend were all run with NumPy
+
+    return result['benchmark'], json.dumps(result['size'], sort_keys=True), result.get('backend', 'numpy')
+
+
+def speedups(report):
+    # Prints how many times faster every benchmark ran with the compiled kernels than with NumPy
+
+    times = {result_key(result): result['seconds'] for result in report['results']}
+    print()
+    print('%-24s %8s %10s %10s %8s' % ('benchmark', 'duration', 'numpy s', 'numba s', 'speed-up'))
+    for result in report['results']:
+        bench, size, backend = result_key(result)
+        if backend == 'numba' and (bench, size, 'numpy') in times:
+            numpy_seconds = times[bench, size, 'numpy']
+            print('%-24s %8g %10.4f %10.4f %7.2fx' % (bench, result['size']['duration'], numpy_seconds,
+                                                      result['seconds'], numpy_seconds / max(result['seconds'], 1e-9)))
+
+
+def compare(report, baseline, tolerance=1.25):
+    # Prints the time and memory of every result relative to the baseline. Returns the number of results that got
+    # slower (or bigger) by more than tolerance times
+
+    old = {result_key(result): result for result in baseline['results']}
+    if report['settings'] != baseline.get('settings'):
+        print('Warning: the reports were run with different settings: %s vs %s' % (report['settings'],
+                                                                                 baseline.get('settings')))
+
+    print()
+    print('%-24s %8s %10s %10s %7s %9s %9s %7s' % ('benchmark', 'duration', 'old s', 'new s', 'ratio', 'old MB',
+                                                  'new MB', 'ratio'))
+    regressions = 0
+    for result in report['results']:
+        before = old.get(result_key(result))
+        if before is None:
+            continue
+        time_ratio = result['seconds'] / max(before['seconds'], 1e-9)
+        memory_ratio = result['peak_mb'] / max(before['peak_mb'], 1e-9)
+        flag = ''
+        # Peaks of a few hundred kB swing a lot from run to run, so memory only counts once it grows by a megabyte
+        grew = memory_ratio > tolerance and result['peak_mb'] - before['peak_mb'] > 1
+        if time_ratio > tolerance or grew:
+            flag = '  <-- regression'
+            regressions += 1
+        print('%-24s %8g %10.4f %10.4f %7.2f %9.1f %9.1f %7.2f%s' % (
+            result['benchmark'], result['size']['duration'], before['seconds'], result['seconds'], time_ratio,
+            before['peak_mb'], result['peak_mb'], memory_ratio, flag))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the MSE plotting pipeline on synthetic trials.')
+    parser.add_argument('--durations', type=float, nargs='+', default=DEFAULT_DURATIONS, metavar='SECONDS',
+                        help='trial lengths to benchmark (default %s)' % ' '.join(map(str, DEFAULT_DURATIONS)))
+    parser.add_argument('--frame-rate', type=int, default=100, help='BTS frame rate in Hz (default 100)')
+    parser.add_argument('--markers', type=int, default=20, help='body-markers per caregiver (default 20)')
+    parser.add_argument('--nan-rate', type=float, default=.02, help='fraction of missing marker frames (default .02)')
+    parser.add_argument('--caregivers', type=int, choices=[1, 2], default=1)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS), metavar='BENCHMARK',
+                        help='benchmarks to run (default all: %s)' % ', '.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark (default 3)')
+    parser.add_argument('--cold', action='store_true', help='delete the binary caches before every run')
+    parser.add_argument('--backend', choices=['default', 'numpy', 'numba', 'both'], default='default',
+                        help='run with the NumPy code, the compiled kernels of kernels.py or both (default: the '
+                             'kernels if numba is installed)')
+    parser.add_argument('--out', default=None, help='write the JSON report to this file')
+    parser.add_argument('--compare', default=None, metavar='REPORT', help='JSON report of an earlier run to compare to')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown (or memory growth) ratio counted as a regression (default 1.25)')
+    args = parser.parse_args(argv)
+
+    backends = {'default': None, 'numpy': ['numpy'], 'numba': ['numba'], 'both': ['numpy', 'numba']}[args.backend]
+    if backends and 'numba' in backends and kernels.numba is None:
+        parser.error('--backend %s needs numba installed' % args.backend)
+
+    print('%-34s %8s %10s %11s' % ('benchmark', 'duration', 'best', 'peak'))
+    report = run(args.durations, args.only, frame_rate=args.frame_rate, markers=args.markers, nan_rate=args.nan_rate,
+                 caregivers=args.caregivers, repeat=args.repeat, cold=args.cold, backends=backends)
+
+    if args.backend == 'both':
+        speedups(report)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Wrote ' + args.out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, tolerance=args.tolerance)
+        print('%d regression(s)' % regressions)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
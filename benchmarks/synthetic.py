@@ -0,0 +1,290 @@
+"""
+Writes synthetic MSE trials: tracked marker data, BORIS observations, heart rates and bounding boxes in the same
+folders, file names, header offsets and column layouts as the real data ('tracked_data/', 'boris_data/',
+'heartrate_data/' and 'volume_data/'). Used by the benchmarks since the real data can't leave the lab, but the files
+work with every script in the repo.
+
+The data is random but shaped like a trial: caregivers wander around a table inside a frame of partitions, markers drop
+out for runs of frames (written as empty fields like BTS does), the BORIS states follow each other through the trial
+with a few rounds of CPR and retrieving/returning periods scattered throughout, and heart rate is one value per second.
+
+Example, from the folder that should hold the data folders:
+    python benchmarks/synthetic.py --duration 300 --frame-rate 100 --nan-rate .02
+"""
+
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# The repo modules live one folder up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trial_data import tracked_file
+from observation import observation_file
+from metadata import heart_rate_file, volume_file
+from catalog import parse_name, heart_rate_key
+
+
+# Body-marker names. Feet markers contain one of trial_data.FEET_TYPES. Extra markers past the end of this list are
+# named M<n>
+BODY_MARKERS = ['HEAD', 'RFHD', 'LFHD', 'C7', 'RSHO', 'LSHO', 'RELB', 'LELB', 'RWRA', 'LWRA', 'RFIN', 'LFIN', 'STRN',
+                'T10', 'RASI', 'LASI', 'RTHI', 'LTHI', 'RKNE', 'LKNE', 'RTIB', 'LTIB', 'RANL', 'LANL', 'RANM', 'LANM',
+                'RHEE', 'LHEE', 'RTOT', 'LTOT']
+
+# Height of each named body-marker in meters when standing. Feet markers are near the floor
+MARKER_HEIGHTS = {'HEAD': 1.75, 'RFHD': 1.7, 'LFHD': 1.7, 'C7': 1.5, 'RSHO': 1.45, 'LSHO': 1.45, 'RELB': 1.15,
+                  'LELB': 1.15, 'RWRA': .9, 'LWRA': .9, 'RFIN': .8, 'LFIN': .8, 'STRN': 1.3, 'T10': 1.25, 'RASI': 1.0,
+                  'LASI': 1.0, 'RTHI': .75, 'LTHI': .75, 'RKNE': .5, 'LKNE': .5, 'RTIB': .3, 'LTIB': .3, 'RANL': .08,
+                  'LANL': .08, 'RANM': .08, 'LANM': .08, 'RHEE': .05, 'LHEE': .05, 'RTOT': .04, 'LTOT': .04}
+
+# States observed in BORIS besides CPR and retrieving/returning. They sort before 'Retrieving/Returning Equipment',
+# which the scripts expect to be the last state
+STATES = ['Airway', 'Assessment', 'Communication', 'Defibrillation', 'Medication']
+REACH_STATE = 'Retrieving/Returning Equipment'
+
+# Trial names used for single and dual caregiver datasets. RVL trials used partitions, dual caregiver trials (S78) did
+# not
+SINGLE_TRIAL = 'MVOL_S08_07_APR_RVL_1'
+DUAL_TRIAL = 'MVOL_S78_03_AC2_LSX_1'
+
+
+def marker_names(body_markers=20, caregivers=1):
+    # Marker names in the order BTS exports them: first caregiver's body-markers, frame, table, then the second
+    # caregiver's body-markers
+
+    body = [BODY_MARKERS[i] if i < len(BODY_MARKERS) else 'M%d' % i for i in range(body_markers)]
+    # Feet markers are at the end of BODY_MARKERS. Keep a few of them when fewer markers are asked for
+    if body_markers < len(BODY_MARKERS):
+        body = body[:max(body_markers - 4, 0)] + BODY_MARKERS[-min(4, body_markers):]
+
+    names = body + ['FRM%d' % i for i in range(1, 13)] + ['TAB%d' % i for i in range(1, 5)]
+    if caregivers == 2:
+        names += [name + '2' for name in body]
+    return names, len(body)
+
+
+def caregiver_motion(rng, frames, frame_rate, body):
+    # (frames, body, 3) positions of one caregiver's body-markers. The caregiver walks around the room, slowly, and
+    # the markers sway around their place on the body
+
+    seconds = frames / frame_rate
+
+    # Slow walk of the body center on the floor, smoothed random steps kept inside the room
+    steps = rng.normal(0, .02, (int(seconds * 4) + 2, 2))
+    path = np.cumsum(steps, axis=0)
+    path -= path.mean(axis=0)
+    path = np.clip(path, -.9, .9)
+    at = np.linspace(0, len(path) - 1, frames)
+    center_x = np.interp(at, np.arange(len(path)), path[:, 0])
+    center_z = np.interp(at, np.arange(len(path)), path[:, 1])
+
+    heights = np.array([MARKER_HEIGHTS.get(name, rng.uniform(.3, 1.6)) for name in body])
+    offsets = rng.normal(0, .12, (len(body), 2))
+
+    # Bending over (during compressions for instance) lowers the upper body
+    time = np.arange(frames) / frame_rate
+    bend = .25 * np.clip(np.sin(2 * np.pi * time / rng.uniform(20, 40)), 0, None)
+    scale = 1 - bend[:, None] * (heights[None, :] > .9)
+
+    points = np.empty((frames, len(body), 3))
+    points[:, :, 0] = center_x[:, None] + offsets[None, :, 0]
+    points[:, :, 1] = heights[None, :] * scale
+    points[:, :, 2] = center_z[:, None] + offsets[None, :, 1]
+    points += rng.normal(0, .01, points.shape)
+    return points
+
+
+def add_dropouts(rng, points, nan_rate, mean_gap=20):
+    # Markers lost by BTS go missing for a run of frames, so dropouts are written as gaps rather than scattered nan's.
+    # nan_rate is the fraction of marker frames that are missing
+
+    frames, markers, _ = points.shape
+    if nan_rate <= 0:
+        return points
+
+    gaps = rng.poisson(nan_rate * frames * markers / mean_gap)
+    starts = rng.integers(0, frames, gaps)
+    lengths = rng.geometric(1 / mean_gap, gaps)
+    which = rng.integers(0, markers, gaps)
+    for start, length, marker in zip(starts, lengths, which):
+        points[start:start + length, marker] = np.nan
+    return points
+
+
+def write_tracked(path, duration=60.0, frame_rate=100, body_markers=20, nan_rate=.02, caregivers=1, filtered=False,
+                  seed=0):
+    # Tracked marker csv as exported by BTS: 10 lines of metadata, then Frame, Time and x, y, z columns for every marker
+    # in meters. filtered adds the 'f' suffix to the marker names. Returns the number of frames
+
+    rng = np.random.default_rng(seed)
+    frames = int(round(duration * frame_rate))
+    names, body = marker_names(body_markers, caregivers)
+
+    parts = [caregiver_motion(rng, frames, frame_rate, names[:body])]
+
+    # Frame (partition) markers around the work area, table markers at table height. Both barely move
+    corners = [(-1.2, -1.2), (1.2, -1.2), (1.2, 1.2), (-1.2, 1.2)]
+    frame = [(x, y, z) for y in (0.0, 1.0, 2.0) for x, z in corners]
+    table = [(.3, .9, .2), (.9, .9, .2), (.9, .9, .6), (.3, .9, .6)]
+    fixed = np.array(frame + table)
+    parts.append(fixed[None, :, :] + rng.normal(0, .002, (frames, len(fixed), 3)))
+
+    if caregivers == 2:
+        parts.append(caregiver_motion(rng, frames, frame_rate, names[:body]))
+
+    points = add_dropouts(rng, np.concatenate(parts, axis=1), nan_rate)
+
+    suffix = 'f' if filtered else ''
+    columns = ['Frame', 'Time'] + [name + suffix + '.' + axis for name in names for axis in 'XYZ']
+    df = pd.DataFrame(points.reshape(frames, -1), columns=columns[2:])
+    df.insert(0, 'Time', np.arange(frames) / frame_rate)
+    df.insert(0, 'Frame', np.arange(frames))
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        metadata = ['Type:,Point 3D tracks', 'Measure unit:,m', 'Tracks:,%d' % len(names),
+                    'Frequency:,%d Hz' % frame_rate, 'Frames:,%d' % frames, 'Start time:,0.000', 'Protocol:,MSE',
+                    'Subject:,', 'Acquisition:,', 'Comments:,']
+        f.write('\n'.join(metadata) + '\n')
+        df.to_csv(f, index=False, float_format='%.6f', na_rep='')
+
+    return frames
+
+
+def state_intervals(rng, duration, subject_states=STATES):
+    # (behavior, start, stop) of every event of one subject: the states follow each other through the trial, CPR rounds
+    # fall inside the longer states, and retrieving/returning periods are scattered through the trial
+
+    cuts = np.sort(rng.uniform(.02, .98, len(subject_states) - 1)) * duration
+    bounds = np.concatenate([[.01 * duration], cuts, [.99 * duration]])
+    events = [(state, bounds[i], bounds[i + 1]) for i, state in enumerate(subject_states)]
+
+    # A round of CPR in the middle of every other state
+    for state, start, stop in events[1::2]:
+        length = stop - start
+        events.append(('CPR', start + .3 * length, start + .6 * length))
+
+    # About one trip for supplies every 30 seconds
+    trips = max(1, int(duration / 30))
+    starts = np.sort(rng.uniform(0, duration * .95, trips))
+    for start in starts:
+        events.append((REACH_STATE, start, min(start + rng.uniform(1, 4), duration)))
+
+    # Trips can't overlap each other since BORIS alternates start and stop of a behavior
+    events.sort(key=lambda event: (event[0], event[1]))
+    cleaned = []
+    for event in events:
+        if cleaned and cleaned[-1][0] == event[0] and event[1] <= cleaned[-1][2]:
+            continue
+        cleaned.append(event)
+    return cleaned
+
+
+def write_boris(path, subjects=('S08',), duration=60.0, seed=0):
+    # BORIS observation csv: 15 lines of observation info, then one row per start/stop event sorted by time
+
+    rng = np.random.default_rng(seed)
+
+    rows = []
+    for subject in subjects:
+        for behavior, start, stop in state_intervals(rng, duration):
+            rows.append((start, subject, behavior, 'START'))
+            rows.append((stop, subject, behavior, 'STOP'))
+    rows.sort(key=lambda row: row[0])
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        # No blank lines: pandas doesn't count them when skipping to the header row on line 16
+        info = ['Observation id,synthetic', 'Observation date,', 'Description,', 'Time offset (s),0.000',
+                'Media file(s),', 'Player #1,video.mp4', 'Observation duration (s),%.3f' % duration,
+                'Independent variables,', 'variable,value', 'Observation type,media', 'Focal subject,',
+                'Subjects,%s' % ' '.join(subjects), 'Ethogram,', 'Exported by,BORIS', 'Events,']
+        f.write('\n'.join(info) + '\n')
+        f.write('Time,Media file path,Total length,FPS,Subject,Behavior,Behavioral category,Comment,Status\n')
+        for time, subject, behavior, status in rows:
+            f.write('%.3f,video.mp4,%.2f,30.00,%s,%s,,,%s\n' % (time, duration, subject, behavior, status))
+
+
+def trial_key(name):
+    # (scenario, volume, attempt number) of a trial name, the key metadata.heart_rates() reads the columns back with
+
+    return heart_rate_key(parse_name(name))
+
+
+def write_heart_rate(path, names, duration=60.0, seed=0):
+    # Heart rate csv of a subject: three header rows (trial, volume, attempt number), a 'Time' row, then one row per
+    # second with one column per trial. Columns of shorter trials are left empty at the bottom
+
+    rng = np.random.default_rng(seed)
+    seconds = int(duration)
+
+    columns = {}
+    for name in names:
+        rate = 80 + np.cumsum(rng.normal(0, 1.5, seconds))
+        columns[trial_key(name)] = np.clip(np.round(rate), 55, 126)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        for level in range(3):
+            f.write(',' + ','.join(key[level] for key in columns) + '\n')
+        f.write('Time' + ',' * len(columns) + '\n')
+        for second in range(seconds):
+            f.write(str(second + 1) + ',' + ','.join('%d' % rate[second] for rate in columns.values()) + '\n')
+
+
+def write_volume(path, names, seed=0):
+    # Bounding box csv of a subject: one row per trial with the box in millimeters
+
+    rng = np.random.default_rng(seed)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        f.write('Trial,Notes,Xmin,Ymin,Zmin,Xmax,Ymax,Zmax\n')
+        for name in names:
+            low = rng.uniform(-900, -500, 3) * [1, 0, 1]
+            high = rng.uniform(500, 900, 3) * [1, 0, 1] + [0, 1800, 0]
+            f.write('%s,,%d,%d,%d,%d,%d,%d\n' % ((name,) + tuple(low.astype(int)) + tuple(high.astype(int))))
+
+
+def make_dataset(folder='.', duration=60.0, frame_rate=100, body_markers=20, nan_rate=.02, caregivers=1,
+                 filtered=False, seed=0):
+    # Writes one complete trial (tracked data, BORIS observation, heart rates and bounding boxes) into the data folders
+    # under folder. The heart rate and bounding box tables of the trial's subjects are rewritten with just this trial,
+    # so single and dual caregiver datasets (which share S08) should go in different folders. Returns the trial name
+
+    name = DUAL_TRIAL if caregivers == 2 else SINGLE_TRIAL
+    trial_id = parse_name(name)
+    subjects = ['S07', 'S08'] if caregivers == 2 else [trial_id.subject]
+
+    write_tracked(os.path.join(folder, tracked_file(name)), duration=duration, frame_rate=frame_rate,
+                  body_markers=body_markers, nan_rate=nan_rate, caregivers=caregivers, filtered=filtered, seed=seed)
+    write_boris(os.path.join(folder, observation_file(name)), subjects=subjects, duration=duration, seed=seed)
+    for i, subject in enumerate(subjects):
+        write_heart_rate(os.path.join(folder, heart_rate_file(subject)), [name], duration=duration, seed=seed + i)
+    for care_only in (False, True):
+        write_volume(os.path.join(folder, volume_file(trial_id.number, care_only)), [name], seed=seed)
+
+    return name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic MSE trial into the data folders.')
+    parser.add_argument('--folder', default='.', help="folder to create the data folders in (default '.')")
+    parser.add_argument('--duration', type=float, default=60.0, help='length of the trial in seconds (default 60)')
+    parser.add_argument('--frame-rate', type=int, default=100, help='BTS frame rate in Hz (default 100)')
+    parser.add_argument('--markers', type=int, default=20, help='body-markers per caregiver (default 20)')
+    parser.add_argument('--nan-rate', type=float, default=.02, help='fraction of missing marker frames (default .02)')
+    parser.add_argument('--caregivers', type=int, choices=[1, 2], default=1, help='caregivers in the trial (default 1)')
+    parser.add_argument('--filtered', action='store_true', help="add the 'f' suffix to marker names")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    name = make_dataset(args.folder, duration=args.duration, frame_rate=args.frame_rate, body_markers=args.markers,
+                        nan_rate=args.nan_rate, caregivers=args.caregivers, filtered=args.filtered, seed=args.seed)
+    print('Wrote ' + name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Works out the bounding box tables of the subjects ('volume_data/S<n>_VOL.csv' and 'volume_data/S<n>_VOL_CareOnly.csv')
+from the tracked marker data instead of by hand.
+
+The bounding box of a trial is the min/max x, y and z reached by any body-marker over the whole trial, found in one
+vectorized min/max over the (frames, markers, 3) marker data with the nan points masked out. The care-only box leaves
+out the frames when the subject was observed retrieving/returning supplies, using the same frame mask as the care-only
+heatmaps. Trials are spread over a pool of worker processes.
+
+The boxes are written in the format heatmap.get_bounds() reads (see metadata.parse_bounds()): one row per trial with
+Xmin, Ymin, Zmin, Xmax, Ymax, Zmax in whole millimeters, rounded outwards so the box holds every point. Rows of trials
+that weren't worked out, and the other columns of rows that were (Notes), are kept as they are. Tables are read again
+automatically wherever they are used since they are cached by modification time.
+
+Examples, from the folder holding 'tracked_data/', 'boris_data/' and 'volume_data/':
+    python bounds_table.py --trials 'MVOL_S08_*' --jobs 4
+    python bounds_table.py --trials 'MVOL_*' --dry-run
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import sys
+import numpy as np
+import pandas as pd
+from trial_data import load_trial, as_slice, tracked_file
+from observation import load_observation
+from metadata import volume_file
+from heatmap import reach_state
+from catalog import scan, parse_name
+
+
+BOUND_COLUMNS = ['Xmin', 'Ymin', 'Zmin', 'Xmax', 'Ymax', 'Zmax']
+
+
+def body_points(trial):
+    # (frames, markers, 3) data of every body-marker: every marker that isn't on the table or the frame, which covers
+    # both caregivers of a dual trial
+
+    body = ~(trial.marker_mask('table') | trial.marker_mask('frame'))
+    return trial.points[:, as_slice(list(np.flatnonzero(body)))]
+
+
+def box(points, keep=None):
+    # Bounding box in millimeters of the points in the frames where keep is True, as [Xmin, Ymin, Zmin, Xmax, Ymax,
+    # Zmax]. Raises ValueError if there are no points
+
+    if keep is not None:
+        points = points[keep]
+    valid = points[~np.any(np.isnan(points), axis=2)]
+    if not len(valid):
+        raise ValueError('no body-marker data')
+
+    # Marker data is in meters
+    low = np.floor(valid.min(axis=0) * 1000)
+    high = np.ceil(valid.max(axis=0) * 1000)
+    return np.concatenate((low, high)).astype(int)
+
+
+def care_only_box(name, trial, points):
+    # Box of the frames left after the retrieving/returning periods are removed, or None if the trial has no BORIS
+    # observation
+
+    try:
+        observation = load_observation(name)
+    except FileNotFoundError:
+        print('Warning: no BORIS observation for ' + name + ', care-only box not worked out')
+        return None
+
+    return box(points, observation.keep_mask(trial.time, exclude=[reach_state(observation)]))
+
+
+def trial_bounds(name, care_only=True):
+    # Runs inside a worker process. Never raises: returns (name, box, care-only box or None, error message or None) so
+    # that one bad trial doesn't stop the batch
+
+    try:
+        trial = load_trial(tracked_file(name))
+        points = body_points(trial)
+        return name, box(points), care_only_box(name, trial, points) if care_only else None, None
+    except Exception as e:
+        return name, None, None, '%s: %s' % (type(e).__name__, str(e).split('\n')[0])
+
+
+def compute_bounds(trials, care_only=True, jobs=1):
+    # Bounding boxes of every trial, in worker processes when jobs > 1. Yields results as each trial finishes
+
+    if jobs <= 1:
+        for name in trials:
+            yield trial_bounds(name, care_only)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(trial_bounds, name, care_only) for name in trials]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def read_table(file):
+    # Existing table, or an empty one. Read as text so that the rows that aren't updated are written back as they were
+
+    if os.path.exists(file):
+        return pd.read_csv(file, delimiter=',', header=0, index_col=0, dtype=str, keep_default_na=False)
+    return pd.DataFrame(columns=['Notes'] + BOUND_COLUMNS).rename_axis('Trial')
+
+
+def update_table(file, boxes):
+    # Writes the boxes ({trial name: box}) into a table, adding rows for new trials. Only those rows are changed, the
+    # others keep their text. Written under a temporary name and then renamed so that a half written table is never read
+
+    df = read_table(file)
+    for name, bounds in boxes.items():
+        df.loc[name, BOUND_COLUMNS] = [str(int(round(b))) for b in bounds]
+
+    df = df.fillna('').sort_index()  # New rows have no notes
+
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    temp = file + '.tmp%d' % os.getpid()
+    df.to_csv(temp)
+    os.replace(temp, file)
+
+
+def build_tables(trials, care_only=True, jobs=1, dry_run=False):
+    """
+    Main Function. Works out the bounding boxes of the trials and writes them into the tables of their subjects.
+    Returns the number of trials that failed.
+    """
+
+    tables = {}
+    failed = 0
+    for name, bounds, care_bounds, error in compute_bounds(trials, care_only=care_only, jobs=jobs):
+        if error is not None:
+            print('failed ' + name + ' - ' + error)
+            failed += 1
+            continue
+        print('done   %s %s' % (name, ' '.join(map(str, bounds))))
+        number = parse_name(name).number
+        tables.setdefault(volume_file(number), {})[name] = bounds
+        if care_bounds is not None:
+            tables.setdefault(volume_file(number, care_only=True), {})[name] = care_bounds
+
+    for file, boxes in sorted(tables.items()):
+        if not dry_run:
+            update_table(file, boxes)
+        print(('Would update ' if dry_run else 'Updated ') + file + ' (%d trials)' % len(boxes))
+
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Work out the subject bounding box tables from tracked marker data.')
+    parser.add_argument('--trials', nargs='+', required=True, metavar='PATTERN',
+                        help="trial names or glob patterns, e.g. 'MVOL_S08_*'")
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='number of worker processes (default 1)')
+    parser.add_argument('--no-care-only', dest='care_only', action='store_false',
+                        help="don't work out the care-only tables")
+    parser.add_argument('--dry-run', action='store_true', help='print the boxes without writing the tables')
+    args = parser.parse_args(argv)
+
+    trials = scan().select(args.trials, requires=['tracked'])
+    if not trials:
+        print('No trials match ' + ' '.join(args.trials))
+        return 1
+
+    return 1 if build_tables(trials, care_only=args.care_only, jobs=args.jobs, dry_run=args.dry_run) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
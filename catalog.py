@@ -0,0 +1,209 @@
+"""
+Index of the MSE trials in the data folders and of the inputs each trial has.
+
+Trial names such as 'MVOL_S08_07_APR_RVL_1' are parsed once into their fields by parse_name() (project, subject,
+subject number, trial number, scenario, volume and attempt number) instead of being cut up with string slices
+wherever a field is needed.
+
+scan() lists 'tracked_data/', 'boris_data/', 'heartrate_data/' and 'volume_data/' once and records every csv with its
+size and modification time. For the heart rate and bounding box tables it also records which trials they have rows for,
+so a trial missing from a table is found without plotting it. The index is saved in 'catalog.json' and updated
+incrementally: on the next scan only tables whose size or modification time changed are read again.
+
+    catalog = scan()
+    catalog.select(['MVOL_S08_*'], requires=['tracked', 'bounds'])
+    catalog.missing('MVOL_S08_07_APR_RVL_1', ['observation', 'heart_rate'])
+
+Inputs a trial can have:
+    tracked           tracked marker data, 'tracked_data/<name>_tracked.csv'
+    observation       BORIS observation, 'boris_data/<name>.csv'
+    heart_rate        a column in the heart rate table of its subject
+    bounds            a row in the bounding box table of its subject
+    care_only_bounds  a row in the care-only bounding box table of its subject
+"""
+
+from collections import namedtuple
+from fnmatch import fnmatch
+from functools import lru_cache
+import json
+import os
+import re
+from trial_data import TRACKED_SUFFIX, tracked_file
+from observation import observation_file
+from metadata import heart_rate_file, volume_file, load_table, parse_heart_rates, parse_bounds
+
+
+# Saved index, relative to the folder the scripts are run from
+INDEX_FILE = 'catalog.json'
+
+# Bumped whenever the saved index changes format
+CATALOG_VERSION = 1
+
+DATA_FOLDERS = ['tracked_data', 'boris_data', 'heartrate_data', 'volume_data']
+
+INPUTS = ['tracked', 'observation', 'heart_rate', 'bounds', 'care_only_bounds']
+
+# 'MVOL_S08_07_APR_RVL_1': project, subject (and subject number), trial number, scenario, volume, attempt number.
+# Anything after the attempt number (e.g. '_tracked') isn't part of the trial
+TRIAL_PATTERN = re.compile(r'(?P<project>[A-Za-z0-9]{4})_(?P<subject>S(?P<number>[0-9]{2}))_(?P<trial>[0-9]{2})_'
+                           r'(?P<scenario>[A-Za-z0-9]{3})_(?P<volume>[A-Za-z0-9]{3})_(?P<attempt>[A-Za-z0-9])')
+
+TrialID = namedtuple('TrialID', ['name', 'base', 'project', 'subject', 'number', 'trial', 'scenario', 'volume',
+                                 'attempt'])
+
+
+@lru_cache(maxsize=None)
+def parse_name(name):
+    # Fields of a trial name as a TrialID. base is the trial name without anything following the attempt number.
+    # Raises ValueError if the name isn't a trial name
+
+    match = TRIAL_PATTERN.match(name)
+    if match is None:
+        raise ValueError('Not an MSE trial name: ' + name)
+    return TrialID(name=name, base=match.group(0), **match.groupdict())
+
+
+def heart_rate_key(trial_id):
+    # Key of a trial in the heart rate table of its subject (see metadata.heart_rates())
+
+    return trial_id.scenario, trial_id.volume, trial_id.attempt
+
+
+def read_index():
+    # Files recorded by the last scan as {path: {'size', 'mtime', 'keys'}}
+
+    try:
+        with open(INDEX_FILE) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return index.get('files', {}) if index.get('version') == CATALOG_VERSION else {}
+
+
+def write_index(files):
+    # Written under a temporary name and then renamed so that a half written index is never read
+
+    temp = INDEX_FILE + '.tmp%d' % os.getpid()
+    try:
+        with open(temp, 'w') as f:
+            json.dump({'version': CATALOG_VERSION, 'files': files}, f, sort_keys=True)
+        os.replace(temp, INDEX_FILE)
+    except OSError:
+        pass  # Read-only folder. The next scan reads the tables again
+
+
+def table_keys(path):
+    # Trials a heart rate or bounding box table has rows for: [scenario, volume, attempt] keys for heart rates, trial
+    # names for bounding boxes. Read through metadata.load_table() so the table's binary cache is shared with plotting
+
+    if os.path.basename(path).startswith('HeartRate_'):
+        return load_table(path, parse_heart_rates)['keys'].tolist()
+    return load_table(path, parse_bounds)['names'].tolist()
+
+
+def scan(persist=True):
+    """
+    Main Function. Lists the data folders and returns a Catalog. Tables that haven't changed since the last scan aren't
+    read again. With persist the index is saved for the next scan.
+    """
+
+    saved = read_index()
+    files = {}
+
+    for folder in DATA_FOLDERS:
+        if not os.path.isdir(folder):
+            continue
+        for entry in os.scandir(folder):
+            if not (entry.is_file() and entry.name.endswith('.csv')):
+                continue
+            path = folder + '/' + entry.name
+            stat = entry.stat()
+            record = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+            if folder in ('heartrate_data', 'volume_data'):
+                old = saved.get(path)
+                if old and old['size'] == record['size'] and old['mtime'] == record['mtime'] and 'keys' in old:
+                    record['keys'] = old['keys']
+                else:
+                    try:
+                        record['keys'] = table_keys(path)
+                    except Exception as e:
+                        print('Warning: could not read %s - %s: %s' % (path, type(e).__name__, e))
+                        record['keys'] = []
+
+            files[path] = record
+
+    if persist and files != saved:
+        write_index(files)
+
+    return Catalog(files)
+
+
+class Catalog:
+    # The files of the data folders and the trials they hold. Made by scan()
+
+    def __init__(self, files):
+        self.files = files
+        self.tables = {path: set(tuple(key) if isinstance(key, list) else key for key in record['keys'])
+                       for path, record in files.items() if 'keys' in record}
+
+        # Every trial that has tracked marker data or a BORIS observation. Files with other names are listed in unknown
+        self.trials = {}
+        self.unknown = []
+        for path in files:
+            folder, base = path.split('/', 1)
+            if folder == 'tracked_data' and base.endswith(TRACKED_SUFFIX):
+                name = base[:-len(TRACKED_SUFFIX)]
+            elif folder == 'boris_data':
+                name = base[:-len('.csv')]
+            else:
+                continue
+            try:
+                self.trials[name] = parse_name(name)
+            except ValueError:
+                self.unknown.append(path)
+
+    def __contains__(self, name):
+        return name in self.trials
+
+    def names(self):
+
+        return sorted(self.trials)
+
+    def inputs(self, name):
+        # {input: True/False} for every input a trial can have (see INPUTS)
+
+        trial_id = parse_name(name)
+        return {'tracked': tracked_file(name) in self.files,
+                'observation': observation_file(name) in self.files,
+                'heart_rate': heart_rate_key(trial_id) in self.tables.get(heart_rate_file(trial_id.subject), ()),
+                'bounds': name in self.tables.get(volume_file(trial_id.number), ()),
+                'care_only_bounds': name in self.tables.get(volume_file(trial_id.number, care_only=True), ())}
+
+    def missing(self, name, requires):
+        # Inputs out of requires that a trial doesn't have
+
+        has = self.inputs(name)
+        return [need for need in requires if not has[need]]
+
+    def size(self, name):
+        # Size in bytes of the tracked marker data of a trial (0 if there is none). Used to start big trials first
+
+        record = self.files.get(tracked_file(name))
+        return record['size'] if record else 0
+
+    def select(self, patterns=None, subjects=None, scenarios=None, volumes=None, requires=()):
+        # Sorted names of the trials matching any of the glob patterns whose subject, scenario and volume are in the
+        # given lists and that have every input in requires. Anything left as None matches every trial
+
+        wanted = {'subject': subjects, 'scenario': scenarios, 'volume': volumes}
+        names = []
+        for name, trial_id in sorted(self.trials.items()):
+            if patterns is not None and not any(fnmatch(name, pattern) for pattern in patterns):
+                continue
+            if any(codes is not None and getattr(trial_id, key) not in codes for key, codes in wanted.items()):
+                continue
+            if requires and self.missing(name, requires):
+                continue
+            names.append(name)
+        return names
@@ -1,100 +1,421 @@
 from scipy.spatial import ConvexHull
 import numpy as np
-import pandas as pd
+from trial_data import load_trial, points_dtype, tracked_file
+from profiling import span, profiled
+from results_cache import cached, lookup
+import kernels
 
+try:
+    from scipy.spatial import QhullError
+except ImportError:
+    from scipy.spatial.qhull import QhullError
 
-def find_second_start(df):
-    # Only for dual caregiver trials. Finds the beginning of the second caregiver data in the csv. Assumes that columns
-    # are ordered first caregiver markers, followed by table markers, followed by second caregiver markers. Returns int
-    # index
 
-    cols = df.columns
-    try:
-        end_ind = cols.get_loc('TAB4f.Z')
-    except KeyError:
-        end_ind = cols.get_loc('TAB4.Z')
+# Calculations per second of the coarse curves that progressive_vol() yields before the full one
+PROGRESSIVE_RATES = (.2, 1.0)
 
-    start_ind = end_ind + 1
 
-    return start_ind
+def get_cols(file, caregiver):
+    # Load body-marker data of the trial. This shares the parse of the csv with get_markers() in heatmap.py through
+    # load_trial(). We are only interested in the volume created by body-markers so table and frame markers are cut off.
+    # For dual caregiver trials, caregiver picks the first or second caregiver's markers.
 
+    trial = load_trial(file)
 
-def get_cols(file, caregiver):
-    # Load marker data as Pandas DataFrame. This is similar to get_markers() in heatmap.py but more verbose because
-    # table and frame markers cannot be loaded with body-markers. We are only interested in the volume created by body-
-    # markers so everything else is cut off.
-    
-    df = pd.read_csv(file, header=10, delimiter=',', skipinitialspace=True, encoding="utf-8-sig")
+    # (frames, markers, 3) view of the body-markers. Nothing is copied until the nan values are filled in below
+    body = trial.caregiver(caregiver)
+    row, col, *rest = body.shape
 
-    # Assumes columns are ordered body-markers, then frame, then table. Or, if there was no frame, body-markers, then
-    # table.
-    try:
-        try:
-            boundary = df.columns.get_loc("FRM1f.X")
-        except KeyError:
-            boundary = df.columns.get_loc("TAB1f.X")
-    except KeyError:
-        try:
-            boundary = df.columns.get_loc("FRM1.X")
-        except KeyError:
-            boundary = df.columns.get_loc("TAB1.X")
-
-    # Use boundaries to extract relevant marker data
-    if caregiver:
-        if caregiver == 2:
-            data = df.values[:, find_second_start(df):]
-        else:
-            data = df.values[:, 2:boundary]
+    # Replace all nan values with mean of body markers at that time step. These replacement values will not breach the
+    # convex hull. As it always has, the mean used for marker m is the one found at time step m, so only the means of
+    # the first col time steps are needed. With numba this is one compiled pass (see kernels.py)
+    if kernels.compiled():
+        data = kernels.fill_nan_mean(body)
     else:
-        data = df.values[:, 2:boundary]
+        mean = np.nanmean(body[:col], axis=1)  # (col, 3)
+        data = np.where(np.isnan(body), mean[None, :col], body)
 
-    # Replace all nan values with mean of body markers at that time step. These replacement values will not breach the
-    # convex hull.
-    x = data[:, 0::3]
-    y = data[:, 1::3]
-    z = data[:, 2::3]
-
-    # Find mean of dimension at every time step
-    x_mean = np.nanmean(x, axis=1)
-    y_mean = np.nanmean(y, axis=1)
-    z_mean = np.nanmean(z, axis=1)
-
-    # Find indices of all nan values
-    ind_x = np.where(np.isnan(x))
-    ind_y = np.where(np.isnan(y))
-    ind_z = np.where(np.isnan(z))
-
-    # Replace all nans with mean
-    x[ind_x] = np.take(x_mean, ind_x[1])
-    y[ind_y] = np.take(y_mean, ind_y[1])
-    z[ind_z] = np.take(z_mean, ind_z[1])
-
-    # Reshape to (n, 3) where n is number of
-    data = np.dstack((x, y, z))
-    row, col, *rest = data.shape
-    data = data.reshape(row*col, 3)
+        # Reshape to (n, 3) where n is number of points. data is a new contiguous array so this is a view
+        data = data.reshape(row*col, 3)
     
-    dt = float(df.iloc[1]['Time'])
+    dt = float(trial.time[1])
     
     return data, col, row, dt
 
 
+class CumulativeHull:
+    # Convex hull of every point seen so far, grown one batch at a time. Only the vertices of the current hull are
+    # kept: the hull of (old points + new points) is the same as the hull of (old hull vertices + new points), so
+    # everything strictly inside the hull can be thrown away. Points in a new batch that fall inside the current hull
+    # are skipped with a single halfspace test against the hull equations, so a new ConvexHull is only built when a
+    # batch actually pushes the hull outward. Until enough points have been seen to span a volume they are all kept and
+    # the volume is 0.
+
+    def __init__(self):
+        self.vertices = None
+        self.equations = None
+        self.volume = 0.0
+
+    def add(self, points):
+        # Fold an (n, 3) array of points into the hull. Returns the cumulative volume
+
+        if len(points) == 0:
+            return self.volume
+
+        if self.equations is None:
+            if self.vertices is None:
+                candidates = points
+            else:
+                candidates = np.concatenate((self.vertices, points))
+            try:
+                hull = ConvexHull(candidates)
+            except QhullError:
+                # Fewer than 4 points or all of them coplanar. Nothing to measure yet
+                self.vertices = candidates
+                return self.volume
+        else:
+            # Qhull stores each facet as [normal, offset] with outward normals, so a point is inside (or on) the hull
+            # when normal . point + offset <= 0 for every facet
+            if kernels.compiled():
+                outside = kernels.outside_hull(points, self.equations)
+            else:
+                outside = np.any(points @ self.equations[:, :3].T + self.equations[:, 3] > 0, axis=1)
+            if not outside.any():
+                return self.volume
+            candidates = np.concatenate((self.vertices, points[outside]))
+            hull = ConvexHull(candidates)
+
+        self.vertices = candidates[hull.vertices]
+        self.equations = hull.equations
+        self.volume = hull.volume
+
+        return self.volume
+
+
+@profiled('ongoing_vol')
 def ongoing_vol(name, calcs_per_second=5, caregiver=False):
     # Main function. Takes in trial name, how many times a second convex volume should be calculated, and caregiver: a
-    # parameter only to be used in dual caregiver trials. Returns list of cumulative volume calculations over time array
+    # parameter only to be used in dual caregiver trials. Returns list of cumulative volume calculations over time array.
+    # calcs_per_second=None calculates the volume at every captured frame. Results are kept in the results cache (see
+    # results_cache.py) so a trial's curve is only worked out once for each calcs_per_second and caregiver.
+
+    file, params = ongoing_vol_inputs(name, calcs_per_second, caregiver)
+    return cached('ongoing_vol', [file], params, lambda: cumulative_vol(file, calcs_per_second, caregiver))
+
+
+def ongoing_vol_inputs(name, calcs_per_second=5, caregiver=False):
+    # Tracked file and parameters that the result of ongoing_vol() depends on
+
+    file = tracked_file(name)
+    return file, {'calcs_per_second': calcs_per_second, 'caregiver': caregiver, 'dtype': points_dtype().name}
+
+
+def progressive_vol(name, calcs_per_second=5, caregiver=False, rates=PROGRESSIVE_RATES):
+    # Yields (vol, time) curves of ongoing_vol() several times: first sampled at each of the coarse rates (calculations
+    # per second) below calcs_per_second, then at calcs_per_second. A coarse curve takes a fraction of the time of the
+    # full one, so a plot can show the shape of the volume long before the full curve is done. If the full curve is in
+    # the results cache it is the only one yielded.
+
+    file, params = ongoing_vol_inputs(name, calcs_per_second, caregiver)
+
+    if lookup('ongoing_vol', [file], params) is None:
+        for rate in rates:
+            if calcs_per_second is None or rate < calcs_per_second:
+                yield cumulative_vol(file, rate, caregiver)
+
+    yield ongoing_vol(name, calcs_per_second=calcs_per_second, caregiver=caregiver)
+
+
+def cumulative_vol(file, calcs_per_second=5, caregiver=False):
+    # Works out the curve returned by ongoing_vol() from the tracked marker data in file
 
     # Get marker data
-    file = 'tracked_data/' + name + '_tracked.csv'
-    data, col, row, dt = get_cols(file, caregiver)
+    with span('get_cols') as s:
+        data, col, row, dt = get_cols(file, caregiver)
+        s.rows = row
 
     # Convert calculations per second to the index interval at which the convex volume algorithm must be run. Not exact.
-    time_between = 1 / calcs_per_second
-    interval = round(time_between / dt)
+    if calcs_per_second is None:
+        interval = 1
+    else:
+        time_between = 1 / calcs_per_second
+        interval = round(time_between / dt)
 
-    # Create convexhull at each interval and calculate its volume. This is the computationally expensive part.
-    vol = [ConvexHull(data[0:i:int(1/dt)]).volume for i in range(interval*col, len(data) + interval*col, interval*col)]
+    # Only every int(1/dt)th point of the (n, 3) data goes into the hull. Taking that subsample once up front means the
+    # points within the first i rows of data are exactly the first ceil(i / step) points of the subsample.
+    step = int(1/dt)
+    sample = data[::step]
+
+    # Grow the hull one checkpoint at a time. Each checkpoint only looks at the points added since the last one, so the
+    # total cost grows linearly with the length of the trial instead of rebuilding the hull over the whole prefix.
+    with span('hull') as s:
+        hull = CumulativeHull()
+        vol = []
+        start = 0
+        for i in range(interval*col, len(data) + interval*col, interval*col):
+            stop = -(-min(i, len(data)) // step)
+            vol.append(hull.add(sample[start:stop]))
+            start = stop
+        s.rows = len(sample)
 
     # Create corresponding time array to be plotted against
     time = np.arange(0, int(len(data)/col), interval)
     time = time * dt
     return vol, time
+
+
+class VolumeCurve:
+    # The curve of cumulative_vol() worked out as frames come in, for trials that are still being recorded (see
+    # live.py). Chunks of frames (TrialData) are given to add() and every checkpoint they complete is added to vol and
+    # time. Only the points of the new frames are folded into the hull, so a chunk costs the same however long the
+    # trial already is. Once the last frame is in, finish() adds the final, partial checkpoint and vol, time are then
+    # the same as cumulative_vol() gives for the whole file.
+
+    def __init__(self, calcs_per_second=5, caregiver=False):
+        self.calcs_per_second = calcs_per_second
+        self.caregiver = caregiver
+        self.hull = CumulativeHull()
+        self.vol = []
+        self.time = []
+        self.frames = 0
+        self.mean = None  # Means of the first col frames, which fill the nan values (see get_cols())
+        self.held = []  # Chunks held back until the means and the frame interval are known
+        self.waiting = []  # Sampled points of the checkpoint that isn't complete yet
+
+    def add(self, chunk):
+        # Folds the frames of a chunk into the curve. Returns the number of checkpoints added
+
+        body = chunk.caregiver(self.caregiver)
+        if self.mean is None:
+            self.held.append((body, chunk.time))
+            bodies, times = zip(*self.held)
+            if sum(len(t) for t in times) < max(body.shape[1], 2):
+                return 0
+            body = np.concatenate(bodies)
+            self.start(body, np.concatenate(times))
+            self.held = []
+
+        return self.fold(body)
+
+    def start(self, body, time):
+        # Works out the nan means, the checkpoint interval and the sampling step from the first frames, as get_cols()
+        # and cumulative_vol() do
+
+        self.col = body.shape[1]
+        self.mean = np.nanmean(body[:self.col], axis=1)
+        self.dt = float(time[1])
+        self.interval = 1 if self.calcs_per_second is None else round(1 / self.calcs_per_second / self.dt)
+        self.step = int(1/self.dt)
+
+    def fold(self, body):
+        # Fills, samples and folds in the points of new frames, checkpoint by checkpoint
+
+        added = 0
+        first = self.frames * self.col  # Position of the chunk's first point in the (n, 3) data of get_cols()
+        data = np.where(np.isnan(body), self.mean[None, :self.col], body).reshape(-1, 3)
+        self.frames += len(body)
+
+        # Points of the chunk that are in the every step-th point subsample
+        offset = -first % self.step
+        positions = np.arange(first + offset, first + len(data), self.step)
+        sample = data[offset::self.step]
+
+        # Checkpoint k holds every sampled point of the frames before (k + 1) * interval
+        done = len(self.vol)
+        while (done + 1) * self.interval <= self.frames:
+            end = np.searchsorted(positions, (done + 1) * self.interval * self.col)
+            self.checkpoint(sample[:end])
+            positions, sample = positions[end:], sample[end:]
+            done += 1
+            added += 1
+
+        self.waiting.append(sample)
+        return added
+
+    def checkpoint(self, sample):
+        # Adds the volume of every point up to the end of the next checkpoint
+
+        self.waiting.append(sample)
+        k = len(self.vol)
+        self.vol.append(self.hull.add(np.concatenate(self.waiting)))
+        self.time.append(k * self.interval * self.dt)
+        self.waiting = []
+
+    def finish(self):
+        # Adds the checkpoint of the frames after the last full interval, if there are any. Called once the recording
+        # has ended. Returns vol, time as cumulative_vol() does
+
+        if self.held:
+            # Fewer frames than markers (or than 2) in the whole trial
+            bodies, times = zip(*self.held)
+            body = np.concatenate(bodies)
+            self.start(body, np.concatenate(times))
+            self.held = []
+            self.fold(body)
+        if self.mean is not None and self.frames % self.interval:
+            self.checkpoint(np.empty((0, 3)))
+
+        return self.vol, np.array(self.time)
+
+
+# Roughly how many points a hull of a whole window can have before it takes longer than the prefix/suffix hulls used by
+# window_volumes() need per frame
+DIRECT_WINDOW_POINTS = 2000
+
+
+def hull_volume(points):
+    # Volume of the convex hull of an (n, 3) array of points. 0 if there are fewer than 4 points or they are coplanar
+
+    try:
+        return ConvexHull(points).volume
+    except (QhullError, ValueError):
+        return 0.0
+
+
+def frame_indices(frames, stride=1):
+    # Frames at which a volume series is calculated: every stride-th frame of the trial
+
+    return np.arange(0, frames, max(int(stride), 1))
+
+
+def instant_volumes(data, col, frames):
+    # Volume of the hull of the body-markers at each of the given frames. data is the (n, 3) array from get_cols()
+
+    return np.array([hull_volume(data[f*col:(f + 1)*col]) for f in frames])
+
+
+def window_volumes(data, col, frames, window):
+    # Volume of the hull of every point in the window frames up to and including each of the given frames (fewer at
+    # the start of the trial). frames must be sorted.
+    #
+    # Windows are worked out with blocks of window frames: a window that starts in block k and ends in block k + 1 is
+    # the part of block k from its start frame on (a suffix) plus the part of block k + 1 up to its end frame (a
+    # prefix). The hull vertices of every prefix and every suffix of a block are built incrementally with
+    # CumulativeHull, once per block, so each window costs one small hull of two vertex sets instead of a hull of
+    # window*col points. That work is done for every frame though, so when the volume is only wanted every few frames
+    # and the windows are small, a hull of each whole window is cheaper.
+
+    spacing = np.mean(np.diff(frames)) if len(frames) > 1 else window
+    if window * col <= DIRECT_WINDOW_POINTS * spacing:
+        return np.array([hull_volume(data[max(t - window + 1, 0)*col:(t + 1)*col]) for t in frames])
+
+    blocks = {}
+
+    def block(k):
+        # (prefix vertices, suffix vertices) for every frame of block k
+        if k not in blocks:
+            for old in [key for key in blocks if key < k - 1]:
+                del blocks[old]
+            first = k * window
+            last = min(first + window, len(data) // col)
+            prefix, suffix = [], []
+            hull = CumulativeHull()
+            for f in range(first, last):
+                hull.add(data[f*col:(f + 1)*col])
+                prefix.append(hull.vertices)
+            hull = CumulativeHull()
+            for f in range(last - 1, first - 1, -1):
+                hull.add(data[f*col:(f + 1)*col])
+                suffix.append(hull.vertices)
+            blocks[k] = (prefix, suffix[::-1])
+        return blocks[k]
+
+    vol = np.empty(len(frames))
+    for i, t in enumerate(frames):
+        start = max(t - window + 1, 0)
+        k = t // window
+        prefix = block(k)[0][t - k*window]
+        if start == k*window:
+            # The window is exactly the start of one block
+            vol[i] = hull_volume(prefix)
+        else:
+            suffix = block(k - 1)[1][start - (k - 1)*window]
+            vol[i] = hull_volume(np.concatenate((suffix, prefix)))
+
+    return vol
+
+
+def _volume_task(shm_name, shape, dtype, col, frames, window):
+    # Runs in a worker process: attaches to the shared marker array and calculates the volumes of some of the frames
+
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        if window is None:
+            return instant_volumes(data, col, frames)
+        return window_volumes(data, col, frames, window)
+    finally:
+        del data
+        shm.close()
+
+
+def volume_series(data, col, frames, window=None, jobs=1):
+    # Instantaneous (window=None) or sliding window volumes at the given frames. With jobs > 1 the frames are split
+    # between worker processes, which all read the marker data from one block of shared memory instead of each getting
+    # a pickled copy of it
+
+    if jobs <= 1 or len(frames) < 2*jobs:
+        if window is None:
+            return instant_volumes(data, col, frames)
+        return window_volumes(data, col, frames, window)
+
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        shared = np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)
+        shared[:] = data
+
+        # A few tasks per worker so that one slow part of the trial doesn't hold up the rest
+        parts = np.array_split(frames, 4 * jobs)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_volume_task, shm.name, data.shape, data.dtype, col, part, window)
+                       for part in parts if len(part)]
+            vol = np.concatenate([future.result() for future in futures])
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return vol
+
+
+@profiled('instant_vol')
+def instant_vol(name, stride=1, caregiver=False, jobs=1):
+    # Volume of the convex hull of the body-markers at every stride-th frame of a trial. caregiver is only used in dual
+    # caregiver trials, see ongoing_vol(). Returns arrays of volumes and of the capture times of those frames
+
+    file = tracked_file(name)
+    with span('get_cols') as s:
+        data, col, row, dt = get_cols(file, caregiver)
+        s.rows = row
+
+    frames = frame_indices(row, stride)
+    with span('hulls') as s:
+        vol = volume_series(data, col, frames, jobs=jobs)
+        s.rows = len(frames)
+
+    return vol, np.asarray(load_trial(file).time)[frames]
+
+
+@profiled('window_vol')
+def window_vol(name, seconds=1.0, stride=1, caregiver=False, jobs=1):
+    # Volume of the convex hull of every body-marker position in the last 'seconds' seconds, at every stride-th frame
+    # of a trial. At the start of the trial the window only holds the frames captured so far. caregiver is only used in
+    # dual caregiver trials, see ongoing_vol(). Returns arrays of volumes and of the capture times of those frames
+
+    file = tracked_file(name)
+    with span('get_cols') as s:
+        data, col, row, dt = get_cols(file, caregiver)
+        s.rows = row
+
+    window = max(int(round(seconds / dt)), 1)
+    frames = frame_indices(row, stride)
+    with span('hulls') as s:
+        vol = volume_series(data, col, frames, window=window, jobs=jobs)
+        s.rows = len(frames)
+
+    return vol, np.asarray(load_trial(file).time)[frames]
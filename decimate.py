@@ -0,0 +1,187 @@
+"""
+Shape-preserving downsampling of the heart rate and cumulative volume traces of the event plots.
+
+An axis is only ~1500 pixels wide, but a long trial's volume curve at full frame rate has hundreds of thousands of
+points. A Trace sits between the data and the artist: it keeps the full x, y of a trace and gives the artist only the
+points of the visible x range, cut down to the pixel width of the axis. Whenever the x limits (zooming, panning) or the
+width of the axis (resizing the window) change, the visible part is decimated again, so drawing costs depend on the size
+of the axis and not on the length of the data. Traces already small enough are drawn as they are.
+
+Two methods:
+    minmax  the first, lowest, highest and last point of every pixel-wide bucket of x, in their original order. Keeps
+            every peak and valley exactly, so the drawn trace looks the same as the full one at that width
+    lttb    Largest-Triangle-Three-Buckets: the one point of every bucket that forms the largest triangle with the
+            point kept from the previous bucket and the mean of the next bucket. Keeps the shape with half the points
+"""
+
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+# Default method, 'minmax' or 'lttb'. None draws every point
+METHOD = 'minmax'
+
+
+def minmax(x, y, buckets):
+    # Points to keep out of x (sorted), y so that every one of the buckets (equal ranges of x) keeps its first, lowest,
+    # highest and last point. Returns the decimated x, y
+
+    n = len(x)
+    if n <= 4 * buckets:
+        return x, y
+
+    # Bucket of every point. x is sorted, so each bucket is a contiguous run of points
+    edges = x[0] + (x[-1] - x[0]) * np.arange(1, buckets) / buckets
+    bucket = np.searchsorted(edges, x, side='right')
+    counts = np.bincount(bucket, minlength=buckets)
+    counts = counts[counts > 0]
+    starts = np.cumsum(counts) - counts
+
+    keep = [starts, starts + counts - 1]
+    for reduce in (np.minimum, np.maximum):
+        # Extreme of every bucket, then the first point of each bucket that reaches it
+        extreme = np.repeat(reduce.reduceat(y, starts), counts)
+        hits = np.flatnonzero(y == extreme)
+        keep.append(hits[np.unique(bucket[hits], return_index=True)[1]])
+    keep = np.unique(np.concatenate(keep))
+
+    return x[keep], y[keep]
+
+
+def lttb(x, y, points):
+    # Largest-Triangle-Three-Buckets down to the given number of points, the first and last point included. Returns
+    # the decimated x, y
+
+    n = len(x)
+    if points >= n or points < 3:
+        return x, y
+
+    # points - 2 buckets of (close to) equal numbers of points between the first and the last point
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+
+    # Third corner of each bucket's triangles: the mean of the next bucket, or the last point for the last bucket
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    # Each bucket depends on the point kept from the one before it, so buckets are gone through in order. Areas within
+    # a bucket are worked out together, so this loops once per bucket (per pixel) and not once per point
+    keep = np.empty(points, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for b in range(points - 2):
+        lo, hi = edges[b], edges[b + 1]
+        area = np.abs((x[a] - next_x[b]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[b] - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[b + 1] = a
+
+    return x[keep], y[keep]
+
+
+def decimate(x, y, pixels, method=None):
+    # x, y cut down for an axis the given number of pixels wide. method is 'minmax', 'lttb' or None for METHOD
+
+    method = METHOD if method is None else method
+    if method == 'minmax':
+        return minmax(x, y, pixels)
+    if method == 'lttb':
+        return lttb(x, y, 2 * pixels)
+    return x, y
+
+
+class Trace(ABC):
+    # The full data of one trace on an axis. show() puts decimated data on the artist; subclasses say how
+
+    def __init__(self, ax, x, y, method=None):
+        self.ax = ax
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.method = method
+        self.shown = None  # (x limits, pixel width) the artist was last given data for
+
+        # Twin axes share x limits but only the axis whose limits were set gets the callback, so every axis sharing x
+        # is watched. The lambda keeps this object alive as long as the axes are (callbacks hold methods weakly)
+        self.callbacks = [(other, other.callbacks.connect('xlim_changed', lambda changed: self.update()))
+                          for other in ax.get_shared_x_axes().get_siblings(ax)]
+        # Resizing the window changes the pixel width without changing the limits. update() only decimates again when
+        # the width has changed
+        self.resize = ax.figure.canvas.mpl_connect('resize_event', lambda event: self.update())
+
+        # The whole trace to start with, so that autoscaling sees all of the data. A trace that fits the axis as it is
+        # never needs decimating again, zooming in only leaves fewer points
+        x, y = decimate(self.x, self.y, self.pixels(), self.method)
+        self.small = len(x) == len(self.x)
+        self.show(x, y)
+
+    def visible(self):
+        # Part of the data within the x limits, plus one point either side so the trace runs to the edges
+
+        lo, hi = sorted(self.ax.get_xlim())
+        first = max(np.searchsorted(self.x, lo) - 1, 0)
+        last = np.searchsorted(self.x, hi, side='right') + 1
+        return self.x[first:last], self.y[first:last]
+
+    def pixels(self):
+
+        return max(int(self.ax.bbox.width), 1)
+
+    def update(self):
+        # Decimates the visible part of the data for the current limits and width of the axis
+
+        pixels = self.pixels()
+        view = (self.ax.get_xlim(), pixels)
+        if self.small or view == self.shown:
+            return
+        self.shown = view
+
+        x, y = self.visible()
+        self.show(*decimate(x, y, pixels, self.method))
+
+    @abstractmethod
+    def show(self, x, y):
+        # Gives the artist the x, y to draw
+        pass
+
+    def remove(self):
+        # Stops following the axis limits and the window size
+
+        for ax, cid in self.callbacks:
+            ax.callbacks.disconnect(cid)
+        self.callbacks = []
+        if self.resize is not None:
+            self.ax.figure.canvas.mpl_disconnect(self.resize)
+            self.resize = None
+
+
+class LineTrace(Trace):
+    # Trace drawn by a Line2D
+
+    def __init__(self, ax, line, x, y, method=None):
+        self.line = line
+        super().__init__(ax, x, y, method)
+
+    def show(self, x, y):
+        self.line.set_data(x, y)
+
+
+class FillTrace(Trace):
+    # Trace drawn as the area between it and 0 with fill_between(). A fill can't be given new data, so a new one is
+    # made every time and artist is the current one
+
+    def __init__(self, ax, x, y, method=None, **kwargs):
+        self.kwargs = kwargs
+        self.artist = None
+        super().__init__(ax, x, y, method)
+
+    def show(self, x, y):
+        if self.artist is not None:
+            self.artist.remove()
+        self.artist = self.ax.fill_between(x, 0, y, **self.kwargs)
+
+    def remove(self):
+        super().remove()
+        if self.artist is not None:
+            self.artist.remove()
+            self.artist = None
@@ -0,0 +1,75 @@
+"""
+Behavior bars of the event plots (eventplot_single.py and eventplot_dual.py).
+
+Every bar of an axis (one per state, one per retrieving/returning instance and one per CPR segment) is a segment of a
+single LineCollection, built from arrays of start and stop times instead of one hlines() artist per interval. Densely
+annotated trials therefore still have one artist per axis to draw and pan. State colors are taken from a colormap
+so that any number of states gets its own color.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+import matplotlib.colors as colors
+
+
+# States get the colors of this colormap in order. Procedures with more states than it has colors get colors spread
+# evenly over MANY_STATES_COLORMAP instead
+STATE_COLORMAP = 'tab10'
+MANY_STATES_COLORMAP = 'hsv'
+
+REACH_COLOR = 'k'
+CPR_COLOR = 'yellow'
+
+BAR_WIDTH = 28
+BAR_ALPHA = .8
+
+
+def state_colors(n):
+    # RGBA colors of n states as an (n, 4) array
+
+    cmap = plt.get_cmap(STATE_COLORMAP)
+    if n <= cmap.N:
+        return cmap(np.arange(n))
+    return plt.get_cmap(MANY_STATES_COLORMAP)(np.arange(n) / n)
+
+
+def pairs(times):
+    # [start, stop, start, stop...] as an (intervals, 2) array. A start without a stop is dropped
+
+    times = np.asarray(times, dtype=float)
+    return times[:len(times) // 2 * 2].reshape(-1, 2)
+
+
+def bar_segments(states, time_list, cpr=None, cpr_levels=None):
+    # Segments and colors of the bars of one axis. states and time_list are the states (without CPR, the last one being
+    # retrieving/returning) and their start/stop times from observation.get_observation(). Every state but the last is
+    # drawn from its first start to its first stop, on its own level counted from the top. Every instance of the last
+    # state is drawn, in black, on the bottom level. cpr and cpr_levels (see find_cpr_levels()) add the CPR segments,
+    # in yellow, on the level of the state they happened in. Returns a (bars, 2, 2) array of segments and a (bars, 4)
+    # array of colors
+
+    n = len(states)
+    first = np.array([times[:2] for times in time_list[:-1]], dtype=float).reshape(-1, 2)
+    reach = pairs(time_list[-1])
+    cpr_levels = np.asarray(cpr_levels if cpr_levels is not None else [], dtype=float)
+    compressions = pairs(cpr if cpr is not None else [])[:len(cpr_levels)]
+
+    levels = np.concatenate((n - np.arange(n - 1), np.ones(len(reach)), n - cpr_levels))
+    intervals = np.concatenate((first, reach, compressions))
+
+    segments = np.stack((np.column_stack((intervals[:, 0], levels)), np.column_stack((intervals[:, 1], levels))),
+                        axis=1)
+    bar_colors = np.concatenate((state_colors(n - 1),
+                                 np.tile(colors.to_rgba(REACH_COLOR), (len(reach), 1)),
+                                 np.tile(colors.to_rgba(CPR_COLOR), (len(compressions), 1))))
+
+    return segments, bar_colors
+
+
+def add_bars(ax, segments, bar_colors):
+    # Adds the bars to an axis as one LineCollection. Returns the collection
+
+    bars = LineCollection(segments, colors=bar_colors, linewidths=BAR_WIDTH, alpha=BAR_ALPHA)
+    ax.add_collection(bars)
+    return bars
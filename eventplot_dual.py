@@ -14,29 +14,34 @@ Areas for improvement:
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
-from observation import get_observation
+from observation import get_observation, load_observation
 from cumulative_volume import ongoing_vol
 from heartrate import plot_hr
+from profiling import span, profiled
+from event_bars import bar_segments, add_bars
+from decimate import FillTrace
 
 
-def find_cpr_levels(obv, cpr):
-    # Finds that states during which CPR occurred so that the yellow compressions on the plot are overlaid at the same
-    # vertical level
+def find_cpr_levels(observation, states, cpr, subject=None):
+    # Finds the states during which CPR occurred so that the yellow compressions on the plot are overlaid at the same
+    # vertical level. states is the list of states without CPR. The last state (retrieving/returning) is never used.
+    # cpr is the list of CPR start/stop times
 
-    levels = []
-    for i in range(0, len(cpr), 2):
-        height = [x for x in range(len(obv)-1) if (obv[x][0] <= cpr[i] and obv[x][1] >= cpr[i+1])]
-        levels.append(height[0])
-    return levels
+    levels = observation.containing(cpr[0::2], cpr[1::2], states[:-1], subject=subject)
+    if np.any(levels < 0):
+        raise IndexError('CPR occurred outside of every state')
+    return levels.tolist()
 
 
-def plot_event(file, calcs_per_second=3, top_subject='S07', bottom_subject='S08'):
+@profiled('plot_event')
+def plot_event(file, calcs_per_second=3, top_subject='S07', bottom_subject='S08', show=True):
     """
-    Main Function
+    Main Function. Returns the figure. With show=False the figure is not shown so that it can be saved instead
     """
 
     # Get data from BORIS observation. Only data pertaining to specified subject is returned
-    states, obv = get_observation(file, specified_subject=top_subject)
+    with span('observation'):
+        states, obv = get_observation(file, specified_subject=top_subject)
 
     # If CPR occurred during trial, separate CPR into other variable
     cpr_exists = True
@@ -57,33 +62,20 @@ def plot_event(file, calcs_per_second=3, top_subject='S07', bottom_subject='S08'
         cpr_exists = False
         print('ValueError: CPR is not in the list')
 
-    color = ['b', 'm', 'peru', 'g', 'violet', 'orange', 'cyan']
-
     # Create figure
     fig, (ax1, ax3) = plt.subplots(2, 1, sharex='col', figsize=(15, 6))
 
-    # Add horizontal lines representing the states
-    for i in range(len(states)):
-
-        # Retrieving/Returning is the only state that occurs more than once (so far) besides cpr. It needs its own
-        # for-loop to iterate through all the instances of retrieving/returning.
-        if i == len(states) - 1:
-            for j in range(0, len(obv[-1]), 2):
-                ax1.hlines(y=len(states) - i, xmin=obv[-1][j], xmax=obv[-1][j + 1], lw=28, colors='k', alpha=.8)
-
-        # Plot all other states
-        else:
-            ax1.hlines(y=len(states) - i, xmin=obv[i][0], xmax=obv[i][1], lw=28, colors=color[i], alpha=.8)
-
-    # Add yellow sections when cpr is being performed
+    # Add horizontal bars representing the states, every instance of retrieving/returning (the only state besides cpr
+    # that occurs more than once so far) and yellow sections when cpr is being performed. One collection per axis, see
+    # event_bars.py
     if cpr_exists:
-        cpr_levels = find_cpr_levels(obv, cpr)
-        for i in range(0, (2 * len(cpr_levels)) - 1, 2):
-            ax1.hlines(y=len(states) - cpr_levels[int(i / 2)],
-                       xmin=cpr[i], xmax=cpr[i + 1], lw=28, colors='yellow', alpha=.8)
+        cpr_levels = find_cpr_levels(load_observation(file), states, cpr, subject=top_subject)
+        add_bars(ax1, *bar_segments(states, obv, cpr, cpr_levels))
+    else:
+        add_bars(ax1, *bar_segments(states, obv))
 
-    # Call ongoing_vol. Computationally expensive. As calcs_per_second is decreased, the convex volume will be
-    # calculated less often and this function will execute more quickly.
+    # Call ongoing_vol. The hull is grown incrementally so the cost grows linearly with trial length. calcs_per_second
+    # only sets how finely the curve is sampled; None calculates the volume at every captured frame.
     vol_arr, time_arr = ongoing_vol(file, calcs_per_second=calcs_per_second, caregiver=1)
 
     # Normalize volume so it fits just beneath the legend
@@ -91,12 +83,14 @@ def plot_event(file, calcs_per_second=3, top_subject='S07', bottom_subject='S08'
     vol_arr = [v * (len(states) - 1) for v in vol_arr]
     vol_arr = [v / max_vol for v in vol_arr]
 
-    ax1.fill_between(time_arr, 0, vol_arr, alpha=.4, facecolor='blue', zorder=0, label='Convex Volume')
+    # Only as many points as the axis can show are drawn, see decimate.py
+    FillTrace(ax1, time_arr, vol_arr, alpha=.4, facecolor='blue', zorder=0, label='Convex Volume')
 
     # Plot heart rate on a duplicated axis
     try:
         ax2 = ax1.twinx()
-        plot_hr(ax2, file, subject=top_subject)
+        with span('heart rate'):
+            plot_hr(ax2, file, subject=top_subject)
         ax2.yaxis.label.set_color('r')
         ax2.tick_params('y', colors='r')
         ax2.set_ylabel('Heart Rate (BPM)', color='r')
@@ -122,7 +116,8 @@ def plot_event(file, calcs_per_second=3, top_subject='S07', bottom_subject='S08'
 
     ###########################################################################################################
 
-    states, obv = get_observation(file, specified_subject=bottom_subject)
+    with span('observation'):
+        states, obv = get_observation(file, specified_subject=bottom_subject)
 
     # If CPR occurred during trial, separate CPR into other variable
     cpr_exists = True
@@ -141,28 +136,15 @@ def plot_event(file, calcs_per_second=3, top_subject='S07', bottom_subject='S08'
         cpr_exists = False
         print('ValueError: CPR is not in the list')
 
-    # Add horizontal lines
-    for i in range(len(states)):
-
-        # Retrieving/Returning is the only state that occurs more than once (so far). It needs its own for-loop to
-        # iterate through all the instances of retrieving/returning.
-        if i == len(states) - 1:
-            for j in range(0, len(obv[-1]), 2):
-                ax3.hlines(y=len(states) - i, xmin=obv[-1][j], xmax=obv[-1][j + 1], lw=28, colors='k', alpha=.8)
-
-        # Plot all other states
-        else:
-            ax3.hlines(y=len(states) - i, xmin=obv[i][0], xmax=obv[i][1], lw=28, colors=color[i], alpha=.8)
-
-    # Add yellow sections when cpr is being performed
+    # Add horizontal bars
     if cpr_exists:
-        cpr_levels = find_cpr_levels(obv, cpr)
-        for i in range(0, (2 * len(cpr_levels)) - 1, 2):
-            ax3.hlines(y=len(states) - cpr_levels[int(i / 2)],
-                       xmin=cpr[i], xmax=cpr[i + 1], lw=28, colors='yellow', alpha=.8)
+        cpr_levels = find_cpr_levels(load_observation(file), states, cpr, subject=bottom_subject)
+        add_bars(ax3, *bar_segments(states, obv, cpr, cpr_levels))
+    else:
+        add_bars(ax3, *bar_segments(states, obv))
 
-    # Call ongoing_vol. Computationally expensive. As calcs_per_second is decreased, the convex volume will be
-    # calculated less often and this function will execute more quickly.
+    # Call ongoing_vol. The hull is grown incrementally so the cost grows linearly with trial length. calcs_per_second
+    # only sets how finely the curve is sampled; None calculates the volume at every captured frame.
     vol_arr, time_arr = ongoing_vol(file, calcs_per_second=calcs_per_second, caregiver=2)
 
     # Normalize volume so it fits just beneath the legend
@@ -170,12 +152,13 @@ def plot_event(file, calcs_per_second=3, top_subject='S07', bottom_subject='S08'
     vol_arr = [v * (len(states) - 1) for v in vol_arr]
     vol_arr = [v / max_vol for v in vol_arr]
 
-    ax3.fill_between(time_arr, 0, vol_arr, alpha=.4, facecolor='blue', zorder=0, label='Convex Volume')
+    FillTrace(ax3, time_arr, vol_arr, alpha=.4, facecolor='blue', zorder=0, label='Convex Volume')
 
     # Plot heart rate on a second axis
     try:
         ax4 = ax3.twinx()
-        plot_hr(ax4, file, subject=bottom_subject)
+        with span('heart rate'):
+            plot_hr(ax4, file, subject=bottom_subject)
         ax4.yaxis.label.set_color('r')
         ax4.tick_params('y', colors='r')
         ax4.set_ylabel('Heart Rate (BPM)', color='r')
@@ -194,13 +177,16 @@ def plot_event(file, calcs_per_second=3, top_subject='S07', bottom_subject='S08'
     ax3.set_xlabel('Time (s)')
     ax3.set_title(bottom_subject)
 
-    plt.show()
+    if show:
+        plt.show()
+
+    return fig
 
 
 if __name__ == "__main__":
 
-    # Times per second that the program stops to calculate cumulative convex volume. The lower the value, the faster
-    # the program
+    # Times per second that the program stops to calculate cumulative convex volume. None calculates it at every
+    # captured frame
     calcs_per_second = 2.0
 
     #############################################################################################################
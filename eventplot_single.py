@@ -11,39 +11,51 @@ Areas for improvement:
     The method for obtaining just the CPR states and then removing them from the states and time_list is not optimal.
     The states have to be defined in BORIS as the exact strings that the plot_events() functions is looking for
     e.g. 'CPR', and 'CPR single round'.
-
-    Variable 'color', the list of colors, was filled with an arbitrary number of options for colors. It's possible that
-    a procedure with a large number of sub-processes could exhaust these colors which would raise an error
 """
 
+import queue
+import threading
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
-from observation import get_observation
-from cumulative_volume import ongoing_vol
-from heartrate import plot_hr
+from observation import get_observation, load_observation
+from cumulative_volume import ongoing_vol, progressive_vol
+from heartrate import hr_2_np, HR_MIN, HR_MAX
+from profiling import span, profiled
+from catalog import parse_name
+from event_bars import bar_segments, add_bars
+from decimate import LineTrace, FillTrace
 
 
-def find_cpr_levels(obv, cpr):
+def find_cpr_levels(observation, states, cpr, subject=None):
     # Finds the states during which CPR occurred so that the yellow compressions on the plot are overlaid at the same
-    # vertical level
+    # vertical level. states is the list of states without CPR. The last state (retrieving/returning) is never used.
+    # cpr is the list of CPR start/stop times
 
-    levels = []
-    for i in range(0, len(cpr), 2):
-        height = [x for x in range(len(obv)-1) if (obv[x][0] <= cpr[i] and obv[x][1] >= cpr[i+1])]
-        levels.append(height[0])
-    return levels
+    levels = observation.containing(cpr[0::2], cpr[1::2], states[:-1], subject=subject)
+    if np.any(levels < 0):
+        raise IndexError('CPR occurred outside of every state')
+    return levels.tolist()
 
 
-def plot_events(name, calcs_per_second=5.0):
-    """
-    Main Function
-    """
+def normalize_vol(vol_arr, states):
+    # Scales the volume so it fits just beneath the legend
+
+    max_vol = max(vol_arr)
+    vol_arr = [v*(len(states)-1) for v in vol_arr]
+    return [v/max_vol for v in vol_arr]
+
+
+def event_data(name, calcs_per_second=5.0, volume=True):
+    # Gathers everything that changes from trial to trial in the event plot: the behavior bars, the cumulative volume
+    # and the heart rate. Returns a dict that EventFigure.update() draws. volume=False leaves the volume out (see
+    # EventFigure.stream_volume())
 
-    subject = name[5:8]
+    subject = parse_name(name).subject
 
     # Get data from BORIS observation. Only data pertaining to specified subject is returned
-    states, time_list = get_observation(name)
+    with span('observation'):
+        states, time_list = get_observation(name)
 
     # If CPR occurred during trial, separate CPR into other variable
     cpr_exists = True
@@ -64,82 +76,227 @@ def plot_events(name, calcs_per_second=5.0):
         cpr_exists = False
         print('ValueError: CPR is not in the list')
 
-    color = ['b', 'm', 'peru', 'g', 'violet', 'orange', 'cyan', 'dimgrey', 'r', 'lime', 'magenta']
-
-    # Create figure
-    fig, ax1 = plt.subplots(figsize=(15, 6))
-
-    # Add horizontal lines representing the states
-    for i in range(len(states)):
-
-        # Retrieving/Returning is the only state that occurs more than once (so far). It needs its own for-loop to
-        # iterate through all the instances of retrieving/returning.
-        if i == len(states)-1:
-            for j in range(0, len(time_list[-1]), 2):
-                ax1.hlines(y=len(states)-i, xmin=time_list[-1][j], xmax=time_list[-1][j+1], lw=28, colors='k', alpha=.8)
-
-        # Plot all other states
-        else:
-            ax1.hlines(y=len(states)-i, xmin=time_list[i][0], xmax=time_list[i][1], lw=28, colors=color[i], alpha=.8)
-
-    # Add yellow sections when cpr is being performed
+    # Horizontal bars representing the states, every instance of retrieving/returning (the only state that occurs more
+    # than once so far) and yellow sections when cpr is being performed, as (segments, colors)
     if cpr_exists:
-        cpr_levels = find_cpr_levels(time_list, cpr)
-        for i in range(0, (2*len(cpr_levels))-1, 2):
-            ax1.hlines(y=len(states)-cpr_levels[int(i/2)],
-                       xmin=cpr[i], xmax=cpr[i+1], lw=28, colors='yellow', alpha=.8)
+        cpr_levels = find_cpr_levels(load_observation(name), states, cpr)
+        bars = bar_segments(states, time_list, cpr, cpr_levels)
+    else:
+        bars = bar_segments(states, time_list)
 
-    # Call ongoing_vol. Computationally expensive. As calcs_per_second is decreased, the convex volume will be
-    # calculated less often and this function will execute more quickly.
+    # Call ongoing_vol. The hull is grown incrementally so the cost grows linearly with trial length. calcs_per_second
+    # only sets how finely the curve is sampled; None calculates the volume at every captured frame.
     try:
-        vol_arr, time_arr = ongoing_vol(name, calcs_per_second=calcs_per_second)
-
-        # Normalize volume so it fits just beneath the legend
-        max_vol = max(vol_arr)
-        vol_arr = [v*(len(states)-1) for v in vol_arr]
-        vol_arr = [v/max_vol for v in vol_arr]
-
-        ax1.fill_between(time_arr, 0, vol_arr, alpha=.4, facecolor='blue', zorder=0, label='Convex Volume')
+        if volume:
+            vol_arr, time_arr = ongoing_vol(name, calcs_per_second=calcs_per_second)
+            vol_arr = normalize_vol(vol_arr, states)
+        else:
+            vol_arr, time_arr = None, None
     # In case tracked mo cop file is not found
     except FileNotFoundError:
+        vol_arr, time_arr = None, None
         print('FileNotFoundError: Tracked marker data file not found')
 
-    # Plot heart rate on a second axis
+    # Heart rate
     try:
-        ax2 = ax1.twinx()
-        plot_hr(ax2, name, subject=subject)
-        ax2.yaxis.label.set_color('r')
-        ax2.tick_params('y', colors='r')
-        ax2.set_ylabel('Heart Rate (BPM)', color='r')
+        with span('heart rate'):
+            hr = hr_2_np(name, subject)
     except KeyError:
-        ax2.axis('off')
+        hr = None
         print('Heart Rate plot unsuccessful')  # Most likely because heart rate wasn't gathered for this trial
 
-    # Plotting parameters
-    custom_lines = [Line2D([0], [0], color='blue', alpha=.4, lw=6),
-                    Line2D([0], [0], color='r', lw=2),
-                    Line2D([0], [0], color='yellow', alpha=.7, lw=9)]
-    ax1.legend(custom_lines, ['Convex Volume', 'Heart Rate', 'Compressions'], loc='upper right')
-    ax1.set_title(name)
-    ax1.set_xlabel('Time (s)')
-    ax1.yaxis.set_ticks(np.arange(1, len(states)+1, 1))
-    states[-1] = 'Retrieving/Returning' + '\n' + 'Equipment'  # Putting a newline in an excessively long string
-    ax1.set_yticklabels(np.flip(states, axis=0), fontsize=10)
-    ax1.margins(x=0)
-    ax1.grid(True)
-    ax1.set_ylim(0, len(states)+1)
-    try:
-        ax1.set_xlim(0, time_arr[-1])
-    except NameError:
+    if vol_arr is None and volume:
         print('Warning: no tracked marker data file found. x axis has default margins')
 
-    plt.show()
+    states[-1] = 'Retrieving/Returning' + '\n' + 'Equipment'  # Putting a newline in an excessively long string
+
+    return {'title': name, 'states': states, 'bars': bars, 'vol': vol_arr, 'time': time_arr, 'hr': hr}
+
+
+class EventFigure:
+    # The event plot figure. As with heatmap.HeatmapFigure, the figure, its twin axes, legend and styling are created
+    # once and update() swaps in the data of each trial, so many trials can be rendered in a row (see mse_plot.py)
+    # without paying for figure setup every time. All of the behavior bars are kept in one collection (see
+    # event_bars.py).
+
+    def __init__(self):
+
+        # Create figure
+        self.fig, ax1 = plt.subplots(figsize=(15, 6))
+        self.ax1 = ax1
+
+        # Horizontal lines representing the states. Segments and colors are set in update()
+        self.bars = add_bars(ax1, np.zeros((0, 2, 2)), np.zeros((0, 4)))
+
+        # Convex volume area and heart rate traces, which only hand the artists as many points as the axis can show (see
+        # decimate.py). Replaced in update()
+        self.volume = None
+        self.hr_trace = None
+
+        # Heart rate on a second axis
+        self.ax2 = ax1.twinx()
+        self.hr_line = self.ax2.plot([], [], c='r', zorder=1, alpha=.7)[0]
+        self.ax2.set_ylim(HR_MIN, HR_MAX)
+        self.ax2.yaxis.label.set_color('r')
+        self.ax2.tick_params('y', colors='r')
+        self.ax2.set_ylabel('Heart Rate (BPM)', color='r')
+
+        # Plotting parameters
+        custom_lines = [Line2D([0], [0], color='blue', alpha=.4, lw=6),
+                        Line2D([0], [0], color='r', lw=2),
+                        Line2D([0], [0], color='yellow', alpha=.7, lw=9)]
+        ax1.legend(custom_lines, ['Convex Volume', 'Heart Rate', 'Compressions'], loc='upper right')
+        ax1.set_xlabel('Time (s)')
+        ax1.margins(x=0)
+        ax1.grid(True)
+
+    def update(self, data):
+        # Draws the data of one trial (see event_data()) in place of the previous one. Returns the figure
+
+        ax1 = self.ax1
+        states = data['states']
+
+        segments, bar_colors = data['bars']
+        self.bars.set_segments(segments)
+        self.bars.set_color(bar_colors)
+
+        self.set_volume(data['vol'], data['time'])
+
+        if self.hr_trace is not None:
+            self.hr_trace.remove()
+            self.hr_trace = None
+        if data['hr'] is None:
+            self.hr_line.set_data([], [])
+            self.ax2.axis('off')
+        else:
+            self.hr_trace = LineTrace(self.ax2, self.hr_line, np.arange(len(data['hr'])), data['hr'])
+            self.ax2.axis('on')
+
+        ax1.set_title(data['title'])
+        ax1.yaxis.set_ticks(np.arange(1, len(states)+1, 1))
+        ax1.set_yticklabels(np.flip(states, axis=0), fontsize=10)
+        ax1.set_ylim(0, len(states)+1)
+
+        if data['time'] is not None:
+            ax1.set_xlim(0, data['time'][-1])
+        else:
+            # Default margins from the data of this trial only
+            ax1.set_autoscalex_on(True)
+            ax1.relim()
+            ax1.update_datalim(segments.reshape(-1, 2))
+            self.ax2.relim()
+            ax1.autoscale_view(scaley=False)
+
+        return self.fig
+
+    def set_volume(self, vol, time):
+        # Replaces the convex volume area (already normalized, see normalize_vol()). None removes it
+
+        if self.volume is not None:
+            self.volume.remove()
+            self.volume = None
+        if vol is not None:
+            self.volume = FillTrace(self.ax1, time, vol, alpha=.4, facecolor='blue', zorder=0, label='Convex Volume')
+            self.ax1.set_xlim(0, time[-1])
+
+    def stream_volume(self, name, states, calcs_per_second=5.0):
+        # Works out the cumulative volume of a trial in a background thread and draws each curve as it comes in: first
+        # coarse ones, then the full curve (see cumulative_volume.progressive_vol()). The figure is only touched from
+        # the thread running the figure's event loop, through a timer. Returns a VolumeStream; call its wait() to get
+        # the final curve drawn when the figure isn't shown.
+
+        stream = VolumeStream(self, name, states, calcs_per_second)
+        stream.start()
+        return stream
+
+
+class VolumeStream:
+    # Background calculation of an event plot's cumulative volume. See EventFigure.stream_volume()
+
+    def __init__(self, figure, name, states, calcs_per_second=5.0):
+        self.figure = figure
+        self.name = name
+        self.states = states
+        self.calcs_per_second = calcs_per_second
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.timer = figure.fig.canvas.new_timer(interval=100)
+        self.timer.add_callback(self.poll)
+
+    def start(self):
+        self.thread.start()
+        self.timer.start()
+
+    def work(self):
+        # Runs in the background thread. Puts every curve on the queue, then None when done
+
+        try:
+            for vol_arr, time_arr in progressive_vol(self.name, calcs_per_second=self.calcs_per_second):
+                self.results.put((normalize_vol(vol_arr, self.states), time_arr))
+        except FileNotFoundError:
+            print('FileNotFoundError: Tracked marker data file not found')
+            print('Warning: no tracked marker data file found. x axis has default margins')
+        finally:
+            self.results.put(None)
+
+    def poll(self):
+        # Draws the newest curve on the queue. Returns True once the final curve has been drawn
+
+        latest, done = None, False
+        while True:
+            try:
+                item = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                done = True
+            else:
+                latest = item
+
+        if latest is not None:
+            self.figure.set_volume(*latest)
+            self.figure.fig.canvas.draw_idle()
+        if done:
+            self.timer.stop()
+        return done
+
+    def wait(self):
+        # Blocks until the final curve is worked out and drawn
+
+        self.thread.join()
+        self.poll()
+
+
+@profiled('plot_events')
+def plot_events(name, calcs_per_second=5.0, show=True, progressive=False):
+    """
+    Main Function. Returns the figure. With show=False the figure is not shown so that it can be saved instead.
+
+    With progressive=True the figure opens as soon as the behaviors and heart rate are loaded and the cumulative volume
+    is drawn in as it is worked out, coarse first and then at calcs_per_second.
+    """
+
+    with span('event data'):
+        data = event_data(name, calcs_per_second=calcs_per_second, volume=not progressive)
+    with span('draw'):
+        figure = EventFigure()
+        fig = figure.update(data)
+
+    if progressive:
+        stream = figure.stream_volume(name, data['states'], calcs_per_second=calcs_per_second)
+        if not show:
+            stream.wait()
+
+    if show:
+        plt.show()
+
+    return fig
 
 
 if __name__ == "__main__":
 
-    # Times per second that the program stops to calculate cumulative convex volume. The lower the value, the faster
-    # the program
+    # Times per second that the program stops to calculate cumulative convex volume. None calculates it at every
+    # captured frame
     calcs_per_second = 1.5
 
     #############################################################################################################
@@ -1,23 +1,21 @@
-import pandas as pd
-import numpy as np
 import warnings
+import numpy as np
+from metadata import heart_rates
+from catalog import parse_name, heart_rate_key
+from decimate import LineTrace
 
 
-def hr_2_np(name, subject):
-    # Loads heart rate data as pandas DataFrame and returns numpy array
+# hmin and hmax have been hardcoded to the maximum and minimum found across both subjects and across all trials up to
+# Fall 2018 in order for the axes across all plots to be consistent. This range will probably suffice for future trials.
+HR_MIN = 55
+HR_MAX = 126
 
-    file = 'heartrate_data/HeartRate_' + subject + '.csv'
-    df = pd.read_csv(file, index_col=0, header=[0, 1, 2])
-    df = df.loc['1':, :]
 
-    trial = name[12:15]
-    volume = name[16:19]
-    attempt_number = name[20]
-
-    hr = df.loc[:, (trial, volume, attempt_number)].values
-    hr = hr[~np.isnan(hr)]
+def hr_2_np(name, subject):
+    # Returns heart rate data of a trial as numpy array. The subject's heart rate table is only read once, see
+    # metadata.py. Raises KeyError if there is no heart rate for the trial
 
-    return hr
+    return heart_rates(subject)[heart_rate_key(parse_name(name))]
 
 
 def plot_hr(ax, name, subject):
@@ -25,12 +23,10 @@ def plot_hr(ax, name, subject):
 
     hr = hr_2_np(name, subject)
 
-    # hmin and hmax have been hardcoded to the maximum and minimum found across both subjects and across all trials up
-    # to Fall 2018 in order for the axes across all plots to be consistent. This range will probably suffice for future
-    # trials.
-    hmin = 55
-    hmax = 126
     warnings.warn('Warning: heart rate range has been hardcoded to 55-126 BPM')
 
-    ax.plot(hr, c='r', zorder=1, alpha=.7)
-    ax.set_ylim(hmin, hmax)
+    # Only as many points as the axis can show are drawn, see decimate.py
+    x = np.arange(len(hr))
+    line = ax.plot(x, hr, c='r', zorder=1, alpha=.7)[0]
+    LineTrace(ax, line, x, hr)
+    ax.set_ylim(HR_MIN, HR_MAX)
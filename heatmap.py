@@ -10,12 +10,10 @@ BL - viewing testing area from the top (-y)   BR - feet data only, viewing testi
 Margins of the plots are created case-by-case so they will change between trials and the location of the
 table/frame/origin will change with them.
 
-Areas for improvement:
-    Each time marker data is needed, a csv is read and the desired markers/columns are extracted. All of the get
-    functions (get_feet, get_table...) read the csv every time they are called. A more streamlined script would read the
-    csv once per execution and then the get functions would access this variable that's already been created and pull
-    the columns they need. However, reading the csv multiple times takes very little time.
+Marker data is read once per trial through trial_data.load_trial(). All of the get functions (get_feet, get_table...)
+pull the markers they need from that one parse.
 
+Areas for improvement:
     Figure out how to make each subplot a true 1:1 ratio since we are representing spatial data. Currently the axes are
     slightly different. This is complicated because plots are being created over images that are being shown. The 1:1
     ratio might have to be created when the image is generated
@@ -23,56 +21,84 @@ Areas for improvement:
 
 
 import numpy as np
-import pandas as pd
+from scipy import fft
 from copy import copy
 import matplotlib.pyplot as plt
 import matplotlib.colors as colors
 from matplotlib import patches
 from matplotlib.lines import Line2D
 import matplotlib.patheffects as pe
-from observation import get_observation
+from observation import load_observation, observation_file
+from metadata import volume_bounds, volume_file
+from trial_data import load_trial, iter_chunks, points_dtype, tracked_file
+from profiling import span, profiled
+from results_cache import cached
+from heatmap_pyramid import HeatmapPyramid, BASE_RESOLUTION
+from catalog import parse_name
+import kernels
 
 
-def plot_bounds(ax, bounds, view, bound_color, alpha=1.0):
-    # Plot boundaries of body-marker data over heatmap. These bounds were found and stored as min/max x, y, and z as
-    # opposed to 8 x, y, and z points. A rectangle patch is the easiest to create with data in this form
+def bounds_rect(bounds, view):
+    # Rectangle (lower left corner, width, height) of the boundaries of body-marker data for a view. These bounds were
+    # found and stored as min/max x, y, and z as opposed to 8 x, y, and z points. A rectangle patch is the easiest to
+    # create with data in this form
 
     x, y, z = bounds
-    line_width = 3
-    z_order = 10
 
-    # Create then add patch
     if view == 'side':
-        p = patches.Rectangle((x[0], y[0]), x[1]-x[0], y[1]-y[0],
-                              zorder=z_order, fill=False, linewidth=line_width, edgecolor=bound_color)
-        ax.add_patch(p)
+        return (x[0], y[0]), x[1]-x[0], y[1]-y[0]
 
     elif view == 'top':
-        p = patches.Rectangle((z[0], x[0]), z[1]-z[0], x[1]-x[0],
-                              zorder=z_order, fill=False, linewidth=line_width, edgecolor=bound_color, alpha=alpha)
-        ax.add_patch(p)
+        return (z[0], x[0]), z[1]-z[0], x[1]-x[0]
 
     else:
-        p = patches.Rectangle((z[0], y[0]), z[1]-z[0], y[1]-y[0],
+        return (z[0], y[0]), z[1]-z[0], y[1]-y[0]
+
+
+def plot_bounds(ax, bounds, view, bound_color, alpha=1.0):
+    # Plot boundaries of body-marker data over heatmap. Returns the patch
+
+    line_width = 3
+    z_order = 10
+
+    xy, width, height = bounds_rect(bounds, view)
+
+    # Create then add patch
+    if view == 'front':
+        p = patches.Rectangle(xy, width, height,
                               zorder=z_order, fill=False, linewidth=line_width, color=bound_color)
-        ax.add_patch(p)
+    else:
+        p = patches.Rectangle(xy, width, height,
+                              zorder=z_order, fill=False, linewidth=line_width, edgecolor=bound_color, alpha=alpha)
+    ax.add_patch(p)
+
+    return p
+
+
+def table_rect(tab):
+    # Rectangle (lower left corner, width, height) of the table seen from the top
+
+    return (tab[5], tab[3]), tab[2]-tab[5], tab[6]-tab[3]
 
 
 def plot_table(ax, tab, tab_color, alpha=1.0):
-    # Plot Table over heatmap
+    # Plot Table over heatmap. Returns the patch
 
     line_width = 2
     edge_color = 'k'
     z_order = -1
 
     # Create then add patch
-    p = patches.Rectangle((tab[5], tab[3]), tab[2]-tab[5], tab[6]-tab[3],
+    xy, width, height = table_rect(tab)
+    p = patches.Rectangle(xy, width, height,
                           zorder=z_order, linewidth=line_width, edgecolor=edge_color, facecolor=tab_color, alpha=alpha)
     ax.add_patch(p)
 
+    return p
 
-def plot_part(part, part_color, ax1, ax2, ax3, ax4):
-    # Plot partition over heatmap
+
+def part_lines(part):
+    # Line data for the partitions. Returns a list of (subplot index, x data, y data), two lines per subplot
 
     # Frame is 1.93 meters top to bottom. This height is subtracted from measured height of markers on top of the frame
     # to find the bottom of the frame on the ground. Measured y value is relative to origin (on force plate) not the
@@ -80,298 +106,767 @@ def plot_part(part, part_color, ax1, ax2, ax3, ax4):
     height_of_part = 1.93
     top_of_part = part[1::3].mean()
     ground = top_of_part - height_of_part
+
+    return [(0, [part[0, 2], part[0, 2]], [ground, part[0, 1]]),
+            (0, [part[2, 2], part[2, 2]], [ground, part[2, 1]]),
+            (1, [part[1, 0], part[1, 0]], [ground, part[1, 1]]),
+            (1, [part[2, 0], part[2, 0]], [ground, part[2, 1]]),
+            (2, part[:, 2], part[:, 0]),
+            (2, [part[-1, 2], part[0, 2]], [part[-1, 0], part[0, 0]]),
+            (3, part[:, 2], part[:, 0]),
+            (3, [part[-1, 2], part[0, 2]], [part[-1, 0], part[0, 0]])]
+
+
+def plot_part(part, part_color, ax1, ax2, ax3, ax4):
+    # Plot partition over heatmap. Returns the lines
+
     line_width = 3
     transparency = 1
+    axes = [ax1, ax2, ax3, ax4]
 
-    ax1.plot([part[0, 2], part[0, 2]], [ground, part[0, 1]], c=part_color, linewidth=line_width, alpha=transparency)
-    ax1.plot([part[2, 2], part[2, 2]], [ground, part[2, 1]], c=part_color, linewidth=line_width, alpha=transparency)
-    ax2.plot([part[1, 0], part[1, 0]], [ground, part[1, 1]], c=part_color, linewidth=line_width, alpha=transparency)
-    ax2.plot([part[2, 0], part[2, 0]], [ground, part[2, 1]], c=part_color, linewidth=line_width, alpha=transparency)
-    ax3.plot(part[:, 2], part[:, 0], c=part_color, linewidth=line_width, alpha=transparency)
-    ax3.plot([part[-1, 2], part[0, 2]], [part[-1, 0], part[0, 0]], c=part_color, linewidth=line_width, alpha=transparency)
-    ax4.plot(part[:, 2], part[:, 0], c=part_color, linewidth=line_width, alpha=transparency)
-    ax4.plot([part[-1, 2], part[0, 2]], [part[-1, 0], part[0, 0]], c=part_color, linewidth=line_width, alpha=transparency)
+    return [axes[i].plot(x, y, c=part_color, linewidth=line_width, alpha=transparency)[0]
+            for i, x, y in part_lines(part)]
 
 
 def get_markers(file):
-    # Load marker data as Pandas DataFrame. Returns DataFrame so that remove_reach can still be run
-
-    # Possible area for improvement: .emt files were used to create .csv files for all our trials in the Fall of 2018.
-    # However, .trc files could've been used. Main difference between .trc and .emt files when stored as .csv files are
-    # the headers. Someone familiar with multi-indexing in Pandas could take advantage of the headers in .trc to
-    # immediately read data into orderly 5dimensional (time, marker_name, [x, y, z]) data that might be easier to work
-    # with and would avoid all the reshaping, stacking etc. that is necessary later on
-    data = pd.read_csv(file, header=10, delimiter=',', index_col=1, skipinitialspace=True, encoding="utf-8-sig")
+    # Load marker data as Pandas DataFrame indexed by time. Returns DataFrame so that remove_reach can still be run
 
-    return data
+    return load_trial(file).frame_data()
 
 
 def get_feet(file):
     # Load marker data for feet as Pandas DataFrame. Returns DataFrame so that remove_reach can still be run
 
-    data = pd.read_csv(file, header=10, delimiter=',', index_col=1, skipinitialspace=True, encoding="utf-8-sig")
-
-    # Searches headers for any header containing one of these string which are only found in feet names (for the moment)
-    # Quick and pythonic way to obtain all the names of feet columns without explicitly listing them
-    feet_types = ['HEE', 'ANM', 'ANL', 'TOT']
-    cols = data.columns
-    feet_names = [col for col in cols if any(ftype in col for ftype in feet_types)]
-
-    return data[feet_names]
+    # Feet are any markers whose name contains one of 'HEE', 'ANM', 'ANL', 'TOT' which are only found in feet names (for
+    # the moment). See trial_data.FEET_TYPES
+    return load_trial(file).frame_data('feet')
 
 
 def get_part(file):
-    # Load marker data for partitions as Pandas DataFrame. Returns Numpy array.
-
-    # Explicitly list names here unlike get_feet since we don't need all columns containing 'FRM', just the four markers
-    # on the top of the frame.
-    part = ['FRM9.X', 'FRM9.Y', 'FRM9.Z', 'FRM10.X', 'FRM10.Y', 'FRM10.Z',
-            'FRM11.X', 'FRM11.Y', 'FRM11.Z', 'FRM12.X', 'FRM12.Y', 'FRM12.Z']
-    partf = ['FRM9f.X', 'FRM9f.Y', 'FRM9f.Z', 'FRM10f.X', 'FRM10f.Y', 'FRM10f.Z',
-             'FRM11f.X', 'FRM11f.Y', 'FRM11f.Z', 'FRM12f.X', 'FRM12f.Y', 'FRM12f.Z']
-    try:
-        data = pd.read_csv(file, header=10, delimiter=',', index_col=False,
-                           skipinitialspace=True, usecols=part, encoding="utf-8-sig")[part]
-    except ValueError:
-        data = pd.read_csv(file, header=10, delimiter=',', index_col=False,
-                           skipinitialspace=True, usecols=partf, encoding="utf-8-sig")[partf]
+    # Load marker data for partitions. Returns Numpy array.
+
+    # Only the four markers on the top of the frame (FRM9 - FRM12) are used, not every 'FRM' marker.
+    data = load_trial(file).part
 
     # The partitions should be fixed but in practice they can be bumped around and sometimes at the beginning or end of
     # trials they are moved while BTS is still recording mocap data. For this reason, the average of all x, y, z for the
     # partition is returned here to give a better representation of where the partitions were
-    return np.nanmean(data.values, axis=0)
+    return np.nanmean(data, axis=0).flatten()
 
 
 def get_table(file):
-    # Load marker data for table as Pandas DataFrame. Returns Numpy array
-
-    data = pd.read_csv(file, header=10, delimiter=',', index_col=1, skipinitialspace=True, encoding="utf-8-sig")
+    # Load marker data for table. Returns Numpy array
 
-    # Searches headers for any header containing 'TAB'. Same approach as get_feet
-    cols = data.columns
-    table = [col for col in cols if 'TAB' in col]
+    # Every marker with 'TAB' in its name
+    data = load_trial(file).table
 
     # For the same reason as the partitions in get_part(), the average values are returned here
-    return np.nanmean(data[table].values, axis=0)
+    return np.nanmean(data, axis=0).flatten()
 
 
 def get_bounds(name, subject, care_only=False):
-    # Load bounding box (min/max x, y, z) for subject as Pandas DataFrame
+    # Load bounding box (min/max x, y, z) in meters for subject. The subject's table is only read once, see metadata.py.
+    # Raises KeyError if the trial isn't in the table
 
-    if care_only:
-        file = 'volume_data/S' + str(subject) + '_VOL_CareOnly.csv'
-    else:
-        file = 'volume_data/S' + str(subject) + '_VOL.csv'
+    return volume_bounds(subject, care_only=care_only)[name]
 
-    df = pd.read_csv(file, delimiter=',', header=0, index_col=0)
 
-    df.loc[name]['Xmin':'Zmax'].apply(float)  # Otherwise a string is returned
-    bounds_df = df.loc[name]['Xmin':'Zmax']
-    bounds_np = bounds_df.values
-    bounds_stacked = np.stack((bounds_np[:3], bounds_np[3:]), axis=1)
-    bounds = bounds_stacked.astype(np.float)/1000  # Convert from millimeters
+def remove_reach(name, df):
+    # Removes marker data during period when subject was observed retrieving/returning supplies. Observations are made
+    # in BORIS and stored in .csv's. Returns DataFrame with periods during retrieving/returning removed. The heatmaps
+    # don't use this, they mask frames out with Observation.keep_mask() instead of copying the DataFrame
 
-    return bounds
+    observation = load_observation(name)
+    keep = observation.keep_mask(np.asarray(df.index, dtype=float), exclude=[reach_state(observation)])
 
+    return df[keep]
 
-def remove_reach(name, df):
-    # Removes marker data during period when subject was observed retrieving/returning supplies. Observations are made
-    # in BORIS and stored in .csv's. Returns DataFrame with periods during retrieving/returning removed.
 
-    states, time_list = get_observation(name)
-    reach = time_list[-1]
-    raw_ind = np.array(df.index)
-    ind = []
+def bin_index(v, v_range, resolution):
+    # Bin of every value in v, the same bins np.histogram2d uses: resolution equal bins over v_range, each including its
+    # left edge, the last one also including its right edge. Values outside of v_range get -1. Returns the bins and the
+    # bin edges
 
-    for r in reach:
-        ind.append(np.where(raw_ind < r)[0][-1])
+    edges = np.linspace(v_range[0], v_range[1], resolution + 1)
 
-    full = np.array([])
+    index = np.searchsorted(edges, v, side='right') - 1
+    index[v == edges[-1]] -= 1
+    index[index >= resolution] = -1
 
-    for i in range(0, len(ind), 2):
-        full = np.append(full, np.arange(ind[i], ind[i + 1] + 1))
+    return index, edges
 
-    data = df.drop(df.index[full.astype(int)])
 
-    return data
+def sigma_bins(sigma, extent, shape):
+    # sigma in meters as a number of bins along the rows and the columns of a histogram of the given shape and extent.
+    # 0 along an axis with no width
 
+    widths = np.array([abs(extent[3] - extent[2]) / shape[0], abs(extent[1] - extent[0]) / shape[1]])
+    return sigma / np.where(widths > 0, widths, np.inf)
 
-def create_heatmap(ax, x, y, resolution, x_range, y_range, palette, v_max):
-    # Creates numpy histogram from x, y data and shows that on given axis as an image.
 
-    heatmap, x_edges, y_edges = np.histogram2d(x, y, bins=resolution, range=[x_range, y_range])
+def gaussian_kernel(sigma, size):
+    # Gaussian of standard deviation sigma bins sampled at the bins of an axis of length size, centered on bin 0 and
+    # wrapping around (bin size - k is offset -k) as needed for convolving by FFT. Cut off at 4 sigma like
+    # scipy.ndimage.gaussian_filter and normalised to sum to 1
 
-    extent = [x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]]
+    offsets = np.arange(size)
+    offsets = np.minimum(offsets, size - offsets)
+    if sigma == 0:
+        return (offsets == 0).astype(float)
 
-    ax.imshow(heatmap.T, cmap=palette, extent=extent, origin='lower', aspect="auto",
-              norm=colors.SymLogNorm(linthresh=0.01, vmin=1, vmax=v_max))
+    kernel = np.where(offsets <= np.ceil(4 * sigma), np.exp(-.5 * (offsets / sigma) ** 2), 0)
+    return kernel / kernel.sum()
 
 
-def plot_heatmap(name, care_only=False):
-    """
-    Main Function
-    """
+def unit_peak(sigma, extent, shape):
+    # Value a single count is smoothed down to in its own bin, the center of the kernel. 1 without smoothing
 
-    print(name)
+    if not sigma:
+        return 1.0
+    radius = np.ceil(4 * sigma_bins(sigma, extent, shape)).astype(int)
+    return np.prod([gaussian_kernel(s, 2 * r + 1)[0] for s, r in zip(sigma_bins(sigma, extent, shape), radius)])
 
-    # Path to tracked data
-    file = 'tracked_data/' + name + '_tracked.csv'
-    df = get_markers(file)
 
-    # Remove reach
+def smooth_views(views, sigma):
+    # Views (list of (histogram, extent), all histograms the same shape) convolved with a Gaussian of standard deviation
+    # sigma in meters, so sparse views (feet-only) show a density instead of single speckled bins. Counts are spread
+    # over the neighboring bins and the part spread past the edges of a view is lost, as with zero padding in
+    # scipy.ndimage.gaussian_filter(mode='constant').
+    #
+    # Bins are as wide as their view's extent over the resolution, so sigma is turned into bins view by view and axis by
+    # axis and every view gets its own kernel, a sampled and normalised spatial Gaussian. Convolving is a multiplication
+    # in the frequency domain, so the views are transformed once, multiplied by the transforms of their kernels and
+    # transformed back, all four views in one batched call. The cost depends on the resolution and not on the number of
+    # points. The Gaussian is separable, so the transform of a kernel is the outer product of the transforms of its row
+    # and column kernels. The histograms are padded with zeros by 4 sigma so counts near one edge don't wrap around
+    # onto the other
+
+    if not sigma:
+        return views
+
+    heatmaps = np.stack([heatmap for heatmap, extent in views])
+    rows, cols = heatmaps.shape[1:]
+
+    # sigma in bins along the rows (v) and columns (h) of every view
+    sigmas = np.array([sigma_bins(sigma, extent, (rows, cols)) for heatmap, extent in views])
+
+    # At least as long as the whole kernel, so its tails don't overlap when a view is narrower than the kernel
+    pad = np.ceil(4 * sigmas.max(axis=0)).astype(int)
+    shape = (fft.next_fast_len(int(max(rows + pad[0], 2 * pad[0] + 1))),
+             fft.next_fast_len(int(max(cols + pad[1], 2 * pad[1] + 1)), real=True))
+
+    f_v = np.array([fft.fft(gaussian_kernel(s, shape[0])) for s in sigmas[:, 0]])
+    f_h = np.array([fft.rfft(gaussian_kernel(s, shape[1])) for s in sigmas[:, 1]])
+    kernels = f_v[:, :, None] * f_h[:, None, :]
+
+    smoothed = fft.irfft2(fft.rfft2(heatmaps, s=shape) * kernels, s=shape)[:, :rows, :cols]
+
+    return [(heatmap, extent) for heatmap, (_, extent) in zip(smoothed, views)]
+
+
+def create_heatmap(x, y, z, feet, resolution, x_range, y_range, z_range, smooth=None):
+    # Creates the histograms of the four views from x, y, z data: front (z, y), side (x, y), top (z, x) and top with
+    # only the points where feet is True. Returns a list of (histogram, extent) ready to be shown as images. smooth is
+    # the standard deviation in meters of a Gaussian the histograms are smoothed with (see smooth_views()).
+
+    # Every coordinate is binned once and shared by the two views it appears in. Each view is then a single bincount of
+    # the combined (row, column) bin index, and feet-only is the top view's index with the feet points picked out
+    ix, x_edges = bin_index(x, x_range, resolution)
+    iy, y_edges = bin_index(y, y_range, resolution)
+    iz, z_edges = bin_index(z, z_range, resolution)
+
+    def view(h, v, h_edges, v_edges, select=None):
+        inside = (h >= 0) & (v >= 0)
+        if select is not None:
+            inside &= select
+        counts = np.bincount(v[inside] * resolution + h[inside], minlength=resolution * resolution)
+        extent = [h_edges[0], h_edges[-1], v_edges[0], v_edges[-1]]
+        return counts.reshape(resolution, resolution).astype(float), extent
+
+    return smooth_views([view(iz, iy, z_edges, y_edges),
+                         view(ix, iy, x_edges, y_edges),
+                         view(iz, ix, z_edges, x_edges),
+                         view(iz, ix, z_edges, x_edges, select=feet)], smooth)
+
+
+def heatmap_pyramids(x, y, z, feet, base_resolution, x_range, y_range, z_range):
+    # Same four views as create_heatmap() but as HeatmapPyramid's binned at base_resolution, which can be zoomed into
+    # (see heatmap_pyramid.py). Coordinates are binned once and shared between views the same way
+
+    ix, x_edges = bin_index(x, x_range, base_resolution)
+    iy, y_edges = bin_index(y, y_range, base_resolution)
+    iz, z_edges = bin_index(z, z_range, base_resolution)
+
+    return [HeatmapPyramid(z, y, iz, iy, z_edges, y_edges),
+            HeatmapPyramid(x, y, ix, iy, x_edges, y_edges),
+            HeatmapPyramid(z, x, iz, ix, z_edges, x_edges),
+            HeatmapPyramid(z, x, iz, ix, z_edges, x_edges, select=feet)]
+
+
+def valid_points(trial, keep=None):
+    # x, y, z vectors of every point in the trial that has no nan value, in the frames where keep is True, plus a vector
+    # that is True for the points that belong to feet markers. Nan values are mostly a problem with unfiltered data.
+    # Points are picked straight out of the (frames, markers, 3) marker data with a mask, so nothing is copied besides
+    # the points that are used.
+
+    points = trial.points
+    valid = ~np.any(np.isnan(points), axis=2)
+    if keep is not None:
+        valid &= keep[:, None]
+
+    data = points[valid]
+    feet = np.broadcast_to(trial.marker_mask('feet'), valid.shape)[valid]
+
+    return data[:, 0], data[:, 1], data[:, 2], feet
+
+
+def bin_views(trial, keep, resolution, ranges=None):
+    # The four views of create_heatmap() from the points valid_points() picks, with ranges found by view_ranges() if
+    # ranges is None. Returns the views, the number of points binned and the ranges. With numba (see kernels.py) the
+    # nan points are dropped and every view is binned in one compiled pass over the marker data, without the x, y, z
+    # vectors and bin indices the NumPy version makes
+
+    if not kernels.compiled():
+        x, y, z, feet = valid_points(trial, keep)
+        if ranges is None:
+            ranges = view_ranges(x.min(), x.max(), y.min(), y.max(), z.min(), z.max())
+        return create_heatmap(x, y, z, feet, resolution, *ranges), len(x), ranges
+
+    if keep is None:
+        keep = np.ones(len(trial), dtype=bool)
+    if ranges is None:
+        lows, highs, points = kernels.valid_bounds(trial.points, keep)
+        if not points:
+            raise ValueError('No points without nan values to find the ranges of the views from')
+        ranges = view_ranges(lows[0], highs[0], lows[1], highs[1], lows[2], highs[2])
+
+    x_edges, y_edges, z_edges = [np.linspace(r[0], r[1], resolution + 1) for r in ranges]
+    counts, points = kernels.bin_views(trial.points, keep, trial.marker_mask('feet'), x_edges, y_edges, z_edges)
+
+    def extent(h_edges, v_edges):
+        return [h_edges[0], h_edges[-1], v_edges[0], v_edges[-1]]
+
+    views = [(counts[0], extent(z_edges, y_edges)),
+             (counts[1], extent(x_edges, y_edges)),
+             (counts[2], extent(z_edges, x_edges)),
+             (counts[3], extent(z_edges, x_edges))]
+    return views, points, ranges
+
+
+def reach_state(observation):
+    # Name of the retrieving/returning state. It is the last of the (sorted) states
+
+    return observation.behaviors()[-1]
+
+
+def frame_selection(name, care_only=False, exclude=None, include=None):
+    # Behaviors observed in BORIS whose frames are removed from (exclude) or the only ones kept in (include) the
+    # heatmap. care_only removes the periods when the subject was observed retrieving/returning supplies. Returns
+    # (observation, exclude, include), or None when every frame is used
+
+    exclude = list(exclude or [])
+    if not (care_only or exclude or include):
+        return None
+
+    observation = load_observation(name)
     if care_only:
-        rws1, cls1 = df.shape
-        df = remove_reach(name, df)
-        rws2, cls2 = df.shape
-        print('Reach loss: %' + str(100 * (rws1 - rws2) / rws1)[:5] + ' -', (rws1 - rws2))
-
-    # DataFrame has structure (time, columns) where columns are individual dimensions of markers: [HEAD.X, HEAD.Y,
-    # HEAD.Z, RFHD.X, ...]. Therefore, DataFrame has to be sliced, stacked, and shaped in order to get data into x, y,
-    # and z columns. As mentioned before, this is an area for improvement. However, it is not computationally expensive.
-    raw_values = df.values[:, 1:]
-    rws1, cls1 = raw_values.shape
-
-    raw_x = raw_values[:, 0::3].flatten()
-    raw_y = raw_values[:, 1::3].flatten()
-    raw_z = raw_values[:, 2::3].flatten()
-
-    # All x, y, z points containing a nan value are removed from data. To this, data is separated into x, y, z vectors
-    # and then stacked shaped into (n, 3) where n is the number of points across the whole trial. Nan values are mostly
-    # a problem with unfiltered data.
-    data = np.stack((raw_x, raw_y, raw_z), axis=-1)
-    data = data[~np.any(np.isnan(data), axis=1)]
-
-    rws2, cls2 = data.shape
-    print('Nan loss: %' + str(100 * ((rws1 * cls1) - (rws2 * cls2)) / (rws1 * cls1))[:5] + ' -',
-          ((rws1 * cls1)-(rws2 * cls2)), 'points')
-    print()
+        exclude.append(reach_state(observation))
 
-    # Back into x, y, z vectors
-    x = data[:, 0]
-    y = data[:, 1]
-    z = data[:, 2]
+    return observation, exclude, include
 
-    tab = get_table(file)  # Get row of table data fom trial
-    boundaries = get_bounds(name, name[6:8], care_only=care_only)  # Get bounding box of subject for trial
 
+def view_ranges(x_min, x_max, y_min, y_max, z_min, z_max, margin_pad=.15):
     # Max x, y, and z coordinates are found, whether it be the table, partition, or body marker, and are padded by
     # margin_pad. To make the x and z axes equal, the minimum min and the maximum max between the two are found and
-    # used for both the x and z axes.
-    margin_pad = .15
-    x_range, y_range, z_range = [[np.array([x.min(), z.min()]).min()-margin_pad,
-                                  np.array([x.max(), z.max()]).max()+margin_pad],
+    # used for both the x and z axes. Returns x_range, y_range, z_range
+
+    return [[np.array([x_min, z_min]).min()-margin_pad,
+             np.array([x_max, z_max]).max()+margin_pad],
+
+            [y_min-margin_pad,
+             y_max+margin_pad],
 
-                                 [y.min()-margin_pad,
-                                  y.max()+margin_pad],
+            [np.array([x_min, z_min]).min()-margin_pad,
+             np.array([x_max, z_max]).max()+margin_pad]]
 
-                                 [np.array([x.min(), z.min()]).min()-margin_pad,
-                                  np.array([x.max(), z.max()]).max()+margin_pad]]
 
-    # Create figure
-    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, sharex='col', sharey='row', figsize=(9, 8))
+def uses_partitions(name):
+    # Whether partitions were used in trial
+
+    trial_id = parse_name(name)
+    return (trial_id.volume != 'URV') and (trial_id.volume != 'RFT') and (trial_id.subject != 'S78')
+
+
+def heatmap_title(name, care_only):
 
     if care_only:
-        fig.suptitle(name[:21] + ' Care Only', x=.5, y=1)
+        return parse_name(name).base + ' Care Only'
+    return parse_name(name).base
+
+
+def heatmap_data(name, care_only=False, resolution=200, chunk_frames=None, ranges=None, exclude=None, include=None,
+                 zoomable=False, smooth=None):
+    # Gathers everything that changes from trial to trial in the heatmap figure: the four histograms and their extents,
+    # the table, the bounding box of the subject and the partitions (None if partitions weren't used). Returns a dict
+    # that HeatmapFigure.update() draws. With chunk_frames the trial is streamed in chunks (see stream_heatmap_data).
+    # ranges, given as [x_range, y_range, z_range] in meters, replaces the ranges found from the data. exclude and
+    # include are lists of BORIS behaviors whose frames are left out of / the only ones used in the heatmap.
+    #
+    # The result is kept in the results cache (see results_cache.py), keyed by the contents of the tracked, BORIS and
+    # bounding box csv's and the parameters, so re-rendering a trial doesn't bin every point again. chunk_frames
+    # doesn't change the result and isn't part of the key.
+    #
+    # zoomable also returns the views as HeatmapPyramid's under 'pyramids', which HeatmapFigure re-bins from when a
+    # view is zoomed into. They hold every point of the trial, so they are neither cached nor available when streaming.
+    #
+    # smooth, the standard deviation in meters of a Gaussian, smooths the views (see smooth_views()). Smoothing takes a
+    # few milliseconds, so it is done after the cache and the cached histograms are shared by every value of smooth.
+
+    if zoomable:
+        if chunk_frames:
+            raise ValueError('A zoomable heatmap needs the whole trial in memory, chunk_frames cannot be used')
+        data = bin_heatmap_data(name, care_only=care_only, resolution=resolution, ranges=ranges, exclude=exclude,
+                                include=include, zoomable=True)
+        return smoothed_data(data, smooth)
+
+    files = [tracked_file(name), volume_file(parse_name(name).number, care_only)]
+    if care_only or exclude or include:
+        files.append(observation_file(name))
+
+    params = {'name': name, 'care_only': care_only, 'resolution': resolution,
+              'ranges': None if ranges is None else np.asarray(ranges, dtype=float).tolist(),
+              'exclude': exclude, 'include': include, 'dtype': points_dtype().name}
+
+    def compute():
+        return bin_heatmap_data(name, care_only=care_only, resolution=resolution, chunk_frames=chunk_frames,
+                                ranges=ranges, exclude=exclude, include=include)
+
+    return smoothed_data(cached('heatmap', files, params, compute), smooth)
+
+
+def smoothed_data(data, smooth):
+    # Copy of a heatmap_data() dict with smoothed views. smooth is kept so that zoomed views are smoothed the same way
+
+    if not smooth:
+        return data
+    with span('smoothing'):
+        return dict(data, views=smooth_views(data['views'], smooth), smooth=smooth)
+
+
+def bin_heatmap_data(name, care_only=False, resolution=200, chunk_frames=None, ranges=None, exclude=None,
+                     include=None, zoomable=False):
+    # Works out the dict returned by heatmap_data() from the marker data
+
+    if chunk_frames:
+        return stream_heatmap_data(name, care_only=care_only, resolution=resolution, chunk_frames=chunk_frames,
+                                   ranges=ranges, exclude=exclude, include=include)
+
+    print(name)
+
+    # Path to tracked data
+    file = tracked_file(name)
+    with span('load trial') as s:
+        trial = load_trial(file)
+        s.rows = frames = len(trial)
+    columns = len(trial.columns)
+
+    # Remove reach (and any other behaviors). Frames are masked out instead of dropped so that the marker data isn't
+    # copied
+    selection = frame_selection(name, care_only=care_only, exclude=exclude, include=include)
+    if selection is not None:
+        observation, exclude, include = selection
+        with span('mask behaviors') as s:
+            keep = observation.keep_mask(trial.time, exclude=exclude, include=include)
+            s.rows = kept_frames = keep.sum()
+        print(('Reach loss' if care_only else 'Masked loss') + ': %' + str(100 * (frames - kept_frames) / frames)[:5] +
+              ' -', (frames - kept_frames))
     else:
-        fig.suptitle(name[:21], x=.5, y=1)
-
-    # Style parameters
-    resolution = 200
-
-    # v_max sets a maximum 'brightness' to heat map. Some markers stay in same place for entire trial (table, partition)
-    # becoming extremely bright and the spectrum becomes compressed and less detailed at the lower end: body-markers,
-    # the important end. v_max forces all values above v_max down to v_max and more diversity is seen in the lower
-    # ranges
-    v_max = 400
-    
-    table_color = 'silver'
-    part_color = 'blue'
-    bound_color = 'r'
-
-    # viridis is the choice of color scale for the marker data.
-    # See https://matplotlib.org/examples/color/colormaps_reference.html
-    palette = copy(plt.cm.viridis)
-
-    # Sets the background (all bins with zero occurrences) to white
-    palette.set_under('w', 0)
-
-    # Front
-    create_heatmap(ax1, z, y, resolution, z_range, y_range, palette, v_max)
-
-    ax1.set_title('Front')
-    ax1.set_ylabel('Y (m)')
-    ax1.plot([tab[2], tab[5]], [tab[7], tab[10]], c=table_color, linewidth=3,
-             path_effects=[pe.Stroke(linewidth=6, foreground='k'), pe.Normal()])
-    plot_bounds(ax1, boundaries, view='front', bound_color=bound_color)
-
-    # Side
-    create_heatmap(ax2, x, y, resolution, x_range, y_range, palette, v_max)
-
-    ax2.set_title('Side')
-    ax2.xaxis.labelpad = 3
-    ax2.plot([tab[0], tab[-3]], [tab[1], tab[-2]], zorder=0, c=table_color, linewidth=3,
-             path_effects=[pe.Stroke(linewidth=6, foreground='k'), pe.Normal()])
-    plot_bounds(ax2, boundaries, view='side', bound_color=bound_color)
-    ax2.xaxis.set_tick_params(labelbottom=True)
-    ax2.set_xlabel('X (m)')
-
-    # Top
-    create_heatmap(ax3, z, x, resolution, z_range, x_range, palette, v_max)
-
-    ax3.set_title('Top')
-    ax3.set_ylabel('X (m)')
-    ax3.set_xlabel('Z (m)')
-    plot_table(ax3, tab, table_color)
-    plot_bounds(ax3, boundaries, view='top', bound_color=bound_color)
-    ax3.yaxis.set_tick_params(labelbottom=True)
-
-    # Re-gathering data for feet-only
-    df = get_feet(file)
+        keep = None
+        kept_frames = frames
+
+    # All points containing a nan value are removed from data. Front, side, top and top - feet-only
+    if zoomable:
+        with span('remove nan') as s:
+            x, y, z, feet = valid_points(trial, keep)
+            s.rows = points = len(x)
+
+        if ranges is None:
+            ranges = view_ranges(x.min(), x.max(), y.min(), y.max(), z.min(), z.max())
+
+        with span('binning') as s:
+            pyramids = heatmap_pyramids(x, y, z, feet, BASE_RESOLUTION, *ranges)
+            views = [pyramid.view(resolution) for pyramid in pyramids]
+            s.rows = points
+    else:
+        with span('remove nan and binning') as s:
+            views, points, ranges = bin_views(trial, keep, resolution, ranges)
+            s.rows = points
 
-    if care_only:
-        df = remove_reach(name, df)
-
-    # Same process for removing nan values as before
-    raw_values = df.values
-    raw_x = raw_values[:, 0::3].flatten()
-    raw_y = raw_values[:, 1::3].flatten()
-    raw_z = raw_values[:, 2::3].flatten()
-    data = np.stack((raw_x, raw_y, raw_z), axis=-1)
-    data = data[~np.any(np.isnan(data), axis=1)]
-    x = data[:, 0]
-    y = data[:, 1]
-    z = data[:, 2]
-
-    # Top - feet-only
-    create_heatmap(ax4, z, x, resolution, z_range, x_range, palette, v_max)
-    ax4.set_title('Top - Feet Only')
-    ax4.get_xaxis().set_visible(False)
-    ax4.get_yaxis().set_visible(False)
-    plot_table(ax4, tab, table_color, alpha=.2)
-    plot_bounds(ax4, boundaries, view='top', bound_color=bound_color, alpha=.2)
-
-    # Plot partitions if partitions were used in trial
-    if (name[16:19] != 'URV') and (name[16:19] != 'RFT') and (name[5:8] != 'S78'):
-        part = get_part(file=file)
-        part.shape = (4, 3)
-        plot_part(part, part_color, ax1, ax2, ax3, ax4)
-
-    # Manually define lines used for legend
-    custom_lines = [Line2D([0], [0], color=table_color, lw=4,
-                           path_effects=[pe.Stroke(linewidth=6, foreground='k'), pe.Normal()]),
-                    Line2D([0], [0], color=part_color, lw=2),
-                    Line2D([0], [0], color=bound_color, lw=2)]
-
-    fig.legend(custom_lines, ['Table', 'Partition', 'Bounding Box'], loc='lower right')
-
-    # Images were flipped when created and this was the easiest fix
-    ax1.invert_xaxis()
-    ax4.invert_yaxis()
-    ax4.invert_xaxis()
-
-    fig.tight_layout()
-
-    plt.show()
+    print('Nan loss: %' + str(100 * ((kept_frames * columns) - (points * 3)) / (kept_frames * columns))[:5] + ' -',
+          ((kept_frames * columns) - (points * 3)), 'points')
+    print()
+
+    with span('table, partitions and bounds'):
+        # Plot partitions if partitions were used in trial
+        if uses_partitions(name):
+            part = get_part(file=file)
+            part.shape = (4, 3)
+        else:
+            part = None
+
+        tab = get_table(file)  # Get row of table data fom trial
+        bounds = get_bounds(name, parse_name(name).number, care_only=care_only)  # Get bounding box of subject for trial
+
+    data = {'title': heatmap_title(name, care_only),
+            'views': views,
+            'tab': tab,
+            'bounds': bounds,
+            'part': part}
+    if zoomable:
+        data['pyramids'] = pyramids
+
+    return data
+
+
+def stream_heatmap_data(name, care_only=False, resolution=200, chunk_frames=10000, ranges=None, exclude=None,
+                        include=None):
+    # Same as heatmap_data() but for recordings too long to load at once. The tracked data is read in chunks of
+    # chunk_frames frames and the four histograms, table and partition averages are added up chunk by chunk, so memory
+    # use depends on chunk_frames and not on the length of the trial. Unless ranges are given, an extra pass over the
+    # data finds the ranges of the views first.
+
+    print(name)
+
+    file = tracked_file(name)
+
+    selection = frame_selection(name, care_only=care_only, exclude=exclude, include=include)
+
+    def kept_chunks():
+        # Yields each chunk with a mask of the frames that are kept after the reach is removed. Each chunk is read
+        # together with the first time of the chunk after it, which is needed to match remove_reach()
+        chunks = iter_chunks(file, chunk_frames)
+        chunk = next(chunks, None)
+        while chunk is not None:
+            following = next(chunks, None)
+            if selection is not None:
+                observation, excluded, included = selection
+                next_time = following.time[0] if following is not None else np.inf
+                keep = observation.keep_mask(chunk.time, exclude=excluded, include=included, next_time=next_time)
+            else:
+                keep = np.ones(len(chunk), dtype=bool)
+            yield chunk, keep
+            chunk = following
+
+    # First pass: ranges of the views
+    if ranges is None:
+        with span('range pass') as s:
+            mins = np.full(3, np.inf)
+            maxs = np.full(3, -np.inf)
+            read = 0  # Counted here since a disabled span doesn't keep rows
+            for chunk, keep in kept_chunks():
+                read += len(chunk)
+                if kernels.compiled():
+                    lows, highs, _ = kernels.valid_bounds(chunk.points, keep)
+                else:
+                    x, y, z, feet = valid_points(chunk, keep)
+                    if not len(x):
+                        continue
+                    lows, highs = [x.min(), y.min(), z.min()], [x.max(), y.max(), z.max()]
+                mins = np.minimum(mins, lows)
+                maxs = np.maximum(maxs, highs)
+            s.rows = read
+            ranges = view_ranges(mins[0], maxs[0], mins[1], maxs[1], mins[2], maxs[2])
+
+    sums = HeatmapSums(name, resolution, ranges)
+
+    # Second pass: histograms
+    with span('binning pass') as s:
+        for chunk, keep in kept_chunks():
+            sums.add(chunk, keep)
+            s.rows = sums.points
+
+    frames, kept_frames, columns, points = sums.frames, sums.kept_frames, sums.columns, sums.points
+    if selection is not None:
+        print(('Reach loss' if care_only else 'Masked loss') + ': %' + str(100 * (frames - kept_frames) / frames)[:5] +
+              ' -', (frames - kept_frames))
+    print('Nan loss: %' + str(100 * ((kept_frames * columns) - (points * 3)) / (kept_frames * columns))[:5] + ' -',
+          ((kept_frames * columns) - (points * 3)), 'points')
+    print()
+
+    return sums.data(heatmap_title(name, care_only), get_bounds(name, parse_name(name).number, care_only=care_only))
+
+
+class HeatmapSums:
+    # The four views of a trial on fixed ranges, with the table and partitions averaged over every frame, added up one
+    # chunk (TrialData) at a time. Each chunk costs the same however many came before it, which stream_heatmap_data()
+    # uses for long recordings and live.py for trials that are still being recorded
+
+    def __init__(self, name, resolution, ranges):
+        self.resolution = resolution
+        self.ranges = ranges
+        self.views = None
+        self.frames = self.kept_frames = self.columns = self.points = 0
+        self.sums = {}
+        self.counts = {}
+        self.averaged = ['table', 'part'] if uses_partitions(name) else ['table']
+
+    def add(self, chunk, keep=None):
+        # Adds the frames of a chunk where keep is True (every frame if keep is None) to the views
+
+        self.frames += len(chunk)
+        self.kept_frames += len(chunk) if keep is None else keep.sum()
+        self.columns = len(chunk.columns)
+
+        chunk_views, chunk_points, _ = bin_views(chunk, keep, self.resolution, self.ranges)
+        self.points += chunk_points
+        if self.views is None:
+            self.views = chunk_views
+        else:
+            self.views = [(view + chunk_view, extent)
+                          for (view, extent), (chunk_view, _) in zip(self.views, chunk_views)]
+
+        # Table and partitions are averaged over the whole trial, reach included, the same as get_table()/get_part()
+        for block in self.averaged:
+            values = chunk.block(block)
+            self.sums[block] = self.sums.get(block, 0) + np.nansum(values, axis=0)
+            self.counts[block] = self.counts.get(block, 0) + np.sum(~np.isnan(values), axis=0)
+
+    def data(self, title, bounds):
+        # The dict of heatmap_data() for the chunks added so far
+
+        with np.errstate(invalid='ignore'):  # Markers not seen yet are nan
+            part = self.sums['part'] / self.counts['part'] if 'part' in self.averaged else None
+            tab = (self.sums['table'] / self.counts['table']).flatten()
+
+        return {'title': title,
+                'views': self.views,
+                'tab': tab,
+                'bounds': bounds,
+                'part': part}
+
+
+class HeatmapFigure:
+    # The 2x2 heatmap figure. Creating a figure, its four images, patches, legend and layout takes far longer than
+    # drawing a trial's data, so when many trials are rendered in a row (see mse_plot.py) the figure and all of its
+    # artists are created once here and update() only swaps in the data of each trial: image data and extents, patch
+    # geometry, partition lines and axis limits.
+    #
+    # When the data has pyramids (heatmap_data(zoomable=True)), the images are re-binned for the region shown every time
+    # the axis limits change, so zooming in with the toolbar shows finer bins instead of bigger pixels.
+
+    def __init__(self, resolution=200):
+
+        # Style parameters
+
+        # v_max sets a maximum 'brightness' to heat map. Some markers stay in same place for entire trial (table,
+        # partition) becoming extremely bright and the spectrum becomes compressed and less detailed at the lower end:
+        # body-markers, the important end. v_max forces all values above v_max down to v_max and more diversity is seen
+        # in the lower ranges
+        self.v_max = 400
+
+        table_color = 'silver'
+        part_color = 'blue'
+        bound_color = 'r'
+
+        # viridis is the choice of color scale for the marker data.
+        # See https://matplotlib.org/examples/color/colormaps_reference.html
+        palette = copy(plt.cm.viridis)
+
+        # Sets the background (all bins with zero occurrences) to white
+        palette.set_under('w', 0)
+
+        # Create figure
+        self.fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, sharex='col', sharey='row', figsize=(9, 8))
+        self.axes = [ax1, ax2, ax3, ax4]
+        self.title = self.fig.suptitle('', x=.5, y=1)
+
+        # Images start out empty and get their data and extent in update()
+        empty = np.zeros((resolution, resolution))
+        self.images = [ax.imshow(empty, cmap=palette, extent=[0, 1, 0, 1], origin='lower', aspect="auto",
+                                 norm=self.color_norm())
+                       for ax in self.axes]
+
+        table_effects = [pe.Stroke(linewidth=6, foreground='k'), pe.Normal()]
+        no_tab = np.zeros(12)
+        no_bounds = np.zeros((3, 2))
+
+        # Front
+        ax1.set_title('Front')
+        ax1.set_ylabel('Y (m)')
+        self.table_front = ax1.plot([0, 0], [0, 0], c=table_color, linewidth=3, path_effects=table_effects)[0]
+        self.bounds_patches = [plot_bounds(ax1, no_bounds, view='front', bound_color=bound_color)]
+
+        # Side
+        ax2.set_title('Side')
+        ax2.xaxis.labelpad = 3
+        self.table_side = ax2.plot([0, 0], [0, 0], zorder=0, c=table_color, linewidth=3,
+                                   path_effects=table_effects)[0]
+        self.bounds_patches.append(plot_bounds(ax2, no_bounds, view='side', bound_color=bound_color))
+        ax2.xaxis.set_tick_params(labelbottom=True)
+        ax2.set_xlabel('X (m)')
+
+        # Top
+        ax3.set_title('Top')
+        ax3.set_ylabel('X (m)')
+        ax3.set_xlabel('Z (m)')
+        self.table_patches = [plot_table(ax3, no_tab, table_color)]
+        self.bounds_patches.append(plot_bounds(ax3, no_bounds, view='top', bound_color=bound_color))
+        ax3.yaxis.set_tick_params(labelbottom=True)
+
+        # Top - feet-only
+        ax4.set_title('Top - Feet Only')
+        ax4.get_xaxis().set_visible(False)
+        ax4.get_yaxis().set_visible(False)
+        self.table_patches.append(plot_table(ax4, no_tab, table_color, alpha=.2))
+        self.bounds_patches.append(plot_bounds(ax4, no_bounds, view='top', bound_color=bound_color, alpha=.2))
+
+        # Partitions. Hidden for trials without partitions
+        self.part_lines = plot_part(np.zeros((4, 3)), part_color, ax1, ax2, ax3, ax4)
+
+        # Manually define lines used for legend
+        custom_lines = [Line2D([0], [0], color=table_color, lw=4, path_effects=table_effects),
+                        Line2D([0], [0], color=part_color, lw=2),
+                        Line2D([0], [0], color=bound_color, lw=2)]
+
+        self.fig.legend(custom_lines, ['Table', 'Partition', 'Bounding Box'], loc='lower right')
+
+        self.laid_out = False
+
+        # Zooming
+        self.resolution = resolution
+        self.pyramids = None
+        self.smooth = None
+        self.shown = [None] * 4  # Axis limits each image was last binned for
+        self.updating = False
+        # Callbacks only hold weak references to methods, the lambda keeps this object alive as long as the figure is
+        for ax in self.axes:
+            ax.callbacks.connect('xlim_changed', lambda ax: self.zoom(ax))
+            ax.callbacks.connect('ylim_changed', lambda ax: self.zoom(ax))
+
+    def color_norm(self, peak=1.0):
+        # Color scale of an image. Bins under one count are background, so a smoothed view, where a single count is
+        # spread down to peak in its own bin (see unit_peak()), has its lower end scaled by peak to keep sparse points
+
+        return colors.SymLogNorm(linthresh=0.01 * peak, vmin=peak, vmax=self.v_max)
+
+    def zoom(self, ax=None):
+        # Re-bins the image of every view whose axis limits have changed since it was last binned. Axes share limits
+        # with their row and column and only the axis that was changed gets the callback, so every view is checked
+
+        if self.pyramids is None or self.updating:
+            return
+
+        self.updating = True  # Setting an extent can set limits, which calls this again
+        try:
+            for i, (ax, image, pyramid) in enumerate(zip(self.axes, self.images, self.pyramids)):
+                limits = (ax.get_xlim(), ax.get_ylim())
+                if limits == self.shown[i]:
+                    continue
+                [(heatmap, extent)] = smooth_views([pyramid.zoom(limits[0], limits[1], self.resolution)], self.smooth)
+                image.set_data(heatmap)
+                image.set_extent(extent)
+                image.set_norm(self.color_norm(unit_peak(self.smooth, extent, heatmap.shape)))
+                ax.set_xlim(limits[0], auto=None)
+                ax.set_ylim(limits[1], auto=None)
+                self.shown[i] = limits
+        finally:
+            self.updating = False
+
+    def update(self, data):
+        # Draws the data of one trial (see heatmap_data()) in place of the previous one. Returns the figure
+
+        self.updating = True
+        try:
+            self.draw_trial(data)
+        finally:
+            self.updating = False
+
+        self.pyramids = data.get('pyramids')
+        self.smooth = data.get('smooth')
+        self.shown = [(ax.get_xlim(), ax.get_ylim()) for ax in self.axes]
+
+        return self.fig
+
+    def draw_trial(self, data):
+
+        self.title.set_text(data['title'])
+
+        for image, (heatmap, extent) in zip(self.images, data['views']):
+            image.set_data(heatmap)
+            image.set_extent(extent)
+            image.set_norm(self.color_norm(unit_peak(data.get('smooth'), extent, heatmap.shape)))
+
+        tab = data['tab']
+        self.table_front.set_data([tab[2], tab[5]], [tab[7], tab[10]])
+        self.table_side.set_data([tab[0], tab[-3]], [tab[1], tab[-2]])
+        for patch in self.table_patches:
+            update_rect(patch, *table_rect(tab))
+
+        for patch, view in zip(self.bounds_patches, ['front', 'side', 'top', 'top']):
+            update_rect(patch, *bounds_rect(data['bounds'], view))
+
+        if data['part'] is None:
+            for line in self.part_lines:
+                line.set_visible(False)
+        else:
+            for line, (i, x, y) in zip(self.part_lines, part_lines(data['part'])):
+                line.set_data(x, y)
+                line.set_visible(True)
+
+        # Axes fit the new data. Images were flipped when created and this was the easiest fix: every x axis and the
+        # bottom row's y axis are inverted
+        for ax in self.axes:
+            ax.relim(visible_only=True)
+            ax.autoscale_view()
+        for ax in self.axes:
+            if not ax.xaxis_inverted():
+                ax.invert_xaxis()
+        if not self.axes[3].yaxis_inverted():
+            self.axes[3].invert_yaxis()
+        if self.axes[0].yaxis_inverted():
+            self.axes[0].invert_yaxis()
+
+        # Tick labels hardly change size between trials so the layout is only worked out once
+        if not self.laid_out:
+            self.fig.tight_layout()
+            self.laid_out = True
+
+
+def update_rect(patch, xy, width, height):
+    # Moves a rectangle patch
+
+    patch.set_xy(xy)
+    patch.set_width(width)
+    patch.set_height(height)
+
+
+@profiled('plot_heatmap')
+def plot_heatmap(name, care_only=False, show=True, chunk_frames=None, ranges=None, exclude=None, include=None,
+                 zoomable=False, smooth=None):
+    """
+    Main Function. Returns the figure. With show=False the figure is not shown so that it can be saved instead.
+
+    For very long recordings, chunk_frames streams the tracked data in chunks of that many frames to limit memory use.
+    ranges ([x_range, y_range, z_range] in meters) fixes the ranges of the views instead of finding them from the data.
+    exclude and include are lists of BORIS behaviors whose frames are left out of / the only ones used in the heatmap.
+
+    With zoomable=True, zooming into a view with the toolbar re-bins it for the zoomed region, down to the detail of
+    single points (see heatmap_pyramid.py). Can't be used with chunk_frames.
+
+    smooth, in meters, shows a smoothed density instead of raw counts: every view is convolved with a Gaussian of that
+    standard deviation, e.g. smooth=.03 to fill in the sparse feet-only view.
+    """
+
+    with span('heatmap data'):
+        data = heatmap_data(name, care_only=care_only, chunk_frames=chunk_frames, ranges=ranges, exclude=exclude,
+                            include=include, zoomable=zoomable, smooth=smooth)
+    with span('draw'):
+        fig = HeatmapFigure().update(data)
+
+    if show:
+        plt.show()
+
+    return fig
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+"""
+Multi-resolution histograms of one heatmap view, so that zooming into a view doesn't mean re-running the script with
+a new resolution.
+
+A view is binned once at a high base resolution (BASE_RESOLUTION bins a side). Coarser levels are made by adding up
+2x2 blocks of bins, halving the resolution each time, so the level with the default 200 bins a side is the same image
+heatmap.create_heatmap() makes. When a view is zoomed into, the coarsest level that still has at least the asked for
+resolution across the zoomed region is cut out and shown. Once the region is smaller than one level can show at that
+resolution, only the points inside it are binned again at full detail.
+
+To find those points without going through the whole trial, the points are sorted by the base bin they fall in (row by
+row, bins ordered left to right). The points in one row of bins of a region are then one contiguous run of the sorted
+points, found with a binary search, so re-binning a region only touches the points inside it.
+
+    pyramid = HeatmapPyramid(z, y, iz, iy, z_edges, y_edges)
+    heatmap, extent = pyramid.zoom([-.5, .5], [0, 1])
+"""
+
+import numpy as np
+
+
+# Bins a side of the finest level. 8 times the default resolution of the heatmaps, so three levels of block sums lead
+# back to it
+BASE_RESOLUTION = 1600
+
+# Coarsest level kept, in bins a side
+MIN_RESOLUTION = 25
+
+
+class HeatmapPyramid:
+    # Histograms of one view at several resolutions plus the points of the view sorted by bin. h and v are the
+    # coordinates along the horizontal and vertical axis of the view, h_bins and v_bins the base bin of every point (-1
+    # outside of the view, see heatmap.bin_index()) and h_edges and v_edges the base bin edges. select picks out the
+    # points that belong to the view (feet-only)
+
+    def __init__(self, h, v, h_bins, v_bins, h_edges, v_edges, select=None):
+
+        self.h_edges = h_edges
+        self.v_edges = v_edges
+        self.resolution = n = len(h_edges) - 1
+
+        inside = (h_bins >= 0) & (v_bins >= 0)
+        if select is not None:
+            inside &= select
+        keys = v_bins[inside].astype(np.int64) * n + h_bins[inside]
+
+        # Spatial index: points sorted by the base bin they fall in
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.h = h[inside][order]
+        self.v = v[inside][order]
+
+        # Base level then block sums. Counts are kept as integers, which is half the memory of floats
+        counts = np.bincount(self.keys, minlength=n * n).reshape(n, n).astype(np.int32)
+        self.levels = [counts]
+        while counts.shape[0] % 2 == 0 and counts.shape[0] // 2 >= MIN_RESOLUTION:
+            rows, cols = counts.shape
+            counts = counts.reshape(rows // 2, 2, cols // 2, 2).sum(axis=(1, 3))
+            self.levels.append(counts)
+
+    def __len__(self):
+        # Number of points in the view
+
+        return len(self.keys)
+
+    def extent(self):
+
+        return [self.h_edges[0], self.h_edges[-1], self.v_edges[0], self.v_edges[-1]]
+
+    def view(self, resolution=200):
+        # Histogram of the whole view with at least resolution bins a side. Returns (histogram, extent)
+
+        return self.zoom(self.h_edges[[0, -1]], self.v_edges[[0, -1]], resolution)
+
+    def zoom(self, h_lim, v_lim, resolution=200):
+        # Histogram of the region h_lim x v_lim (axis limits, in either order) with at least resolution bins a side
+        # across it. Returns (histogram, extent) ready to be shown as an image, the same as create_heatmap(). The
+        # extent covers whole bins, so it can reach a little past the region
+
+        h_lo, h_hi = clip_region(h_lim, self.h_edges)
+        v_lo, v_hi = clip_region(v_lim, self.v_edges)
+        if h_hi <= h_lo or v_hi <= v_lo:
+            return np.zeros((1, 1)), sorted(h_lim) + sorted(v_lim)  # Region is outside of the view
+
+        # Share of the view the region takes up along each axis
+        h_share = (h_hi - h_lo) / (self.h_edges[-1] - self.h_edges[0])
+        v_share = (v_hi - v_lo) / (self.v_edges[-1] - self.v_edges[0])
+
+        # Coarsest level that still has resolution bins across the region
+        for counts in reversed(self.levels):
+            if min(h_share, v_share) * counts.shape[0] >= resolution:
+                return self.crop(counts, h_lo, h_hi, v_lo, v_hi)
+
+        return self.rebin(h_lo, h_hi, v_lo, v_hi, resolution)
+
+    def crop(self, counts, h_lo, h_hi, v_lo, v_hi):
+        # Bins of a level that cover the region
+
+        n = counts.shape[0]
+        h0, h1 = bin_span(h_lo, h_hi, self.h_edges, n)
+        v0, v1 = bin_span(v_lo, v_hi, self.v_edges, n)
+
+        h_edges = np.linspace(self.h_edges[0], self.h_edges[-1], n + 1)
+        v_edges = np.linspace(self.v_edges[0], self.v_edges[-1], n + 1)
+        return counts[v0:v1, h0:h1].astype(float), [h_edges[h0], h_edges[h1], v_edges[v0], v_edges[v1]]
+
+    def region_points(self, h_lo, h_hi, v_lo, v_hi):
+        # h, v of the points in the base bins that overlap the region. One binary search per row of bins
+
+        n = self.resolution
+        h0, h1 = bin_span(h_lo, h_hi, self.h_edges, n)
+        v0, v1 = bin_span(v_lo, v_hi, self.v_edges, n)
+
+        rows = np.arange(v0, v1, dtype=np.int64) * n
+        starts = np.searchsorted(self.keys, rows + h0, side='left')
+        ends = np.searchsorted(self.keys, rows + h1, side='left')
+
+        # Index of every point of every run, without a python loop over the rows
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        index = offsets + np.arange(lengths.sum())
+
+        return self.h[index], self.v[index]
+
+    def rebin(self, h_lo, h_hi, v_lo, v_hi, resolution):
+        # Bins only the points inside the region, at resolution bins a side
+
+        h, v = self.region_points(h_lo, h_hi, v_lo, v_hi)
+        counts, _, _ = np.histogram2d(v, h, bins=resolution, range=[[v_lo, v_hi], [h_lo, h_hi]])
+
+        return counts, [h_lo, h_hi, v_lo, v_hi]
+
+
+def clip_region(lim, edges):
+    # Sorted axis limits (axes can be inverted) cut down to the range of the view
+
+    lo, hi = sorted(lim)
+    return max(lo, edges[0]), min(hi, edges[-1])
+
+
+def bin_span(lo, hi, edges, n):
+    # First bin and one past the last bin of n equal bins over the range of edges that overlap lo to hi
+
+    width = (edges[-1] - edges[0]) / n
+    first = int(np.clip(np.floor((lo - edges[0]) / width), 0, n - 1))
+    last = int(np.clip(np.ceil((hi - edges[0]) / width), first + 1, n))
+    return first, last
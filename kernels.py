@@ -0,0 +1,145 @@
+"""
+Compiled kernels for the hottest loops of the scripts, used when numba is installed.
+
+The NumPy versions of these loops are chains of whole-array calls (isnan, where, searchsorted, bincount, matmul...),
+each of which makes a temporary array as big as the marker data. The kernels here do the same work in one pass over the
+data without those temporaries:
+
+    fill_nan_mean   nan values of the body-markers replaced with the mean of their frame (cumulative_volume.get_cols)
+    valid_bounds    min/max x, y, z of the points without nan values (heatmap ranges)
+    bin_views       nan points dropped and the four heatmap views binned at once (heatmap.create_heatmap)
+    outside_hull    points outside a convex hull, tested before every ConvexHull (cumulative_volume.CumulativeHull)
+
+Each caller keeps its NumPy version and only uses a kernel when compiled() is True, so numba is optional: without it
+(or with USE_NUMBA = False) everything runs as before. The results are the same, counts and bins exactly and filled
+values up to rounding. Kernels are compiled on first use and the compiled code is cached in __pycache__, so only the
+first run after numba is installed pays for compiling.
+
+    pip install numba
+    python benchmarks/run_benchmarks.py --backend both --only get_cols ongoing_vol plot_heatmap
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Use the kernels when numba is installed. False always uses the NumPy versions, e.g. to compare the two
+USE_NUMBA = True
+
+
+def compiled():
+    # Whether the compiled kernels are used
+
+    return USE_NUMBA and numba is not None
+
+
+if numba is not None:
+
+    @numba.njit(cache=True, error_model='numpy')
+    def fill_nan_mean(body):
+        # (frames * markers, 3) copy of (frames, markers, 3) body-marker data with every nan value replaced with the
+        # mean of the same coordinate over the markers of a frame. As in get_cols(), marker m takes the mean of frame m
+
+        frames, markers, dims = body.shape
+
+        # Means of the first frames only, since only those are used. Summed in the dtype of the data like np.nanmean
+        mean = np.zeros((markers, dims), dtype=body.dtype)
+        for f in range(min(frames, markers)):
+            for d in range(dims):
+                count = 0
+                for m in range(markers):
+                    v = body[f, m, d]
+                    if not np.isnan(v):
+                        mean[f, d] += v
+                        count += 1
+                mean[f, d] = mean[f, d] / count
+
+        data = np.empty((frames * markers, dims), dtype=body.dtype)
+        for f in range(frames):
+            for m in range(markers):
+                for d in range(dims):
+                    v = body[f, m, d]
+                    data[f * markers + m, d] = mean[m, d] if np.isnan(v) else v
+
+        return data
+
+    @numba.njit(cache=True)
+    def valid_bounds(points, keep):
+        # Min and max x, y, z of the points of (frames, markers, 3) marker data that have no nan value, in the frames
+        # where keep is True. Returns the mins, the maxs and the number of points
+
+        lows = np.full(3, np.inf)
+        highs = np.full(3, -np.inf)
+        n = 0
+        for f in range(points.shape[0]):
+            if not keep[f]:
+                continue
+            for m in range(points.shape[1]):
+                x, y, z = points[f, m, 0], points[f, m, 1], points[f, m, 2]
+                if np.isnan(x) or np.isnan(y) or np.isnan(z):
+                    continue
+                lows[0], highs[0] = min(lows[0], x), max(highs[0], x)
+                lows[1], highs[1] = min(lows[1], y), max(highs[1], y)
+                lows[2], highs[2] = min(lows[2], z), max(highs[2], z)
+                n += 1
+
+        return lows, highs, n
+
+    @numba.njit(cache=True)
+    def bin_of(v, edges):
+        # Bin of a value, the same as heatmap.bin_index(): -1 outside of the edges, the last bin includes its right edge
+
+        bins = len(edges) - 1
+        index = np.searchsorted(edges, v, side='right') - 1
+        if v == edges[bins]:
+            index -= 1
+        return index if index < bins else -1
+
+    @numba.njit(cache=True)
+    def bin_views(points, keep, feet, x_edges, y_edges, z_edges):
+        # Histograms of the front (z, y), side (x, y), top (z, x) and feet-only top views of the points of
+        # (frames, markers, 3) marker data that have no nan value, in the frames where keep is True. feet is True for
+        # the feet markers. Returns a (4, resolution, resolution) array of counts and the number of points
+
+        resolution = len(x_edges) - 1
+        counts = np.zeros((4, resolution, resolution))
+        n = 0
+        for f in range(points.shape[0]):
+            if not keep[f]:
+                continue
+            for m in range(points.shape[1]):
+                x, y, z = points[f, m, 0], points[f, m, 1], points[f, m, 2]
+                if np.isnan(x) or np.isnan(y) or np.isnan(z):
+                    continue
+                n += 1
+                ix, iy, iz = bin_of(x, x_edges), bin_of(y, y_edges), bin_of(z, z_edges)
+                if iy >= 0:
+                    if iz >= 0:
+                        counts[0, iy, iz] += 1
+                    if ix >= 0:
+                        counts[1, iy, ix] += 1
+                if ix >= 0 and iz >= 0:
+                    counts[2, ix, iz] += 1
+                    if feet[m]:
+                        counts[3, ix, iz] += 1
+
+        return counts, n
+
+    @numba.njit(cache=True)
+    def outside_hull(points, equations):
+        # True for every point of an (n, 3) array outside the hull with the given Qhull facet equations ([normal,
+        # offset] rows). A point stops being tested at the first facet it is outside of
+
+        outside = np.zeros(len(points), dtype=np.bool_)
+        for i in range(len(points)):
+            x, y, z = points[i, 0], points[i, 1], points[i, 2]
+            for j in range(len(equations)):
+                if equations[j, 0] * x + equations[j, 1] * y + equations[j, 2] * z + equations[j, 3] > 0:
+                    outside[i] = True
+                    break
+
+        return outside
@@ -0,0 +1,315 @@
+"""
+Heatmap and cumulative volume of an MSE trial drawn while BTS is still recording it.
+
+The tracked csv is followed as it grows (or its text is read from a local TCP port), and every refresh only the rows
+appended since the last one are parsed. The new frames are binned into the four heatmap views (heatmap.HeatmapSums) and
+folded into the cumulative hull (cumulative_volume.VolumeCurve), so the cost of a refresh depends on the number of new
+frames and not on how long the recording has been going. The figures are redrawn at a fixed refresh rate.
+
+The ranges of the heatmap views can't be found from data that hasn't been recorded yet, so the views are binned on the
+fixed grid of aggregate_heatmap.py unless other ranges are given. Once the recording has ended (the sender closed the
+connection, or the file stopped growing for --idle seconds) the volume curve is the same as ongoing_vol() gives for the
+finished file.
+
+Examples, from the folder holding 'tracked_data/' and 'volume_data/':
+    python live.py live_data/MVOL_S08_07_APR_RVL_1_tracked.csv
+    python live.py --port 5005 --name MVOL_S08_07_APR_RVL_1 --refresh 4
+
+replay.py stands in for the capture system when testing:
+    python replay.py tracked_data/MVOL_S08_07_APR_RVL_1_tracked.csv --to live_data/MVOL_S08_07_APR_RVL_1_tracked.csv
+"""
+
+import argparse
+import codecs
+import io
+import os
+import socket
+import sys
+import time
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from trial_data import TrialData, TRACKED_SUFFIX, is_header, points_dtype
+from heatmap import HeatmapFigure, HeatmapSums, get_bounds, heatmap_title
+from cumulative_volume import VolumeCurve
+from aggregate_heatmap import GRID_RANGES
+from catalog import parse_name
+
+
+# Redraws per second
+REFRESH_RATE = 2
+
+
+class RowParser:
+    # Turns the text of a tracked csv, given a piece at a time as it is written, into TrialData chunks. Lines before
+    # the column headers are skipped and a row is only parsed once its line is complete
+
+    def __init__(self, float32=None):
+        self.dtype = points_dtype(float32)
+        self.names = None
+        self.partial = ''  # Text after the last line break
+
+    def feed(self, text):
+        # TrialData of the rows completed by text, or None if there are none
+
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+
+        if self.names is None:
+            for i, line in enumerate(lines):
+                if is_header(line):
+                    # Parsed the same way load_trial() parses it, so the columns get the same names
+                    self.names = list(pd.read_csv(io.StringIO(line), skipinitialspace=True, nrows=0).columns)
+                    lines = lines[i + 1:]
+                    break
+            else:
+                return None
+
+        rows = [line for line in lines if line.strip()]
+        if not rows:
+            return None
+
+        df = pd.read_csv(io.StringIO('\n'.join(rows)), names=self.names, header=None, delimiter=',',
+                         skipinitialspace=True)
+        return TrialData.from_frame(df, self.dtype)
+
+
+class FileSource:
+    # Text appended to a tracked csv since the last read(). The file doesn't have to exist yet. With idle, the
+    # recording is taken to have ended once the file hasn't grown for that many seconds
+
+    def __init__(self, path, idle=None):
+        self.path = path
+        self.idle = idle
+        self.file = None
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.last_growth = time.monotonic()
+        self.ended = False
+
+    def read(self):
+
+        if self.file is None:
+            try:
+                self.file = open(self.path, 'rb')
+            except FileNotFoundError:
+                return ''
+
+        data = self.file.read()
+        if data:
+            self.last_growth = time.monotonic()
+        elif self.idle is not None and time.monotonic() - self.last_growth > self.idle:
+            self.close()
+            self.ended = True
+
+        return self.decoder.decode(data, final=self.ended)
+
+    def close(self):
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SocketSource:
+    # Text received from a local TCP port (e.g. replay.py --port) since the last read(). Connects once something is
+    # listening. The recording has ended when the sender closes the connection
+
+    def __init__(self, port, host='localhost'):
+        self.address = (host, port)
+        self.sock = None
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.ended = False
+
+    def read(self):
+
+        if self.ended:
+            return ''
+        if self.sock is None:
+            try:
+                self.sock = socket.create_connection(self.address, timeout=.1)
+            except OSError:
+                return ''  # Nothing listening yet
+            self.sock.setblocking(False)
+
+        chunks = []
+        while True:
+            try:
+                data = self.sock.recv(1 << 20)
+            except BlockingIOError:
+                break
+            if not data:
+                self.close()
+                self.ended = True
+                break
+            chunks.append(data)
+
+        return self.decoder.decode(b''.join(chunks), final=self.ended)
+
+    def close(self):
+
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class LiveTrial:
+    # Heatmap views and volume curve of a trial being recorded, brought up to date by poll()
+
+    def __init__(self, source, name, resolution=200, ranges=GRID_RANGES, calcs_per_second=5, caregiver=False,
+                 float32=None):
+        self.source = source
+        self.name = name
+        self.parser = RowParser(float32)
+        self.sums = HeatmapSums(name, resolution, ranges)
+        self.volume = VolumeCurve(calcs_per_second, caregiver)
+        self.ended = False
+
+        # A trial that is still being recorded usually isn't in the bounding box table yet
+        try:
+            self.bounds = get_bounds(name, parse_name(name).number)
+        except (OSError, KeyError):
+            self.bounds = np.zeros((3, 2))
+
+    def poll(self):
+        # Parses and folds in the rows written since the last poll. Returns the number of new frames
+
+        text = self.source.read()
+        if self.source.ended:
+            text += '\n'  # The last row may not end with a line break
+
+        chunk = self.parser.feed(text)
+        frames = 0
+        if chunk is not None and len(chunk):
+            self.sums.add(chunk)
+            self.volume.add(chunk)
+            frames = len(chunk)
+
+        if self.source.ended and not self.ended:
+            self.volume.finish()
+            self.ended = True
+
+        return frames
+
+    def frames(self):
+
+        return self.sums.frames
+
+    def heatmap_data(self):
+        # heatmap_data() dict of the frames recorded so far, or None before the first frame
+
+        if self.sums.views is None:
+            return None
+        return self.sums.data(heatmap_title(self.name, False) + ' (live)', self.bounds)
+
+
+class LiveFigures:
+    # The heatmap figure and a cumulative volume figure of a LiveTrial, redrawn refresh times a second by a timer of
+    # the heatmap figure's event loop
+
+    def __init__(self, live, resolution=200, refresh=REFRESH_RATE):
+        self.live = live
+        self.heatmap = HeatmapFigure(resolution)
+
+        self.vol_fig, self.vol_ax = plt.subplots(figsize=(9, 3))
+        self.vol_line = self.vol_ax.plot([], [], c='blue')[0]
+        self.vol_ax.set_xlabel('Time (s)')
+        self.vol_ax.set_ylabel('Convex Volume (m^3)')
+
+        self.timer = self.heatmap.fig.canvas.new_timer(interval=int(1000 / refresh))
+        self.timer.add_callback(self.refresh)
+
+    def start(self):
+        self.timer.start()
+
+    def refresh(self):
+        # Folds in the new frames and redraws. Stops the timer once the recording has ended
+
+        ended = self.live.ended
+        if self.live.poll() or self.live.ended != ended:
+            self.draw()
+        if self.live.ended:
+            self.timer.stop()
+            print('Recording ended: %d frames' % self.live.frames())
+
+    def draw(self):
+
+        data = self.live.heatmap_data()
+        if data is None:
+            return
+        self.heatmap.update(data)
+        self.heatmap.fig.canvas.draw_idle()
+
+        self.vol_line.set_data(self.live.volume.time, self.live.volume.vol)
+        self.vol_ax.set_title('%s - %d frames' % (self.live.name, self.live.frames()))
+        self.vol_ax.relim()
+        self.vol_ax.autoscale_view()
+        self.vol_fig.canvas.draw_idle()
+
+
+def trial_name(path):
+    # Trial name of a tracked csv path
+
+    base = os.path.basename(path)
+    if base.endswith(TRACKED_SUFFIX):
+        return base[:-len(TRACKED_SUFFIX)]
+    return os.path.splitext(base)[0]
+
+
+def watch(source, name, resolution=200, ranges=GRID_RANGES, calcs_per_second=5, caregiver=False, refresh=REFRESH_RATE):
+    """
+    Main Function. Shows the heatmap and cumulative volume of a trial while it is being recorded, updated refresh times
+    a second from source (a FileSource or SocketSource). Returns the LiveTrial once the windows are closed.
+    """
+
+    live = LiveTrial(source, name, resolution=resolution, ranges=ranges, calcs_per_second=calcs_per_second,
+                     caregiver=caregiver)
+    figures = LiveFigures(live, resolution=resolution, refresh=refresh)
+    figures.start()
+
+    try:
+        plt.show()
+    finally:
+        source.close()
+
+    return live
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show the heatmap and cumulative volume of a trial while it is being '
+                                                 'recorded.')
+    parser.add_argument('file', nargs='?', help='tracked csv being written')
+    parser.add_argument('--port', type=int, default=None, help='read the csv text from this local TCP port instead')
+    parser.add_argument('--name', default=None, help='trial name (default: from the file name)')
+    parser.add_argument('--refresh', type=float, default=REFRESH_RATE,
+                        help='redraws per second (default %g)' % REFRESH_RATE)
+    parser.add_argument('--idle', type=float, default=None, metavar='SECONDS',
+                        help='take the recording to have ended once the file stops growing for this long')
+    parser.add_argument('--resolution', type=int, default=200, help='bins per heatmap axis (default 200)')
+    parser.add_argument('--ranges', type=float, nargs=6, default=None,
+                        metavar=('XMIN', 'XMAX', 'YMIN', 'YMAX', 'ZMIN', 'ZMAX'),
+                        help='ranges of the views in meters (default the aggregate heatmap grid)')
+    parser.add_argument('--calcs-per-second', type=float, default=5.0,
+                        help='cumulative volume calculations per second of recording (default 5)')
+    parser.add_argument('--caregiver', type=int, choices=[1, 2], default=None,
+                        help='caregiver of a dual caregiver trial whose volume is followed')
+    args = parser.parse_args(argv)
+
+    if (args.file is None) == (args.port is None):
+        parser.error('give either a file or --port')
+    name = args.name or (trial_name(args.file) if args.file else None)
+    if name is None:
+        parser.error('--name is needed with --port')
+    try:
+        parse_name(name)
+    except ValueError as e:
+        parser.error(str(e) + ' (use --name)')
+
+    source = FileSource(args.file, idle=args.idle) if args.file else SocketSource(args.port)
+    ranges = GRID_RANGES if args.ranges is None else [args.ranges[0:2], args.ranges[2:4], args.ranges[4:6]]
+    watch(source, name, resolution=args.resolution, ranges=ranges, calcs_per_second=args.calcs_per_second,
+          caregiver=args.caregiver or False, refresh=args.refresh)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
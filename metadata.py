@@ -0,0 +1,140 @@
+"""
+Loads the manually created tables used alongside the marker data: heart rates ('heartrate_data/HeartRate_<subject>.csv')
+and subject bounding boxes ('volume_data/S<n>_VOL.csv' and 'volume_data/S<n>_VOL_CareOnly.csv').
+
+Each table is read once into NumPy arrays held in a dict keyed by trial, so looking up a trial doesn't re-read the
+whole table. Tables are kept in memory (least recently used are dropped first) and are read again only if the csv
+changes. With PERSIST, the arrays are also saved as a binary .npz file in a 'cache/' folder next to the csv so that
+later runs skip parsing the csv too.
+"""
+
+from functools import lru_cache
+import json
+import os
+import numpy as np
+import pandas as pd
+from trial_data import CACHE_DIR, source_stamp
+
+
+# Save tables as binary .npz files next to the csv's
+PERSIST = True
+
+
+def sidecar_path(file):
+
+    folder, base = os.path.split(file)
+    return os.path.join(folder, CACHE_DIR, os.path.splitext(base)[0] + '.npz')
+
+
+def read_sidecar(file):
+    # Arrays saved for a csv, or None if there are none or the csv has changed since they were saved
+
+    try:
+        with np.load(sidecar_path(file), allow_pickle=False) as saved:
+            if json.loads(str(saved['source'])) != source_stamp(file):
+                return None
+            return {key: saved[key] for key in saved.files}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_sidecar(file, arrays):
+    # Saves arrays for a csv. Written under a temporary name and then renamed so that a half written file is never read
+
+    path = sidecar_path(file)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + '.tmp%d.npz' % os.getpid()
+        np.savez(temp, source=json.dumps(source_stamp(file)), **arrays)
+        os.replace(temp, path)
+    except OSError:
+        pass  # Read-only data folder. The table still works, it just isn't saved
+
+
+def load_table(file, parse):
+    # Arrays of a table, from its sidecar if there is an up to date one, otherwise by parsing the csv with parse()
+
+    arrays = read_sidecar(file) if PERSIST else None
+
+    if arrays is None:
+        arrays = parse(file)
+        if PERSIST:
+            write_sidecar(file, arrays)
+
+    return arrays
+
+
+def parse_heart_rates(file):
+    # Heart rate csv's have three header rows: trial, volume and attempt number, one column per trial. Every column is
+    # stripped of its nan values and all of them are stored end to end in one array, with offsets marking where each
+    # column starts
+
+    df = pd.read_csv(file, index_col=0, header=[0, 1, 2])
+    df = df.loc['1':, :]
+
+    columns = [df.iloc[:, i].values.astype(float) for i in range(df.shape[1])]
+    columns = [hr[~np.isnan(hr)] for hr in columns]
+
+    return {'keys': np.array([[str(level) for level in col] for col in df.columns], dtype=str).reshape(-1, 3),
+            'values': np.concatenate(columns + [np.zeros(0)]),
+            'offsets': np.cumsum([0] + [len(hr) for hr in columns])}
+
+
+def parse_bounds(file):
+    # Bounding box csv's have one row per trial with (among others) the columns Xmin, Ymin, Zmin, Xmax, Ymax, Zmax in
+    # millimeters
+
+    df = pd.read_csv(file, delimiter=',', header=0, index_col=0)
+
+    bounds_np = df.loc[:, 'Xmin':'Zmax'].values.astype(float)
+    bounds_stacked = np.stack((bounds_np[:, :3], bounds_np[:, 3:]), axis=2)
+
+    return {'names': np.array(df.index, dtype=str),
+            'bounds': bounds_stacked/1000}  # Convert from millimeters
+
+
+@lru_cache(maxsize=32)
+def _heart_rates(file, size, mtime):
+
+    arrays = load_table(file, parse_heart_rates)
+    values, offsets = arrays['values'], arrays['offsets']
+    values.flags.writeable = False  # Shared by every caller
+
+    return {tuple(key): values[offsets[i]:offsets[i + 1]] for i, key in enumerate(arrays['keys'])}
+
+
+@lru_cache(maxsize=32)
+def _bounds(file, size, mtime):
+
+    arrays = load_table(file, parse_bounds)
+    arrays['bounds'].flags.writeable = False  # Shared by every caller
+
+    return dict(zip(arrays['names'], arrays['bounds']))
+
+
+def heart_rate_file(subject):
+
+    return 'heartrate_data/HeartRate_' + subject + '.csv'
+
+
+def heart_rates(subject):
+    # Heart rates of a subject as {(scenario, volume, attempt number): heart rate array}
+
+    file = heart_rate_file(subject)
+    stamp = source_stamp(file)
+    return _heart_rates(file, stamp['size'], stamp['mtime'])
+
+
+def volume_file(subject, care_only=False):
+
+    if care_only:
+        return 'volume_data/S' + str(subject) + '_VOL_CareOnly.csv'
+    return 'volume_data/S' + str(subject) + '_VOL.csv'
+
+
+def volume_bounds(subject, care_only=False):
+    # Bounding boxes of a subject as {trial name: [[xmin, xmax], [ymin, ymax], [zmin, zmax]]} in meters
+
+    file = volume_file(subject, care_only)
+    stamp = source_stamp(file)
+    return _bounds(file, stamp['size'], stamp['mtime'])
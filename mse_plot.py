@@ -0,0 +1,321 @@
+"""
+Command line entry point for creating plots of many MSE trials without opening any plotting windows.
+
+Instead of editing the trial list under 'if __name__ == "__main__":' in heatmap.py, eventplot_single.py or
+eventplot_dual.py, trials are picked with glob patterns on the command line. Figures are rendered with the Agg backend and
+saved to an output folder. Trials are spread over a pool of worker processes and a summary of which trials succeeded and
+which failed is printed at the end.
+
+Heatmaps and single caregiver event plots are drawn on figure templates (heatmap.HeatmapFigure and
+eventplot_single.EventFigure): each worker process builds the figure once and only updates its data for every trial it
+renders. --fresh-figures creates a new figure for every trial instead.
+
+--profile records how long each stage of every trial took (see profiling.py), prints it after the trial and saves it
+next to the figure as <figure name>_profile.json.
+
+Examples:
+    python mse_plot.py heatmap --trials 'MVOL_S08_*' --jobs 4 --out plots
+    python mse_plot.py heatmap --trials 'MVOL_S08_07_*' --care-only --format pdf
+    python mse_plot.py events --trials 'MVOL_S08_*' --calcs-per-second 5
+    python mse_plot.py dual --trials 'MVOL_S78_*' --caregivers S07 S08
+
+Trials are looked up in the catalog of the data folders (see catalog.py). Trials that are missing an input the plot
+needs (tracked data, BORIS observation, bounding box) are skipped and listed instead of failing part way through, and
+when several jobs are used the biggest trials are started first.
+
+Like the top-level scripts, this must be run from the folder holding 'tracked_data/', 'boris_data/', 'heartrate_data/'
+and 'volume_data/'.
+"""
+
+import matplotlib
+matplotlib.use('Agg')  # Must be set before pyplot is imported by any of the plotting modules
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+import json
+import os
+import sys
+import time
+import traceback
+import matplotlib.pyplot as plt
+import profiling
+import results_cache
+import trial_data
+from catalog import scan
+
+
+# Figure templates of this process, keyed by command. Created on first use
+templates = {}
+
+
+def required_inputs(command, options):
+    # Inputs (see catalog.INPUTS) a trial needs for a plot. Heart rates, and the tracked data of event plots, are
+    # optional: the plot is drawn without them
+
+    if command == 'heatmap':
+        requires = ['tracked', 'care_only_bounds' if options['care_only'] else 'bounds']
+        if options['care_only'] or options['exclude'] or options['include']:
+            requires.append('observation')
+        return requires
+
+    return ['observation']
+
+
+def find_trials(catalog, command, patterns, options):
+    # Trials matching any of the glob patterns. Returns the sorted names of the trials that have every input the plot
+    # needs, and {name: missing inputs} of the ones that don't
+
+    requires = required_inputs(command, options)
+    missing = {name: catalog.missing(name, requires) for name in catalog.select(patterns)}
+
+    return ([name for name, needs in missing.items() if not needs],
+            {name: needs for name, needs in missing.items() if needs})
+
+
+def output_name(command, trial, options):
+    # File name (without extension) of the saved figure
+
+    if command == 'heatmap':
+        suffix = '_heatmap_care_only' if options['care_only'] else '_heatmap'
+        if options['exclude'] or options['include']:
+            suffix += '_masked'
+        if options['smooth']:
+            suffix += '_smooth%g' % options['smooth']
+    elif command == 'events':
+        suffix = '_events'
+    else:
+        suffix = '_dual'
+    return trial + suffix
+
+
+def get_template(command):
+    # Figure template of this process for a command, created the first time it is needed
+
+    if command not in templates:
+        if command == 'heatmap':
+            from heatmap import HeatmapFigure
+            templates[command] = HeatmapFigure()
+        else:
+            from eventplot_single import EventFigure
+            templates[command] = EventFigure()
+
+    return templates[command]
+
+
+def make_figure(command, trial, options):
+    # Creates the figure of one trial without showing it. Returns the figure and whether it is a template that must be
+    # kept open for the next trial
+
+    reuse = not options['fresh_figures']
+
+    if command == 'heatmap':
+        from heatmap import heatmap_data, plot_heatmap
+        kwargs = {'care_only': options['care_only'], 'chunk_frames': options['chunk_frames'],
+                  'ranges': options['ranges'], 'exclude': options['exclude'], 'include': options['include'],
+                  'smooth': options['smooth']}
+        if reuse:
+            with profiling.span('heatmap data'):
+                data = heatmap_data(trial, **kwargs)
+            with profiling.span('draw'):
+                return get_template(command).update(data), True
+        return plot_heatmap(trial, show=False, **kwargs), False
+
+    if command == 'events':
+        from eventplot_single import event_data, plot_events
+        if reuse:
+            with profiling.span('event data'):
+                data = event_data(trial, calcs_per_second=options['calcs_per_second'])
+            with profiling.span('draw'):
+                return get_template(command).update(data), True
+        return plot_events(trial, calcs_per_second=options['calcs_per_second'], show=False), False
+
+    from eventplot_dual import plot_event
+    top_subject, bottom_subject = options['caregivers']
+    return plot_event(trial, calcs_per_second=options['calcs_per_second'], top_subject=top_subject,
+                      bottom_subject=bottom_subject, show=False), False
+
+
+def close_stray_figures():
+    # Closes every figure except the templates. Used after a trial fails part way through creating a figure
+
+    keep = [template.fig for template in templates.values()]
+    for num in plt.get_fignums():
+        fig = plt.figure(num)
+        if fig not in keep:
+            plt.close(fig)
+
+
+def render(command, trial, options):
+    # Creates and saves the figure of one trial. Runs inside a worker process. Never raises: returns (trial, list of
+    # saved files, error message or None, seconds taken, stage profile as text or None) so that one bad trial doesn't
+    # stop the batch
+
+    start = time.time()
+    profile = None
+    try:
+        trial_data.FLOAT32 = options['float32']
+        results_cache.configure(enabled=options['results_cache'], max_mb=options['results_cache_mb'])
+        with profiling.collect(trial) if options['profile'] else nullcontext() as profile:
+            with profiling.span('make figure'):
+                fig, template = make_figure(command, trial, options)
+            saved = []
+            for fmt in options['formats']:
+                path = os.path.join(options['out'], output_name(command, trial, options) + '.' + fmt)
+                with profiling.span('save ' + fmt):
+                    fig.savefig(path, bbox_inches='tight', dpi=options['dpi'])
+                saved.append(path)
+        if not template:
+            plt.close(fig)
+        if profile is not None:
+            saved.append(save_profile(command, trial, options, profile))
+        return trial, saved, None, time.time() - start, None if profile is None else profile.report()
+
+    except Exception as e:
+        close_stray_figures()
+        message = '%s: %s' % (type(e).__name__, str(e).split('\n')[0])
+        if options['traceback']:
+            message += '\n' + traceback.format_exc()
+        return trial, [], message, time.time() - start, None if profile is None else profile.report()
+
+
+def save_profile(command, trial, options, profile):
+    # Writes the stage profile of a trial as json. Returns its path
+
+    path = os.path.join(options['out'], output_name(command, trial, options) + '_profile.json')
+    with open(path, 'w') as f:
+        json.dump(profile.to_dict(), f, indent=2)
+    return path
+
+
+def run_batch(command, trials, options, jobs=1):
+    # Renders every trial, in worker processes when jobs > 1. Yields results as each trial finishes
+
+    if jobs <= 1:
+        for trial in trials:
+            yield render(command, trial, options)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(render, command, trial, options) for trial in trials]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def print_summary(results):
+    # Per-trial success/failure table. Returns the number of failed trials
+
+    failed = [r for r in results if r[2] is not None]
+
+    print()
+    print('%d trial(s): %d succeeded, %d failed' % (len(results), len(results) - len(failed), len(failed)))
+    for trial, saved, error, seconds, profile in results:
+        status = 'ok    ' if error is None else 'FAILED'
+        detail = ', '.join(saved) if error is None else error
+        print('  %s %-28s %6.1fs  %s' % (status, trial, seconds, detail))
+
+    return len(failed)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='mse_plot.py', description='Create MSE trial plots in batch.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--trials', nargs='+', required=True, metavar='PATTERN',
+                        help="trial names or glob patterns, e.g. 'MVOL_S08_*'")
+    common.add_argument('--jobs', '-j', type=int, default=1, help='number of worker processes (default 1)')
+    common.add_argument('--out', default='plots', help="output folder (default 'plots')")
+    common.add_argument('--format', dest='formats', nargs='+', default=['png'], choices=['png', 'pdf', 'svg'],
+                        help='output format(s) (default png)')
+    common.add_argument('--dpi', type=int, default=100, help='resolution of raster output (default 100)')
+    common.add_argument('--traceback', action='store_true', help='include full tracebacks for failed trials')
+    common.add_argument('--fresh-figures', action='store_true',
+                        help='create a new figure for every trial instead of updating a template')
+    common.add_argument('--profile', action='store_true',
+                        help='time each stage of every trial and save the profiles as json next to the figures')
+    common.add_argument('--no-results-cache', dest='results_cache', action='store_false',
+                        help='recompute volume curves and histograms instead of using the results cache')
+    common.add_argument('--results-cache-mb', type=float, default=results_cache.MAX_MB, metavar='MB',
+                        help='size cap of the results cache (default %d MB)' % results_cache.MAX_MB)
+    common.add_argument('--float32', action='store_true',
+                        help='hold marker data as float32 to halve the memory used by big trials')
+
+    heatmap = subparsers.add_parser('heatmap', parents=[common], help='heatmaps (heatmap.py)')
+    heatmap.add_argument('--care-only', action='store_true', help='remove retrieving/returning periods')
+    heatmap.add_argument('--exclude', nargs='+', default=None, metavar='BEHAVIOR',
+                         help='leave out frames during these BORIS behaviors')
+    heatmap.add_argument('--include', nargs='+', default=None, metavar='BEHAVIOR',
+                         help='only use frames during these BORIS behaviors')
+    heatmap.add_argument('--chunk-frames', type=int, default=None, metavar='N',
+                         help='stream the tracked data in chunks of N frames to limit memory use on long recordings')
+    heatmap.add_argument('--ranges', type=float, nargs=6, default=None,
+                         metavar=('XMIN', 'XMAX', 'YMIN', 'YMAX', 'ZMIN', 'ZMAX'),
+                         help='fixed ranges of the views in meters instead of ranges found from the data')
+    heatmap.add_argument('--smooth', type=float, default=None, metavar='SIGMA',
+                         help='smooth the views with a Gaussian of standard deviation SIGMA meters, e.g. 0.03')
+
+    events = subparsers.add_parser('events', parents=[common], help='single caregiver event plots '
+                                                                    '(eventplot_single.py)')
+    events.add_argument('--calcs-per-second', type=float, default=5.0,
+                        help='cumulative volume calculations per second (default 5)')
+
+    dual = subparsers.add_parser('dual', parents=[common], help='dual caregiver event plots (eventplot_dual.py)')
+    dual.add_argument('--calcs-per-second', type=float, default=3.0,
+                      help='cumulative volume calculations per second (default 3)')
+    dual.add_argument('--caregivers', nargs=2, default=['S07', 'S08'], metavar=('TOP', 'BOTTOM'),
+                      help='subjects acting as caregiver 1 and caregiver 2, as tracked in BTS (default S07 S08)')
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    options = {'out': args.out, 'formats': args.formats, 'dpi': args.dpi, 'traceback': args.traceback,
+               'fresh_figures': args.fresh_figures, 'float32': args.float32, 'profile': args.profile,
+               'results_cache': args.results_cache, 'results_cache_mb': args.results_cache_mb,
+               'care_only': getattr(args, 'care_only', False),
+               'chunk_frames': getattr(args, 'chunk_frames', None),
+               'exclude': getattr(args, 'exclude', None),
+               'include': getattr(args, 'include', None),
+               'ranges': None if getattr(args, 'ranges', None) is None else [args.ranges[0:2], args.ranges[2:4],
+                                                                             args.ranges[4:6]],
+               'smooth': getattr(args, 'smooth', None),
+               'calcs_per_second': getattr(args, 'calcs_per_second', None),
+               'caregivers': getattr(args, 'caregivers', None)}
+
+    catalog = scan()
+    trials, skipped = find_trials(catalog, args.command, args.trials, options)
+    for trial, needs in sorted(skipped.items()):
+        print('skipped %s - no %s' % (trial, ', '.join(needs)))
+    if not trials:
+        print('No trials to plot match ' + ' '.join(args.trials))
+        return 1
+
+    # Biggest trials first so that a big one isn't left running on its own at the end
+    if args.jobs > 1:
+        trials.sort(key=catalog.size, reverse=True)
+
+    os.makedirs(args.out, exist_ok=True)
+
+    print('Rendering %d trial(s) with %d job(s)' % (len(trials), args.jobs))
+
+    results = []
+    for result in run_batch(args.command, trials, options, jobs=args.jobs):
+        trial, saved, error, seconds, profile = result
+        print(('done   ' if error is None else 'failed ') + trial)
+        if profile is not None:
+            print(profile + '\n')
+        results.append(result)
+
+    failed = print_summary(results)
+    if skipped:
+        print('%d trial(s) skipped for missing inputs' % len(skipped))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,171 @@
+import os
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 
 
+class Observation:
+    # Observations made in BORIS for one trial. Every behavior (state) is stored, per subject and for all subjects
+    # together, as sorted NumPy arrays of start and stop times so that questions like "which interval of a behavior
+    # contains time t" or "which state contains the interval [a, b]" are answered with a binary search instead of a scan
+    # over every event. Assumes, like the BORIS exports used in Fall 2018, that the events of a behavior alternate
+    # start, stop, start, stop...
+
+    def __init__(self, time, subject, behavior):
+        self.time = np.asarray(time, dtype=float)
+        self.subject = np.asarray(subject, dtype=object)
+        self.behavior = np.asarray(behavior, dtype=object)
+        self._tables = {}
+
+    def _table(self, subject=None):
+        # {behavior: event times in file order} for one subject, or for all subjects if subject is None. Worked out once
+        # per subject by sorting the events by behavior instead of scanning every event for every behavior
+
+        if subject not in self._tables:
+            if subject is None:
+                rows = np.arange(len(self.time))
+            else:
+                rows = np.flatnonzero(self.subject == subject)
+
+            names, codes = np.unique(self.behavior[rows].astype(str), return_inverse=True)
+            order = rows[np.argsort(codes, kind='stable')]
+            bounds = np.searchsorted(np.sort(codes), np.arange(len(names) + 1))
+
+            self._tables[subject] = {name: self.time[order[bounds[i]:bounds[i + 1]]] for i, name in enumerate(names)}
+
+        return self._tables[subject]
+
+    def behaviors(self, subject=None):
+        # Sorted names of the behaviors observed for a subject (or for anyone if subject is None)
+
+        return sorted(self._table(subject))
+
+    def times(self, behavior, subject=None):
+        # Start/stop times of a behavior as a flat array [start, stop, start, stop...]
+
+        return self._table(subject)[behavior]
+
+    def intervals(self, behavior, subject=None):
+        # All intervals of a behavior. Returns arrays of start and stop times, sorted by start
+
+        times = self.times(behavior, subject)
+        n = len(times) // 2
+        starts = times[0:2 * n:2]
+        stops = times[1:2 * n:2]
+        order = np.argsort(starts, kind='stable')
+        return starts[order], stops[order]
+
+    def at(self, t, behavior, subject=None):
+        # Which interval of a behavior contains each time in t. Returns the index of the interval (as ordered by
+        # intervals()) or -1 where no interval contains the time
+
+        starts, stops = self.intervals(behavior, subject)
+        t = np.asarray(t, dtype=float)
+
+        index = np.searchsorted(starts, t, side='right') - 1
+        found = index >= 0
+        found[found] = stops[index[found]] >= t[found]
+        return np.where(found, index, -1)
+
+    def containing(self, a, b, behaviors, subject=None):
+        # Which state contains each interval [a, b]. Returns, for each interval, the position in behaviors of the first
+        # behavior with an interval that contains it, or -1 if none does
+
+        a = np.atleast_1d(np.asarray(a, dtype=float))
+        b = np.atleast_1d(np.asarray(b, dtype=float))
+        result = np.full(len(a), -1)
+
+        for i, behavior in enumerate(behaviors):
+            # The only interval of the behavior that can contain [a, b] is the last one starting at or before a
+            starts, stops = self.intervals(behavior, subject)
+            index = np.searchsorted(starts, a, side='right') - 1
+            inside = index >= 0
+            inside[inside] = stops[index[inside]] >= b[inside]
+            result[(result == -1) & inside] = i
+
+        return result
+
+    def frame_mask(self, time, behaviors, subject=None, next_time=np.inf):
+        # Boolean mask over the frames of a time vector, True during any interval of any of the behaviors. See
+        # interval_mask()
+
+        intervals = [self.intervals(behavior, subject) for behavior in behaviors]
+        starts = np.concatenate([start for start, stop in intervals] + [[]])
+        stops = np.concatenate([stop for start, stop in intervals] + [[]])
+
+        return interval_mask(time, starts, stops, next_time)
+
+    def keep_mask(self, time, exclude=(), include=None, subject=None, next_time=np.inf):
+        # Boolean mask over the frames of a time vector of the frames to keep: frames during any of the include behaviors
+        # (every frame if include is None) that are not during any of the exclude behaviors
+
+        if include is None:
+            keep = np.ones(len(time), dtype=bool)
+        else:
+            keep = self.frame_mask(time, include, subject, next_time)
+
+        if exclude:
+            keep &= ~self.frame_mask(time, exclude, subject, next_time)
+
+        return keep
+
+
+def interval_mask(time, starts, stops, next_time=np.inf):
+    # Boolean mask of the frames inside any of the periods [starts[i], stops[i]], found with a binary search of the sorted
+    # time vector instead of a scan per period. Frames are marked the same way that heatmap.remove_reach() always has:
+    # from the last frame before the start to the last frame before the stop. next_time is the time of the frame
+    # following the last one in time, for when time is one chunk of a longer recording.
+
+    time_next = np.append(time, next_time)
+    first = np.maximum(np.searchsorted(time_next, starts) - 1, 0)
+    last = np.searchsorted(time, stops)
+    keep = first < last
+
+    change = np.zeros(len(time) + 1, dtype=int)
+    np.add.at(change, first[keep], 1)
+    np.add.at(change, last[keep], -1)
+
+    return np.cumsum(change[:-1]) > 0
+
+
+def observation_file(name):
+
+    return 'boris_data/' + name + '.csv'
+
+
+@lru_cache(maxsize=8)
+def _read_observation(file, size, mtime):
+    # Parsed BORIS file. Size and modification time are part of the cache key so that an edited file is read again
+
+    df = pd.read_csv(file, header=15, delimiter=',', skipinitialspace=True,
+                     encoding="utf-8-sig")[['Time', 'Subject', 'Behavior']]
+
+    return Observation(df['Time'].values, df['Subject'].values, df['Behavior'].values)
+
+
+def load_observation(name):
+    # Load observations made in BORIS as an Observation. Each BORIS file is only parsed once, so the single plot, dual
+    # plot and remove_reach all share one parse
+
+    file = observation_file(name)
+    stat = os.stat(file)
+    return _read_observation(file, stat.st_size, stat.st_mtime_ns)
+
+
 def get_observation(name, specified_subject=False):
     # Load observations made in BORIS. Returns list containing names of all the states and list containing start/stop
     # times of all the states
 
-    file = 'boris_data/' + name + '.csv'
-    df = pd.read_csv(file, header=15, delimiter=',', skipinitialspace=True,
-                     encoding="utf-8-sig")[['Time', 'Subject', 'Behavior']]
+    observation = load_observation(name)
 
     # Specified subject == 'None' when plot for single caregiver trial is being created. In that case, all the BORIS
     # data applies to the plot. However, in dual caregiver trials, a subject has to be specified so that just the
     # relevant data can be pulled from the BORIS observation.
-    if specified_subject:
-        data = df.loc[df['Subject'] == specified_subject][['Time', 'Behavior']]
-    else:
-        data = df.loc[:, ['Time', 'Behavior']]
-
-    states = np.unique(data.values[:, 1])  # Get name of states. np.unique() avoids duplicates
+    subject = specified_subject if specified_subject else None
 
-    temp_list = data.values.tolist()
-    
-    values = sorted(set(map(lambda x: x[1], temp_list)))
-    time_list = [[y[0] for y in temp_list if y[1] == x] for x in values]
+    states = observation.behaviors(subject)
+    time_list = [observation.times(state, subject).tolist() for state in states]
 
     # Format of states: [state, state, state, state...]
     # Format of time_list: [[start_time, stop_time], [start_time, stop_time, start_time, stop_time... ]... ]
-    return states.tolist(), time_list
+    return states, time_list
@@ -0,0 +1,170 @@
+"""
+Stage-level timing and memory of the plotting pipeline.
+
+The stages of plot_heatmap(), plot_events(), plot_event() and ongoing_vol() (reading the csv, masking behaviors,
+removing nan's, growing the hull, binning, drawing...) are wrapped in spans:
+
+    with span('binning') as s:
+        views = create_heatmap(...)
+        s.rows = len(x)
+
+or, for a whole function, @profiled('cumulative volume'). Every span records its wall time, CPU time, the peak resident
+memory (RSS) of the process when it ended, how much that peak grew during the span and, if the code sets it, how many
+rows (frames, points...) it worked on. Spans nest, so a stage is reported under the stage it ran in.
+
+Profiling is off unless enable() is called. When it is off, span() hands back one shared object that does nothing and
+@profiled functions just call through, so the spans can stay in the code. mse_plot.py turns it on with --profile and
+writes one profile per trial:
+
+    with collect(trial) as profile:
+        plot_heatmap(trial, show=False)
+    print(profile.report())
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+ENABLED = False
+
+# Profile that spans are recorded in (None outside of collect()), and the names of the spans currently open
+_profile = None
+_stack = []
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+
+def peak_rss():
+    # High-water mark of the resident memory of this process in MB, or None where it can't be read
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes everywhere else
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class Span:
+    # One timed stage. rows can be set inside the with block
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        _stack.append(self.name)
+        self.path = '/'.join(_stack)
+        self.profile = _profile
+        if self.profile is not None:
+            # Place kept in start order, filled in when the span ends
+            self.index = len(self.profile.spans)
+            self.profile.spans.append(None)
+        self.rss_start = peak_rss()
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        rss = peak_rss()
+        _stack.pop()
+
+        if self.profile is not None:
+            self.profile.spans[self.index] = {'stage': self.path, 'depth': self.path.count('/'), 'wall_s': wall,
+                                              'cpu_s': cpu, 'peak_rss_mb': rss,
+                                              'rss_growth_mb': None if rss is None else rss - self.rss_start,
+                                              'rows': None if self.rows is None else int(self.rows)}
+        return False
+
+
+class NullSpan:
+    # Stand-in for Span when profiling is off
+
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, key, value):
+        pass  # Shared by every disabled span, so nothing is kept
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name):
+    # Context manager timing a stage. Does nothing unless profiling is enabled
+
+    if not ENABLED:
+        return NULL_SPAN
+    return Span(name)
+
+
+def profiled(name):
+    # Decorator timing every call of a function as a stage
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Profile:
+    # Spans recorded for one trial, in the order they started so that each stage is followed by the stages inside it
+
+    def __init__(self, trial):
+        self.trial = trial
+        self.spans = []
+
+    def to_dict(self):
+        return {'trial': self.trial, 'stages': self.spans}
+
+    def report(self):
+        # Text table of the stages
+
+        lines = ['%-40s %9s %9s %11s %11s %10s' % ('stage (' + self.trial + ')', 'wall s', 'cpu s', 'peak MB',
+                                                   'growth MB', 'rows')]
+        for s in self.spans:
+            name = '  ' * s['depth'] + s['stage'].rsplit('/', 1)[-1]
+            lines.append('%-40s %9.3f %9.3f %11s %11s %10s' % (
+                name[:40], s['wall_s'], s['cpu_s'], fmt(s['peak_rss_mb']), fmt(s['rss_growth_mb']),
+                '' if s['rows'] is None else s['rows']))
+        return '\n'.join(lines)
+
+
+def fmt(mb):
+    return '' if mb is None else '%.1f' % mb
+
+
+@contextmanager
+def collect(trial):
+    # Records the spans of everything run inside the with block into a new Profile. Turns profiling on for the block
+
+    global _profile
+    previous, was_enabled = _profile, ENABLED
+    _profile = Profile(trial)
+    enable()
+    try:
+        yield _profile
+    finally:
+        _profile = previous
+        enable(was_enabled)
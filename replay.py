@@ -0,0 +1,134 @@
+"""
+Stands in for the capture system when testing live.py: writes out a recorded tracked csv again as if BTS were recording
+it, either appended to a file or sent to whoever connects to a local TCP port.
+
+The lines above the rows (BTS metadata and the column headers) are written first, then the rows are written in batches
+as their times come up, --speed times faster than they were recorded. Every batch is flushed, so a reader following the
+file sees it grow the way a recording does, including the last line of a batch being cut off part way when --split is
+given.
+
+Examples, from the folder holding 'tracked_data/':
+    python replay.py tracked_data/MVOL_S08_07_APR_RVL_1_tracked.csv --to live_data/MVOL_S08_07_APR_RVL_1_tracked.csv
+    python replay.py tracked_data/MVOL_S08_07_APR_RVL_1_tracked.csv --port 5005 --speed 4
+"""
+
+import argparse
+import os
+import socket
+import sys
+import time
+from trial_data import find_header, DEFAULT_HEADER
+
+
+# Batches written per second
+BATCH_RATE = 10
+
+
+def read_recording(file):
+    # The text above the rows, and the rows with their times. Rows are kept as the lines of the file
+
+    header = find_header(file)
+    if header is None:
+        header = DEFAULT_HEADER
+
+    with open(file, encoding='utf-8-sig', newline='') as f:
+        lines = f.readlines()
+
+    head = ''.join(lines[:header + 1])
+    columns = [field.strip() for field in lines[header].split(',')]
+    time_column = columns.index('Time')
+
+    rows = [line for line in lines[header + 1:] if line.strip()]
+    times = [float(row.split(',')[time_column]) for row in rows]
+
+    return head, rows, times
+
+
+def replay(file, write, speed=1.0, rate=BATCH_RATE, split=False):
+    # Writes the recording in file through write() (which gets text) in real time divided by speed. With split the
+    # last row of every batch is written in two parts, the second with the next batch
+
+    head, rows, times = read_recording(file)
+    write(head)
+
+    start = time.monotonic()
+    sent = 0
+    carried = ''
+    while sent < len(rows):
+        time.sleep(1 / rate)
+        elapsed = (time.monotonic() - start) * speed
+        stop = sent
+        while stop < len(rows) and times[stop] - times[0] <= elapsed:
+            stop += 1
+        if stop == sent:
+            continue
+
+        text = carried + ''.join(rows[sent:stop])
+        carried = ''
+        if split and stop < len(rows):
+            cut = len(text) - len(rows[stop - 1]) // 2
+            text, carried = text[:cut], text[cut:]
+        write(text)
+        sent = stop
+
+    if carried:
+        write(carried)
+
+    return len(rows)
+
+
+def to_file(path):
+    # write() appending to a new file, flushed every batch
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    f = open(path, 'w', encoding='utf-8', newline='')
+
+    def write(text):
+        f.write(text)
+        f.flush()
+
+    return f, write
+
+
+def to_port(port, host='localhost'):
+    # write() sending to the first reader that connects to the port. Waits for it
+
+    server = socket.create_server((host, port))
+    print('Waiting for a reader on port %d' % port)
+    connection, _ = server.accept()
+    server.close()
+
+    def write(text):
+        connection.sendall(text.encode('utf-8'))
+
+    return connection, write
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recorded tracked csv as if it were being recorded.')
+    parser.add_argument('file', help='recorded tracked csv')
+    parser.add_argument('--to', default=None, metavar='FILE', help='file to write the recording into (overwritten)')
+    parser.add_argument('--port', type=int, default=None, help='local TCP port to send the recording to')
+    parser.add_argument('--speed', type=float, default=1.0, help='times faster than real time (default 1)')
+    parser.add_argument('--rate', type=float, default=BATCH_RATE,
+                        help='batches written per second (default %g)' % BATCH_RATE)
+    parser.add_argument('--split', action='store_true', help='cut the last row of every batch in two')
+    args = parser.parse_args(argv)
+
+    if (args.to is None) == (args.port is None):
+        parser.error('give either --to or --port')
+
+    output, write = to_file(args.to) if args.to else to_port(args.port)
+    try:
+        rows = replay(args.file, write, speed=args.speed, rate=args.rate, split=args.split)
+    finally:
+        output.close()
+
+    print('Replayed %d rows' % rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Disk cache of derived results (cumulative volume curves, heatmap histograms) so that re-rendering a plot after a style
+change doesn't redo the expensive parts.
+
+A result is stored under a key made from a hash of the contents of every input file plus the parameters that change the
+result, so an entry can never be used for data or settings it wasn't made from: edit a csv or change a parameter and
+the result is simply worked out again under a new key. Content hashes of the input files are remembered by size and
+modification time so that unchanged files aren't read again just to be hashed.
+
+Entries are pickle files in 'results_cache/' next to the data folders. The folder is kept under MAX_MB by deleting the
+least recently used entries, and can be deleted at any time.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+
+# Set to False to always recompute
+ENABLED = True
+
+# Folder holding the entries, relative to the folder the scripts are run from
+CACHE_DIR = 'results_cache'
+
+# Size cap of the folder in MB
+MAX_MB = 500
+
+# Bumped whenever a change to the code changes results, so that older entries are no longer used
+RESULTS_VERSION = 1
+
+# Content hashes of input files, keyed by (path, size, modification time)
+_hashes = {}
+
+
+def configure(enabled=None, folder=None, max_mb=None):
+
+    global ENABLED, CACHE_DIR, MAX_MB
+    if enabled is not None:
+        ENABLED = enabled
+    if folder is not None:
+        CACHE_DIR = folder
+    if max_mb is not None:
+        MAX_MB = max_mb
+
+
+def file_hash(path):
+    # sha256 of a file's contents. Raises FileNotFoundError (like reading the file would) if it doesn't exist
+
+    stat = os.stat(path)
+    stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    if stamp not in _hashes:
+        index = read_index()
+        known = index.get(stamp[0])
+        if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime_ns:
+            _hashes[stamp] = known['sha256']
+        else:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(2**20), b''):
+                    digest.update(block)
+            _hashes[stamp] = digest.hexdigest()
+            index[stamp[0]] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': _hashes[stamp]}
+            write_json(os.path.join(CACHE_DIR, 'hashes.json'), index)
+
+    return _hashes[stamp]
+
+
+def read_index():
+    # Content hashes saved by earlier runs, as {absolute path: {'size', 'mtime', 'sha256'}}
+
+    try:
+        with open(os.path.join(CACHE_DIR, 'hashes.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json(path, data):
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + '.tmp%d' % os.getpid()
+        with open(temp, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp, path)
+    except OSError:
+        pass  # Read-only folder. Files are just hashed again next run
+
+
+def result_key(kind, files, params):
+    # Key of a result: what was calculated, the contents of the files it was calculated from and the parameters used
+
+    description = {'kind': kind, 'version': RESULTS_VERSION, 'files': [file_hash(file) for file in files],
+                   'params': params}
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def entry_path(key):
+
+    return os.path.join(CACHE_DIR, key[:2], key + '.pkl')
+
+
+def load(key):
+    # Cached result of a key, or None. Marks the entry as recently used
+
+    path = entry_path(key)
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return result
+
+
+def store(key, result):
+    # Saves a result, then evicts the least recently used entries if the cache has grown past MAX_MB
+
+    path = entry_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + '.tmp%d' % os.getpid()
+        with open(temp, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+    except OSError:
+        return  # Read-only folder. The result is still returned, it just isn't kept
+
+    evict()
+
+
+def entries():
+    # (last used, size, path) of every entry
+
+    found = []
+    for folder, dirs, names in os.walk(CACHE_DIR):
+        for name in names:
+            if name.endswith('.pkl'):
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Removed by another process
+                found.append((stat.st_mtime, stat.st_size, path))
+    return found
+
+
+def evict(max_mb=None):
+    # Deletes the least recently used entries until the cache is under max_mb (MAX_MB by default)
+
+    limit = (MAX_MB if max_mb is None else max_mb) * 2**20
+    found = sorted(entries())
+    total = sum(size for used, size, path in found)
+
+    for used, size, path in found:
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def lookup(kind, files, params):
+    # Cached result for these input files and parameters, or None if there isn't one (or the cache is off)
+
+    if not ENABLED:
+        return None
+    return load(result_key(kind, files, params))
+
+
+def cached(kind, files, params, compute):
+    # Returns the result of compute() for these input files and parameters, from the cache if it has been worked out
+    # before. params must be json serializable (anything else is turned into its str())
+
+    if not ENABLED:
+        return compute()
+
+    key = result_key(kind, files, params)
+    result = load(key)
+    if result is None:
+        result = compute()
+        store(key, result)
+    return result
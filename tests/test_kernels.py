@@ -0,0 +1,95 @@
+"""
+Checks that the compiled kernels of kernels.py give the same results as the NumPy versions they stand in for, on a short
+synthetic trial (benchmarks/synthetic.py). Skipped when numba isn't installed.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+from scipy.spatial import ConvexHull
+
+numba = pytest.importorskip('numba')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import kernels
+import heatmap
+from trial_data import load_trial, tracked_file
+from synthetic import make_dataset
+
+
+@pytest.fixture(scope='module')
+def trial(tmp_path_factory):
+    # A 5 second trial with markers dropping out often enough for every frame mean to skip some
+
+    folder = tmp_path_factory.mktemp('synthetic')
+    name = make_dataset(str(folder), duration=5, frame_rate=100, body_markers=20, nan_rate=.1)
+    return load_trial(os.path.join(str(folder), tracked_file(name)), use_cache=False)
+
+
+@pytest.fixture
+def keep(trial):
+    # Frames kept, about three quarters of them
+
+    return np.random.default_rng(0).random(len(trial)) < .75
+
+
+def test_fill_nan_mean(trial):
+
+    body = trial.caregiver(False)
+    row, col = body.shape[:2]
+    assert np.isnan(body).any()
+
+    mean = np.nanmean(body[:col], axis=1)
+    expected = np.where(np.isnan(body), mean[None, :col], body).reshape(row * col, 3)
+
+    np.testing.assert_allclose(kernels.fill_nan_mean(body), expected, rtol=1e-12)
+
+
+def test_valid_bounds(trial, keep):
+
+    x, y, z, feet = heatmap.valid_points(trial, keep)
+    lows, highs, points = kernels.valid_bounds(trial.points, keep)
+
+    assert points == len(x)
+    np.testing.assert_array_equal(lows, [x.min(), y.min(), z.min()])
+    np.testing.assert_array_equal(highs, [x.max(), y.max(), z.max()])
+
+
+@pytest.mark.parametrize('shrink', [0, .3])
+def test_bin_views(trial, keep, monkeypatch, shrink):
+    # With shrink the ranges are cut down so that some points fall outside of the views
+
+    x, y, z, feet = heatmap.valid_points(trial, keep)
+    ranges = heatmap.view_ranges(x.min(), x.max(), y.min(), y.max(), z.min(), z.max())
+    ranges = [[low + shrink * (high - low) / 2, high - shrink * (high - low) / 2] for low, high in ranges]
+
+    monkeypatch.setattr(kernels, 'USE_NUMBA', True)
+    views, points, _ = heatmap.bin_views(trial, keep, 50, ranges)
+    monkeypatch.setattr(kernels, 'USE_NUMBA', False)
+    expected_views, expected_points, _ = heatmap.bin_views(trial, keep, 50, ranges)
+
+    assert points == expected_points
+    for (counts, extent), (expected_counts, expected_extent) in zip(views, expected_views):
+        np.testing.assert_array_equal(counts, expected_counts)
+        np.testing.assert_allclose(extent, expected_extent)
+
+
+def test_outside_hull(trial):
+    # The hull of the first points, tested with every point. Its vertices lie on its facets, where the sums of the
+    # kernel and the matrix product round differently, so points that close to a facet are left out
+
+    points = kernels.fill_nan_mean(trial.caregiver(False))
+    equations = ConvexHull(points[:200]).equations
+    distances = points @ equations[:, :3].T + equations[:, 3]
+    expected = np.any(distances > 0, axis=1)
+
+    outside = kernels.outside_hull(points, equations)
+    clear = np.all(np.abs(distances) > 1e-9, axis=1)
+    assert outside[clear].any() and not outside[clear].all()
+    np.testing.assert_array_equal(outside[clear], expected[clear])
@@ -0,0 +1,371 @@
+"""
+Loads the tracked marker data of an MSE trial. Marker data has been obtained from the BTS system, tracked in BTS SMART
+tracker, exported as .emt, and saved as .csv, and stored in 'tracked_data/'.
+
+The csv is parsed once per trial into a TrialData object. The header row and the marker names are sniffed from the file
+itself, so files with or without the 'f' suffix on the marker names (TAB1f.X vs TAB1.X) are handled the same way. All
+marker data is held as a single (frames, markers, 3) array and the marker groups that the plots need (body, feet, table,
+frame, each caregiver) are sliced out of it only when they are first asked for.
+
+heatmap.py, cumulative_volume.py and the eventplot scripts all go through load_trial() so a trial that is needed by
+several functions in one run is only read from disk once.
+
+Parsing the text csv is by far the slowest part of loading a trial, so the first load of a trial also writes its marker
+data to a binary cache in 'tracked_data/cache/'. Later runs open the cached arrays with np.memmap instead of parsing the
+csv, so nothing is read until it is used. A cache entry is rebuilt whenever the size or modification time of its csv
+changes. The cache folder can be deleted at any time.
+
+Every marker group and every function that uses the marker data works on views of the one (frames, markers, 3) array
+rather than on copies of it. With FLOAT32 (or float32=True) the marker positions are held as float32 instead of float64,
+which halves the memory used by big trials. Times are always kept as float64.
+"""
+
+from functools import lru_cache
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# Substrings that are only found in the names of feet markers (for the moment)
+FEET_TYPES = ['HEE', 'ANM', 'ANL', 'TOT']
+
+# The four markers on the top of the frame used to draw the partitions
+PART_MARKERS = ['FRM9', 'FRM10', 'FRM11', 'FRM12']
+
+# Row of the column headers in the .emt exports used during Fall 2018. Only used if the header can't be found
+DEFAULT_HEADER = 10
+
+# Tracked marker data of a trial is 'tracked_data/<trial name>_tracked.csv'
+TRACKED_SUFFIX = '_tracked.csv'
+
+# Name of the folder, next to the tracked csv's, that holds the binary cache
+CACHE_DIR = 'cache'
+
+# Bumped whenever the layout of the cache files changes so that old entries are rebuilt
+CACHE_VERSION = 1
+
+# Default for the float32 argument of load_trial() and iter_chunks(). Positions are in millimeters/meters so float32 still
+# keeps well under a micrometer of precision
+FLOAT32 = False
+
+
+def find_header(file, max_lines=100):
+    # Finds the row of the csv holding the column headers. BTS puts a block of metadata above the headers whose length
+    # isn't guaranteed, so the header is taken to be the first row with a 'Time' column followed by marker columns.
+    # Returns the number of lines to skip before the header
+
+    with open(file, encoding='utf-8-sig') as f:
+        for i, line in enumerate(f):
+            if i >= max_lines:
+                break
+            if is_header(line):
+                return i
+
+    return None
+
+
+def is_header(line):
+    # Whether a line of a tracked csv is its column headers: a 'Time' column followed by marker columns
+
+    fields = [field.strip() for field in line.split(',')]
+    return 'Time' in fields and any(field.endswith('.X') for field in fields)
+
+
+class TrialData:
+    # Marker data for one trial. time is the (frames,) time vector and points is the (frames, markers, 3) array of x, y,
+    # z marker positions. markers holds the marker names with any 'f' suffix removed and columns holds the original
+    # column names from the csv in the same order as points.reshape(frames, -1).
+
+    def __init__(self, time, points, columns):
+        self.time = time
+        self.points = points
+        self.columns = list(columns)
+        self.filtered = all(col.split('.')[0].endswith('f') for col in self.columns)
+        self.markers = [marker_name(col, self.filtered) for col in self.columns[0::3]]
+        self._blocks = {}
+
+    @classmethod
+    def from_csv(cls, file, dtype=float):
+        # Parses a tracked csv. Frame and Time are the first two columns, followed by x, y, z columns for every marker
+
+        trial = cls.from_frame(read_csv(file), dtype)
+
+        # Arrays are shared between every function that loads this trial, so they are made read only to keep one caller
+        # from changing another's data
+        trial.time.flags.writeable = False
+        trial.points.flags.writeable = False
+
+        return trial
+
+    @classmethod
+    def from_frame(cls, df, dtype=float):
+        # TrialData from a DataFrame of (part of) a tracked csv. Marker positions are stored as dtype
+
+        # Drops 'Frame', 'Time' and any empty column created by a trailing comma
+        columns = [col for col in df.columns if col[-2:] in ('.X', '.Y', '.Z')]
+
+        time = df['Time'].values.astype(float)
+        values = df[columns].to_numpy(dtype=dtype)
+        points = values.reshape(len(time), -1, 3)
+
+        return cls(time, points, columns)
+
+    def __len__(self):
+        return len(self.time)
+
+    def astype(self, dtype):
+        # The same trial with marker positions stored as dtype. Returns self if they already are
+
+        if self.points.dtype == dtype:
+            return self
+
+        points = self.points.astype(dtype)
+        points.flags.writeable = self.points.flags.writeable
+        return TrialData(self.time, points, self.columns)
+
+    def index(self, marker):
+        # Returns the position of a marker in points. marker is given without the 'f' suffix
+
+        return self.markers.index(marker)
+
+    def block(self, name):
+        # Returns the (frames, markers, 3) data for a group of markers. Groups made of consecutive markers (which is all of
+        # them in the usual marker order) are views into points, anything else is a copy. The block is worked out on the
+        # first call and kept.
+
+        if name not in self._blocks:
+            self._blocks[name] = self.points[:, self._select(name)]
+
+        return self._blocks[name]
+
+    def _select(self, name):
+        # Marker selection (slice or list of indices) for each group
+
+        if name == 'all':
+            return slice(None)
+
+        if name in ('body', 'caregiver1'):
+            # Assumes markers are ordered body-markers, then frame, then table. Or, if there was no frame, body-markers,
+            # then table.
+            try:
+                boundary = self.index('FRM1')
+            except ValueError:
+                boundary = self.index('TAB1')
+            return slice(0, boundary)
+
+        if name == 'caregiver2':
+            # Only for dual caregiver trials. Assumes that markers are ordered first caregiver markers, followed by
+            # table markers, followed by second caregiver markers.
+            return slice(self.index('TAB4') + 1, None)
+
+        if name == 'feet':
+            return as_slice([i for i, marker in enumerate(self.markers) if any(ftype in marker for ftype in FEET_TYPES)])
+
+        if name == 'table':
+            return as_slice([i for i, marker in enumerate(self.markers) if 'TAB' in marker])
+
+        if name == 'frame':
+            return as_slice([i for i, marker in enumerate(self.markers) if 'FRM' in marker])
+
+        if name == 'part':
+            return as_slice([self.index(marker) for marker in PART_MARKERS])
+
+        raise KeyError(name)
+
+    @property
+    def body(self):
+        return self.block('body')
+
+    @property
+    def feet(self):
+        return self.block('feet')
+
+    @property
+    def table(self):
+        return self.block('table')
+
+    @property
+    def frame(self):
+        return self.block('frame')
+
+    @property
+    def part(self):
+        return self.block('part')
+
+    def caregiver(self, caregiver):
+        # Body-marker block of one caregiver. caregiver is False or 1 for the first (or only) caregiver, 2 for the second
+
+        if caregiver == 2:
+            return self.block('caregiver2')
+        return self.block('caregiver1')
+
+    def marker_mask(self, name):
+        # Boolean array over the markers, True for the markers in a group
+
+        mask = np.zeros(len(self.markers), dtype=bool)
+        mask[self._select(name)] = True
+        return mask
+
+    def column_names(self, name):
+        # Original csv column names belonging to a group of markers
+
+        selection = self._select(name)
+        markers = range(len(self.markers))[selection] if isinstance(selection, slice) else selection
+        return [self.columns[3*i + j] for i in markers for j in range(3)]
+
+    def frame_data(self, name='all'):
+        # Group of markers as a DataFrame with the time as its index. Columns are the original csv column names
+
+        block = self.block(name)
+        return pd.DataFrame(block.reshape(len(self), -1), index=self.time, columns=self.column_names(name))
+
+
+def as_slice(indices):
+    # Turns a list of consecutive increasing marker indices into a slice, so that the block is a view instead of a copy
+
+    if indices and list(indices) == list(range(indices[0], indices[-1] + 1)):
+        return slice(indices[0], indices[-1] + 1)
+    return indices
+
+
+def read_csv(file, chunksize=None):
+    # Reads a tracked csv as a DataFrame, or as an iterator of DataFrames of chunksize rows
+
+    header = find_header(file)
+    if header is None:
+        return pd.read_csv(file, header=DEFAULT_HEADER, delimiter=',', skipinitialspace=True, encoding="utf-8-sig",
+                           chunksize=chunksize)
+
+    return pd.read_csv(file, skiprows=header, header=0, delimiter=',', skipinitialspace=True, encoding="utf-8-sig",
+                       chunksize=chunksize)
+
+
+def marker_name(col, filtered):
+    # 'TAB1f.X' -> 'TAB1' when the file uses the 'f' suffix, 'TAB1.X' -> 'TAB1' otherwise
+
+    name = col.split('.')[0]
+    if filtered:
+        name = name[:-1]
+    return name
+
+
+def cache_paths(file):
+    # Paths of the three cache files for a tracked csv: marker array, time vector and a json file holding the marker
+    # names and the size/modification time of the csv the cache was built from
+
+    folder, base = os.path.split(file)
+    stem = os.path.join(folder, CACHE_DIR, os.path.splitext(base)[0])
+    return stem + '.points.npy', stem + '.time.npy', stem + '.json'
+
+
+def source_stamp(file):
+    # Size and modification time of a file. Used to tell whether a cache entry is out of date
+
+    stat = os.stat(file)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def read_cache(file):
+    # Returns the cached TrialData for a tracked csv, or None if there is no cache entry or the csv has changed since the
+    # entry was written. Arrays are memory mapped read only.
+
+    points_file, time_file, meta_file = cache_paths(file)
+
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta['version'] != CACHE_VERSION or meta['source'] != source_stamp(file):
+            return None
+
+        points = np.load(points_file, mmap_mode='r')
+        time = np.load(time_file, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return TrialData(time, points, meta['columns'])
+
+
+def write_cache(file, trial, source):
+    # Writes a TrialData to the cache. source is the source_stamp() of the csv taken before it was parsed, so that a csv
+    # that grew while it was being parsed (one still being recorded) doesn't get an entry pairing its new size with the
+    # old rows. Each file is written under a temporary name and then renamed so that a run that is interrupted (or
+    # another process loading the same trial) never sees half a cache entry. The json file is written last since
+    # read_cache() treats it as the marker of a complete entry.
+
+    points_file, time_file, meta_file = cache_paths(file)
+    os.makedirs(os.path.dirname(meta_file), exist_ok=True)
+
+    meta = {'version': CACHE_VERSION, 'source': source, 'columns': trial.columns}
+
+    for path, array in ((points_file, trial.points), (time_file, trial.time)):
+        temp = path + '.tmp%d' % os.getpid()
+        with open(temp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(temp, path)
+
+    temp = meta_file + '.tmp%d' % os.getpid()
+    with open(temp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(temp, meta_file)
+
+
+def points_dtype(float32=None):
+    # dtype of the marker positions. float32 of None means use FLOAT32
+
+    if float32 is None:
+        float32 = FLOAT32
+    return np.dtype(np.float32 if float32 else np.float64)
+
+
+def iter_chunks(file, chunk_frames=10000, float32=None):
+    # Yields a trial as a series of TrialData objects of at most chunk_frames frames each, for recordings too long to
+    # hold in memory at once. If the trial is in the binary cache, chunks are slices of the memory mapped arrays.
+    # Otherwise the csv is parsed chunk by chunk (and no cache entry is written, since that would need the whole trial).
+
+    dtype = points_dtype(float32)
+    trial = read_cache(file)
+
+    if trial is not None:
+        for start in range(0, len(trial), chunk_frames):
+            stop = start + chunk_frames
+            yield TrialData(trial.time[start:stop], trial.points[start:stop], trial.columns).astype(dtype)
+        return
+
+    for df in read_csv(file, chunksize=chunk_frames):
+        yield TrialData.from_frame(df, dtype)
+
+
+def tracked_file(name):
+
+    return 'tracked_data/' + name + TRACKED_SUFFIX
+
+
+def load_trial(file, use_cache=True, float32=None):
+    # Returns the TrialData for a tracked csv. The last couple of trials are kept in memory so the heatmap, cumulative
+    # volume and event plot functions all share one load of the file. With use_cache the binary cache is used (and
+    # created if needed) instead of parsing the csv every run. float32 picks the dtype of the marker positions, see
+    # FLOAT32. Trials in memory are keyed on the size and modification time of the csv, so a csv that changes (is
+    # exported again, or is still being recorded) is loaded again.
+
+    stamp = source_stamp(file)
+    return _load_trial(file, stamp['size'], stamp['mtime'], use_cache, points_dtype(float32))
+
+
+@lru_cache(maxsize=2)
+def _load_trial(file, size, mtime, use_cache, dtype):
+
+    if not use_cache:
+        return TrialData.from_csv(file, dtype)
+
+    # The cache always holds float64 so that it can serve either dtype. A float32 trial is a copy of it in memory,
+    # half the size of the float64 data
+    trial = read_cache(file)
+    if trial is None:
+        trial = TrialData.from_csv(file)
+        try:
+            write_cache(file, trial, {'size': size, 'mtime': mtime})
+        except OSError:
+            pass  # Read-only data folder. The trial is still usable, it just won't be cached
+
+    return trial.astype(dtype)